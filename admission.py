@@ -0,0 +1,159 @@
+"""
+Contrôle d'admission : débit par client et par classe de route coûteuse
+
+Chaque route coûteuse appartient à une classe de coût (auth, upload, sign,
+bulk, preview) ; chaque client (utilisateur connecté, sinon adresse IP)
+dispose d'un seau de jetons par classe, rempli au débit RATE_LIMIT_<CLASSE>
+(« 60/min ») jusqu'à sa capacité. Une requête prend un jeton (ou un jeton par
+Mo annoncé pour les envois de fichiers) ; si le seau est vide, elle est
+refusée tout de suite en 429 avec Retry-After, avant la lecture du corps,
+bcrypt ou toute analyse de PDF. Les seaux sont partagés par tous les workers
+dans une petite base SQLite locale (ADMISSION_DB, distincte de la base
+principale) ; en cas d'erreur de cette base, la requête est admise.
+
+Le plafond global du travail PDF (tous workers confondus) est appliqué par
+executors.SlotPool, au moment de lancer la tâche.
+"""
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify, request
+
+import metrics
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+ADMISSION_DB = os.environ.get('ADMISSION_DB') or os.path.join(tempfile.gettempdir(), 'signature-admission.db')
+ADMISSION_RETENTION_SECONDS = 3600  # Seau inutilisé depuis une heure : plein, donc inutile de le garder
+
+# Débit par défaut de chaque classe : « N/s », « N/min » ou « N/h » (N = capacité du seau)
+DEFAULT_RATES = {
+    'auth': '10/min',      # Connexion, inscription (bcrypt), par IP
+    'upload': '120/min',   # 1 jeton + 1 par Mo annoncé
+    'sign': '60/min',      # Signature simple ou multiple
+    'bulk': '2000/h',      # 1 jeton + 1 par Mo annoncé
+    'preview': '600/min',  # Rendu de pages
+}
+PERIODS = {'s': 1, 'sec': 1, 'min': 60, 'h': 3600}
+MEGABYTE = 1024 * 1024
+
+def parse_rate(value):
+    """(capacité, jetons par seconde) d'un débit « N/période » ; lève ValueError"""
+    count, _, period = value.strip().partition('/')
+    capacity = float(count)
+    if capacity <= 0 or period.strip() not in PERIODS:
+        raise ValueError(f'Débit invalide : {value}')
+    return capacity, capacity / PERIODS[period.strip()]
+
+RATES = {name: parse_rate(os.environ.get(f'RATE_LIMIT_{name.upper()}', default))
+         for name, default in DEFAULT_RATES.items()}
+
+class BucketStore:
+    """Seaux de jetons partagés entre processus (table SQLite, une connexion par thread)"""
+
+    def __init__(self, path=ADMISSION_DB):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        # Connexion propre au thread et au processus (jamais héritée d'un fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=OFF')  # Seaux perdus au plus en cas de crash : sans gravité
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, capacity, rate, cost):
+        """Retire cost jetons du seau key ; retourne 0 si admis, sinon l'attente en secondes"""
+        cost = min(cost, capacity)  # Une requête plus chère que le seau passe quand il est plein
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def purge(self, max_age=ADMISSION_RETENTION_SECONDS):
+        """Supprime les seaux inutilisés depuis max_age secondes ; retourne leur nombre"""
+        conn = self._connect()
+        return conn.execute('DELETE FROM buckets WHERE updated < ?', (time.time() - max_age,)).rowcount
+
+store = BucketStore()
+
+def client_identity():
+    """Utilisateur connecté (posé par login_optional/login_required), sinon adresse IP"""
+    user = getattr(request, 'current_user', None)
+    if user:
+        return f"user:{user['id']}"
+    return f'ip:{request.remote_addr}'
+
+def admit(cost_class, cost=1, identity=None):
+    """Prélève cost jetons pour le client courant ; retourne 0 si admis, sinon Retry-After"""
+    capacity, rate = RATES[cost_class]
+    key = f'{cost_class}:{identity or client_identity()}'
+    try:
+        wait = store.take(key, capacity, rate, cost)
+    except sqlite3.Error as e:
+        print(f"Contrôle d'admission indisponible ({e}) : requête admise")
+        return 0
+    if not wait:
+        return 0
+    metrics.inc('signature_throttled_total', cost_class=cost_class)
+    return max(1, math.ceil(wait))
+
+def by_size(req):
+    """Coût d'un envoi de fichier : 1 jeton + 1 par Mo annoncé (Content-Length)"""
+    return 1 + (req.content_length or 0) / MEGABYTE
+
+def too_many_requests(retry_after):
+    response = jsonify({'error': f'Trop de requêtes, réessayez dans {retry_after} s'})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def limit(cost_class, cost=1):
+    """Décorateur : 429 + Retry-After si le seau cost_class du client est vide
+
+    À placer sous login_optional/login_required pour compter par utilisateur ;
+    cost est un nombre de jetons ou une fonction de la requête (by_size).
+    """
+    if cost_class not in RATES:
+        raise ValueError(f'Classe de coût inconnue : {cost_class}')
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if ADMISSION_ENABLED:
+                retry_after = admit(cost_class, cost(request) if callable(cost) else cost)
+                if retry_after:
+                    return too_many_requests(retry_after)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
@@ -1,76 +1,114 @@
-from flask import Flask, request, jsonify, send_file, render_template, session
+from flask import Flask, Response, request, jsonify, send_file, render_template, session
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 import os
-from datetime import datetime
+import json
+import base64
+import hmac
+import ipaddress
+import math
+import time
 import uuid
 from functools import wraps
-import requests  # Pour vérifier reCAPTCHA
 try:
-    from PyPDF2 import PdfReader, PdfWriter
+    from PyPDF2 import PdfReader
 except ImportError:
-    from PyPDF2 import PdfFileReader as PdfReader, PdfFileWriter as PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from PIL import Image
-import io
-import base64
+    from PyPDF2 import PdfFileReader as PdfReader
 
 # Import de la gestion de base de données
+import admission
+import bulk
 import database as db
+import delivery
+import executors
+import jobs
+import maintenance
+import metrics
+import pdf_engine
+import previews
+import recaptcha
+import signatures as signature_store
+import uploads
+from storage import UploadStore
 
 app = Flask(__name__)
+app.request_class = uploads.IngestRequest
 CORS(app, supports_credentials=True)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production-' + str(uuid.uuid4()))
 
-# Configuration reCAPTCHA
-RECAPTCHA_SECRET_KEY = os.environ.get('RECAPTCHA_SECRET_KEY', '')
+# Derrière Traefik : adresse du client lue dans X-Forwarded-For (limitation de débit par IP)
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', '0'))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
 
+# Vérification reCAPTCHA (session persistante, cache des tokens, disjoncteur)
 def verify_recaptcha(token):
     """Vérifie le token reCAPTCHA v3"""
-    if not RECAPTCHA_SECRET_KEY:
-        # Si pas de clé configurée, on accepte (mode dev)
-        return True
-    
-    try:
-        response = requests.post(
-            'https://www.google.com/recaptcha/api/siteverify',
-            data={
-                'secret': RECAPTCHA_SECRET_KEY,
-                'response': token
-            },
-            timeout=5
-        )
-        result = response.json()
-        
-        # reCAPTCHA v3 retourne un score de 0.0 à 1.0
-        # Score > 0.5 = probablement humain
-        # Score < 0.5 = probablement bot
-        if result.get('success') and result.get('score', 0) >= 0.5:
-            return True
-        
-        print(f"reCAPTCHA failed: score={result.get('score', 0)}")
-        return False
-    except Exception as e:
-        print(f"Erreur vérification reCAPTCHA: {e}")
-        # En cas d'erreur, on accepte pour ne pas bloquer les vrais users
-        return True
+    return recaptcha.verify(token)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 SIGNED_FOLDER = 'signed'
-SIGNATURE_FOLDER = 'signatures'
 ALLOWED_EXTENSIONS = {'pdf'}
 
-for folder in [UPLOAD_FOLDER, SIGNED_FOLDER, SIGNATURE_FOLDER]:
+for folder in [UPLOAD_FOLDER, SIGNED_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
+uploads.IngestRequest.ingest_folder = UPLOAD_FOLDER
+uploads.IngestRequest.ingest_max_bytes = app.config['MAX_CONTENT_LENGTH']
+uploads.IngestRequest.allowed_extensions = ALLOWED_EXTENSIONS
+uploads.IngestRequest.bulk_paths = frozenset({'/api/sign/bulk'})
+uploads.IngestRequest.bulk_max_bytes = bulk.BULK_MAX_BYTES
+upload_store = UploadStore(UPLOAD_FOLDER)
+signed_files = delivery.SignedFileDelivery(SIGNED_FOLDER)
+BATCH_MAX_PLACEMENTS = int(os.environ.get('BATCH_MAX_PLACEMENTS', '2000'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # Jeton des routes de supervision (/metrics...)
+PREVIEW_MAX_AGE = 24 * 3600  # Les prévisualisations d'un file_id ne changent jamais
 
 # Initialiser la base de données
 db.init_db()
 
+# Nettoyage périodique (sessions expirées, uploads et PDF anonymes périmés)
+janitor = maintenance.Janitor(upload_store, SIGNED_FOLDER)
+
+@app.before_request
+def start_background_tasks():
+    """Démarre le thread de nettoyage dans chaque worker (un seul l'exécute à la fois)"""
+    maintenance.start_scheduler(janitor)
+
+@app.before_request
+def start_request_timer():
+    request.started_at = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Durée et statut de la requête, par route (gabarit de l'URL, pas l'URL elle-même)"""
+    started_at = getattr(request, 'started_at', None)
+    route = request.url_rule.rule if request.url_rule else 'inconnue'
+    if started_at is not None:
+        metrics.observe('signature_http_request_duration_seconds', time.perf_counter() - started_at,
+                        route=route, method=request.method)
+    metrics.inc('signature_http_requests_total', route=route, method=request.method,
+                status=str(response.status_code))
+    return response
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """Réponse JSON quand un upload dépasse la taille maximale"""
+    max_bytes = request.max_content_length or app.config['MAX_CONTENT_LENGTH']
+    max_mb = max_bytes // (1024 * 1024)
+    return jsonify({'error': f'Fichier trop volumineux (maximum {max_mb} Mo)'}), 413
+
+@app.errorhandler(executors.Saturated)
+def executor_saturated(e):
+    """Réponse 503 quand le pool de calcul (PDF ou bcrypt) est saturé"""
+    response = jsonify({'error': 'Serveur surchargé, réessayez dans quelques secondes'})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -101,11 +139,39 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def is_internal_request():
+    """Requête de supervision autorisée : jeton METRICS_TOKEN, ou appel direct depuis le réseau interne
+
+    Sans jeton configuré, seul un appel depuis une adresse locale ou privée qui
+    n'est pas passé par le proxy (pas de X-Forwarded-For) est accepté : une
+    requête publique relayée par Traefik porte toujours cet en-tête.
+    """
+    if METRICS_TOKEN:
+        token = request.headers.get('Authorization', '')
+        return hmac.compare_digest(token.encode(), f'Bearer {METRICS_TOKEN}'.encode())
+    if 'X-Forwarded-For' in request.headers:
+        return False
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_private
+
+def internal_required(f):
+    """Décorateur pour les routes de supervision (métriques, statistiques internes)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not is_internal_request():
+            return jsonify({'error': 'Accès réservé à la supervision'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 # ============================================
 # ROUTES D'AUTHENTIFICATION
 # ============================================
 
 @app.route('/api/register', methods=['POST'])
+@admission.limit('auth')
 def register():
     """Inscription d'un nouvel utilisateur"""
     data = request.get_json()
@@ -140,6 +206,7 @@ def register():
     })
 
 @app.route('/api/login', methods=['POST'])
+@admission.limit('auth')
 def login():
     """Connexion d'un utilisateur"""
     data = request.get_json()
@@ -221,8 +288,9 @@ def account_page():
 
 @app.route('/api/upload', methods=['POST'])
 @login_optional
+@admission.limit('upload', cost=admission.by_size)
 def upload_file():
-    """Upload un fichier PDF"""
+    """Upload un fichier PDF (reçu en flux : haché, borné et vérifié pendant l'écriture)"""
     if 'file' not in request.files:
         return jsonify({'error': 'Aucun fichier fourni'}), 400
     
@@ -231,131 +299,429 @@ def upload_file():
         return jsonify({'error': 'Nom de fichier vide'}), 400
     
     if file and allowed_file(file.filename):
+        stream = file.stream
+        with metrics.stage('upload_receive'):
+            stream.finish()
+        if stream.rejected:
+            return jsonify({'error': stream.rejected}), 400
+        
         filename = secure_filename(file.filename)
         unique_filename = f"{uuid.uuid4()}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(filepath)
+        sha256 = stream.hexdigest()
+        
+        blob = upload_store.find(sha256)
+        if blob:
+            # Contenu déjà connu : ni écriture ni analyse, on réutilise ses métadonnées
+            stream.close()
+            num_pages = blob['num_pages']
+            pages = json.loads(blob['geometry'])
+        else:
+            # Nombre de pages lu dans l'arbre des pages (/Count) et géométrie des
+            # pages, sur le fichier partiel encore ouvert : aucune relecture
+            try:
+                with metrics.stage('upload_parse'):
+                    pdf_reader = PdfReader(stream.file)
+                    num_pages = pdf_engine.page_count(pdf_reader)
+                    if num_pages < 1:
+                        raise ValueError('document sans page')
+                    geometry = pdf_engine.compute_geometry(pdf_reader)
+            except Exception as e:
+                print(f"PDF rejeté ({file.filename}): {e}")
+                return jsonify({'error': 'PDF illisible ou corrompu'}), 400
+            
+            with metrics.stage('upload_store'):
+                filepath = upload_store.store(stream, sha256)
+            pdf_engine.cache_geometry(filepath, geometry)
+            previews.remember_digest(filepath, sha256)
+            pages = [pdf_engine.geometry_as_dict(page) for page in geometry]
         
-        # Obtenir le nombre de pages
-        pdf_reader = PdfReader(filepath)
-        num_pages = len(pdf_reader.pages)
+        user_id = request.current_user['id'] if request.current_user else None
+        upload_store.register(unique_filename, sha256, stream.size, num_pages, pages, filename, user_id)
+        metrics.observe('signature_pdf_bytes', stream.size, kind='upload')
+        metrics.observe('signature_pdf_pages', num_pages, kind='upload')
         
         return jsonify({
             'success': True,
             'file_id': unique_filename,
             'filename': filename,
-            'num_pages': num_pages
+            'num_pages': num_pages,
+            'pages': pages
         })
     
     return jsonify({'error': 'Type de fichier non autorisé'}), 400
 
+def parse_placement(values, signature):
+    """Placement à partir des champs d'une requête (page, x, y, width, height) ; lève ValueError"""
+    try:
+        page = int(values.get('page', 0))
+        box = [float(values.get(name, default))
+               for name, default in (('x', 400), ('y', 50), ('width', 150), ('height', 75))]
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError('Placement invalide')
+    if not all(math.isfinite(value) for value in box):
+        raise ValueError('Placement invalide')
+    return pdf_engine.Placement(page, *box, signature)
+
+def wants_async(data):
+    """La signature doit-elle passer par la file d'attente ? ("async": true ou ?async=1)"""
+    return bool(data.get('async')) or request.args.get('async') in ('1', 'true')
+
+def enqueue_signing(user_id, file_id, input_path, signed_path, placements, images):
+    """Met une signature en file d'attente et répond 202 avec l'identifiant du job"""
+    try:
+        job_id = jobs.enqueue(user_id, file_id, input_path, signed_path, placements, images)
+    except jobs.QueueFull:
+        response = jsonify({'error': 'File de signature saturée, réessayez plus tard'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/jobs/{job_id}'
+    }), 202
+
 @app.route('/api/sign', methods=['POST'])
 @login_optional
+@admission.limit('sign')
 def sign_pdf():
     """Ajoute une signature au PDF"""
     data = request.get_json()
     
     file_id = data.get('file_id')
     signature_data = data.get('signature')  # Base64 image data
-    position = data.get('position', {})
-    page_num = data.get('page', 0)
+    signature_id = data.get('signature_id')  # Ou signature sauvegardée (connexion requise)
+    position = data.get('position') or {}
     
-    if not file_id or not signature_data:
+    if not file_id or not (signature_data or signature_id is not None):
         return jsonify({'error': 'Données manquantes'}), 400
+    if not isinstance(position, dict):
+        return jsonify({'error': 'Placement invalide'}), 400
+    
+    # Position de la signature (par défaut en bas à droite)
+    try:
+        placement = parse_placement({**position, 'page': data.get('page', 0)}, 'signature')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    page_num = placement.page
     
     try:
         # Chemins des fichiers
-        input_path = os.path.join(UPLOAD_FOLDER, file_id)
-        if not os.path.exists(input_path):
+        input_path = upload_store.resolve(file_id)
+        if not input_path:
             return jsonify({'error': 'Fichier non trouvé'}), 404
         
-        # Sauvegarder la signature
-        signature_filename = f"{uuid.uuid4()}.png"
-        signature_path = os.path.join(SIGNATURE_FOLDER, signature_filename)
+        if signature_data:
+            # Décoder l'image base64 (traitée en mémoire, sans fichier temporaire)
+            with metrics.stage('decode_signature'):
+                signature_image = pdf_engine.decode_signature(signature_data)
+        else:
+            if not request.current_user:
+                return jsonify({'error': 'Authentification requise pour les signatures sauvegardées'}), 401
+            signature_image = signature_store.load(signature_id, request.current_user['id'])
+            if not signature_image:
+                return jsonify({'error': 'Signature non trouvée'}), 404
         
-        # Décoder l'image base64
-        image_data = signature_data.split(',')[1] if ',' in signature_data else signature_data
-        image_bytes = base64.b64decode(image_data)
+        # Sauvegarder le PDF signé (mise à jour incrémentale de la seule page signée)
+        signed_filename = f"signed_{file_id}"
+        signed_path = os.path.join(SIGNED_FOLDER, signed_filename)
         
-        with open(signature_path, 'wb') as f:
-            f.write(image_bytes)
+        # Ajouter à l'historique si l'utilisateur est connecté
+        user_id = None
+        if hasattr(request, 'current_user') and request.current_user:
+            user_id = request.current_user['id']
         
-        # Créer le PDF avec la signature
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=letter)
+        if wants_async(data):
+            return enqueue_signing(user_id, file_id, input_path, signed_path,
+                                   [placement], {'signature': signature_image})
         
-        # Position de la signature (par défaut en bas à droite)
-        x = position.get('x', 400)
-        y = position.get('y', 50)
-        width = position.get('width', 150)
-        height = position.get('height', 75)
+        # Durée vue du worker (attente du pool comprise) ; le détail des étapes
+        # (sign_read, sign_embed...) est mesuré dans le processus de calcul
+        with metrics.stage('sign'):
+            result = executors.run('pdf', pdf_engine.stamp, input_path, signed_path, [placement], {'signature': signature_image})
         
-        can.drawImage(signature_path, x, y, width=width, height=height, mask='auto')
-        can.save()
+        original_filename = file_id.split('_', 1)[1] if '_' in file_id else file_id
+        with metrics.stage('history'):
+            db.add_to_history(user_id, original_filename, signed_filename, signed_path, page_num)
         
-        # Fusionner avec le PDF original
-        packet.seek(0)
-        signature_pdf = PdfReader(packet)
-        existing_pdf = PdfReader(input_path)
-        output = PdfWriter()
+        response = {
+            'success': True,
+            'signed_file_id': signed_filename,
+            'message': 'PDF signé avec succès'
+        }
+        if result.optimization:
+            response['optimization'] = result.optimization
+        return jsonify(response)
+    
+    except (IndexError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except executors.Saturated:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/sign/batch', methods=['POST'])
+@login_optional
+@admission.limit('sign')
+def sign_pdf_batch():
+    """Ajoute plusieurs signatures (plusieurs pages) au PDF en une seule passe
+
+    Corps attendu :
+    {
+        "file_id": "...",
+        "signatures": {"paraphe": "data:image/png;base64,..."},
+        "placements": [
+            {"page": 0, "x": 400, "y": 50, "width": 150, "height": 75, "signature": "paraphe"},
+            {"page": 1, "x": 400, "y": 50, "signature_id": 12}
+        ]
+    }
+    Un placement référence soit une clé de "signatures", soit une signature
+    sauvegardée ("signature_id", connexion requise). Avec "async": true, la
+    signature est mise en file d'attente (réponse 202, suivi via /api/jobs/<job_id>).
+    """
+    data = request.get_json()
+    
+    file_id = data.get('file_id')
+    signatures = data.get('signatures') or {}
+    placements_data = data.get('placements') or []
+    
+    if not file_id or not placements_data:
+        return jsonify({'error': 'Données manquantes'}), 400
+    if len(placements_data) > BATCH_MAX_PLACEMENTS:
+        return jsonify({'error': f'Maximum {BATCH_MAX_PLACEMENTS} placements par requête'}), 400
+    
+    input_path = upload_store.resolve(file_id)
+    if not input_path:
+        return jsonify({'error': 'Fichier non trouvé'}), 404
+    
+    user_id = None
+    if hasattr(request, 'current_user') and request.current_user:
+        user_id = request.current_user['id']
+    
+    # Résolution des signatures référencées (chaque image n'est décodée qu'une fois)
+    sources = {}
+    placements = []
+    for item in placements_data:
+        if not isinstance(item, dict):
+            return jsonify({'error': 'Placement invalide'}), 400
+        if item.get('signature_id') is not None:
+            if not user_id:
+                return jsonify({'error': 'Authentification requise pour les signatures sauvegardées'}), 401
+            key = f"saved:{item['signature_id']}"
+            if key not in sources:
+                saved = signature_store.load(item['signature_id'], user_id)
+                if not saved:
+                    return jsonify({'error': 'Signature non trouvée'}), 404
+                sources[key] = saved
+        else:
+            key = item.get('signature')
+            if key not in signatures:
+                return jsonify({'error': f'Signature inconnue : {key}'}), 400
+            sources[key] = signatures[key]
         
-        for i, page in enumerate(existing_pdf.pages):
-            if i == page_num:
-                page.merge_page(signature_pdf.pages[0])
-            output.add_page(page)
+        try:
+            placements.append(parse_placement(item, key))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    try:
+        # Les signatures sauvegardées sont déjà chargées, les autres sont des data URL
+        with metrics.stage('decode_signature'):
+            images = {
+                key: source if isinstance(source, pdf_engine.SignatureImage) else pdf_engine.decode_signature(source)
+                for key, source in sources.items()
+            }
         
-        # Sauvegarder le PDF signé
         signed_filename = f"signed_{file_id}"
         signed_path = os.path.join(SIGNED_FOLDER, signed_filename)
+        if wants_async(data):
+            return enqueue_signing(user_id, file_id, input_path, signed_path, placements, images)
         
-        with open(signed_path, 'wb') as output_file:
-            output.write(output_file)
-        
-        # Nettoyer
-        os.remove(signature_path)
-        
-        # Ajouter à l'historique si l'utilisateur est connecté
-        user_id = None
-        if hasattr(request, 'current_user') and request.current_user:
-            user_id = request.current_user['id']
+        with metrics.stage('sign'):
+            result = executors.run('pdf', pdf_engine.stamp, input_path, signed_path, placements, images)
         
         original_filename = file_id.split('_', 1)[1] if '_' in file_id else file_id
-        db.add_to_history(user_id, original_filename, signed_filename, signed_path, page_num)
+        first_page = min(placement.page for placement in placements)
+        with metrics.stage('history'):
+            db.add_to_history(user_id, original_filename, signed_filename, signed_path, first_page)
         
-        return jsonify({
+        response = {
             'success': True,
             'signed_file_id': signed_filename,
+            'signatures_applied': len(placements),
+            'pages_signed': len({placement.page for placement in placements}),
             'message': 'PDF signé avec succès'
-        })
+        }
+        if result.optimization:
+            response['optimization'] = result.optimization
+        return jsonify(response)
     
+    except (IndexError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except executors.Saturated:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/sign/bulk', methods=['POST'])
+@login_required
+@admission.limit('bulk', cost=admission.by_size)
+def sign_pdf_bulk():
+    """Signe plusieurs PDF (ou une archive ZIP de PDF) avec la même signature
+
+    Formulaire multipart :
+    - files : un ou plusieurs PDF et/ou archives ZIP ;
+    - signature_id (signature sauvegardée) ou signature (data URL) ;
+    - page ('last' par défaut, 'first', 'all' ou numéro 0-indexé, négatif
+      depuis la fin), anchor ('bottom-right' par défaut, 'bottom-left',
+      'top-right', 'top-left', 'center'), width, height et margin en points.
+
+    La réponse est une archive ZIP envoyée en flux : chaque PDF signé y est
+    ajouté dès qu'il est prêt, puis rapport.json détaille le résultat de
+    chaque document. Les documents signés en masse ne sont pas ajoutés à
+    l'historique.
+    """
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify({'error': 'Aucun fichier fourni'}), 400
+    
+    try:
+        rule = bulk.parse_rule(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    signature_id = request.form.get('signature_id')
+    signature_data = request.form.get('signature')
+    if signature_id:
+        signature_image = signature_store.load(signature_id, request.current_user['id'])
+        if not signature_image:
+            return jsonify({'error': 'Signature non trouvée'}), 404
+    elif signature_data:
+        try:
+            with metrics.stage('decode_signature'):
+                signature_image = pdf_engine.decode_signature(signature_data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        return jsonify({'error': 'Données manquantes'}), 400
+    
+    job = bulk.BulkJob(UPLOAD_FOLDER, app.config['MAX_CONTENT_LENGTH'])
+    try:
+        with metrics.stage('upload_receive'):
+            for file in files:
+                stream = file.stream
+                stream.finish()
+                if stream.rejected:
+                    raise ValueError(f'{file.filename} : {stream.rejected}')
+                job.add_upload(file.filename, stream)
+        if not job.documents:
+            raise ValueError('Aucun PDF à signer')
+    except ValueError as e:
+        job.cleanup()
+        return jsonify({'error': str(e)}), 400
+    except Exception:
+        job.cleanup()
+        raise
+    
+    response = Response(job.stream(rule, signature_image), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="signed_documents.zip"'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx transmet chaque morceau sans attendre la fin
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/metrics', methods=['GET'])
+@internal_required
+def prometheus_metrics():
+    """Métriques Prometheus agrégées sur tous les workers et processus de calcul"""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/executors/stats', methods=['GET'])
+@internal_required
+def executors_stats():
+    """Occupation et latences des pools de calcul (PDF, bcrypt) du worker courant"""
+    return jsonify(executors.stats())
+
+@app.route('/api/recaptcha/stats', methods=['GET'])
+@internal_required
+def recaptcha_stats():
+    """Compteurs, latence et état du disjoncteur de la vérification reCAPTCHA"""
+    return jsonify(recaptcha.get_client().stats())
+
+@app.route('/api/jobs/stats', methods=['GET'])
+@internal_required
+def sign_jobs_stats():
+    """Profondeur de la file de signature"""
+    return jsonify(jobs.queue_stats())
+
+def get_job_for_request(job_id):
+    """Récupère un job si l'utilisateur courant y a accès (None sinon)"""
+    job = db.get_sign_job(job_id)
+    if not job:
+        return None
+    if job['user_id'] is not None:
+        user = get_current_user()
+        if not user or user['id'] != job['user_id']:
+            return None
+    return job
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def sign_job_status(job_id):
+    """État d'un job de signature asynchrone"""
+    job = get_job_for_request(job_id)
+    if not job:
+        return jsonify({'error': 'Job non trouvé'}), 404
+    return jsonify(jobs.job_status(job))
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def sign_job_result(job_id):
+    """Télécharge le PDF signé d'un job terminé"""
+    job = get_job_for_request(job_id)
+    if not job:
+        return jsonify({'error': 'Job non trouvé'}), 404
+    if job['status'] in ('queued', 'running'):
+        return jsonify(jobs.job_status(job)), 202
+    if job['status'] != 'done':
+        return jsonify(jobs.job_status(job)), 409
+    return download_file(jobs.job_status(job)['signed_file_id'])
+
 @app.route('/api/download/<file_id>')
 def download_file(file_id):
-    """Télécharge le PDF signé"""
-    filepath = os.path.join(SIGNED_FOLDER, file_id)
-    
-    if not os.path.exists(filepath):
+    """Télécharge le PDF signé (ETag, Range, délégation au proxy selon DELIVERY_MODE)"""
+    if not signed_files.resolve(file_id):
         return jsonify({'error': 'Fichier non trouvé'}), 404
     
     original_name = file_id.replace('signed_', '').split('_', 1)[1]
     download_name = f"signed_{original_name}"
     
-    return send_file(filepath, as_attachment=True, download_name=download_name)
+    return signed_files.send(file_id, download_name)
 
 @app.route('/api/preview/<file_id>/<int:page>')
+@admission.limit('preview')
 def preview_page(file_id, page):
-    """Génère une prévisualisation d'une page du PDF"""
+    """Génère une prévisualisation d'une page du PDF (?dpi=96&format=png|webp)"""
     try:
-        filepath = os.path.join(UPLOAD_FOLDER, file_id)
-        if not os.path.exists(filepath):
+        filepath = upload_store.resolve(file_id)
+        if not filepath:
             return jsonify({'error': 'Fichier non trouvé'}), 404
         
-        # Note: Pour une vraie prévisualisation, il faudrait pdf2image
-        # Cette version retourne juste un message de succès
-        return jsonify({'success': True, 'message': 'Prévisualisation disponible'})
-    
+        dpi, fmt = previews.normalize_options(
+            request.args.get('dpi', type=int),
+            request.args.get('format')
+        )
+        path, etag = previews.get_preview(filepath, page, dpi, fmt)
+        
+        response = send_file(path, mimetype=previews.PREVIEW_FORMATS[fmt], etag=etag,
+                             max_age=PREVIEW_MAX_AGE, conditional=True)
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.immutable = True
+        return response
+    
+    except previews.PreviewUnavailable as e:
+        return jsonify({'error': f'Prévisualisation indisponible : {e}'}), 501
+    except (IndexError, ValueError) as e:
+        # Page hors du document ou options invalides, comme pour /api/sign
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -376,7 +742,10 @@ def save_signature_route():
         return jsonify({'error': 'Nom et signature requis'}), 400
     
     user_id = request.current_user['id']
-    signature_id = db.save_signature(user_id, name, signature_data)
+    try:
+        signature_id = signature_store.save(user_id, name, signature_data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
         'success': True,
@@ -387,11 +756,29 @@ def save_signature_route():
 @app.route('/api/signatures', methods=['GET'])
 @login_required
 def get_signatures():
-    """Récupère toutes les signatures sauvegardées de l'utilisateur"""
+    """Récupère les signatures sauvegardées de l'utilisateur (métadonnées et miniatures)"""
     user_id = request.current_user['id']
-    signatures = db.get_user_signatures(user_id)
+    signatures = signature_store.list_for_user(user_id)
     
-    return jsonify({'signatures': signatures})
+    response = jsonify({'signatures': signatures})
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # Revalidation systématique (ETag)
+    return response.make_conditional(request)
+
+@app.route('/api/signatures/<int:signature_id>/image', methods=['GET'])
+@login_required
+def get_signature_image(signature_id):
+    """Image complète (PNG) d'une signature sauvegardée"""
+    saved = signature_store.load(signature_id, request.current_user['id'])
+    if not saved:
+        return jsonify({'error': 'Signature non trouvée'}), 404
+    
+    response = app.response_class(saved.data, mimetype='image/png')
+    response.set_etag(saved.digest)
+    response.cache_control.private = True
+    response.cache_control.max_age = PREVIEW_MAX_AGE
+    return response.make_conditional(request)
 
 @app.route('/api/signatures/<int:signature_id>', methods=['DELETE'])
 @login_required
@@ -404,16 +791,53 @@ def delete_signature_route(signature_id):
         return jsonify({'success': True, 'message': 'Signature supprimée'})
     return jsonify({'error': 'Signature non trouvée'}), 404
 
+HISTORY_PAGE_MAX = 500
+
+def encode_history_cursor(entry):
+    """Curseur opaque de pagination : (created_at, id) de la dernière entrée"""
+    raw = f"{entry['created_at']}|{entry['id']}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_history_cursor(cursor):
+    """Inverse de encode_history_cursor ; lève ValueError si le curseur est invalide"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, history_id = raw.rsplit('|', 1)
+        return created_at, int(history_id)
+    except Exception:
+        raise ValueError('Curseur invalide')
+
 @app.route('/api/history', methods=['GET'])
 @login_required
 def get_history():
-    """Récupère l'historique des signatures de l'utilisateur"""
+    """Récupère l'historique des signatures de l'utilisateur
+
+    Paramètres : limit (50 par défaut, 500 max), cursor (next_cursor de la page
+    précédente), fields (colonnes séparées par des virgules), count=1 (total).
+    """
     user_id = request.current_user['id']
-    limit = request.args.get('limit', 50, type=int)
-    
-    history = db.get_user_history(user_id, limit)
-    
-    return jsonify({'history': history})
+    limit = max(1, min(HISTORY_PAGE_MAX, request.args.get('limit', 50, type=int)))
+    fields = request.args.get('fields')
+    fields = set(fields.split(',')) if fields else None
+    
+    before = None
+    if request.args.get('cursor'):
+        try:
+            before = decode_history_cursor(request.args['cursor'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    # Une entrée de plus que demandé : indique s'il reste une page suivante
+    history = db.get_user_history(user_id, limit + 1, before, fields)
+    next_cursor = None
+    if len(history) > limit:
+        history = history[:limit]
+        next_cursor = encode_history_cursor(history[-1])
+    
+    result = {'history': history, 'next_cursor': next_cursor}
+    if request.args.get('count') in ('1', 'true'):
+        result['total'] = db.count_user_history(user_id)
+    return jsonify(result)
 
 @app.route('/api/history/<int:history_id>/download', methods=['GET'])
 @login_required
@@ -422,17 +846,16 @@ def download_from_history(history_id):
     user_id = request.current_user['id']
     
     # Récupérer l'entrée de l'historique
-    history = db.get_user_history(user_id, limit=1000)
-    entry = next((h for h in history if h['id'] == history_id), None)
+    entry = db.get_history_entry(user_id, history_id)
     
     if not entry:
         return jsonify({'error': 'Fichier non trouvé'}), 404
     
-    filepath = entry['file_path']
-    if not os.path.exists(filepath):
+    name = os.path.basename(entry['file_path'])
+    if not signed_files.resolve(name):
         return jsonify({'error': 'Fichier non trouvé sur le serveur'}), 404
     
-    return send_file(filepath, as_attachment=True, download_name=entry['signed_filename'])
+    return signed_files.send(name, entry['signed_filename'])
 
 @app.route('/api/history', methods=['DELETE'])
 @login_required
@@ -0,0 +1,110 @@
+"""
+Benchmark : débit de téléchargement des PDF signés par worker
+
+Un serveur WSGI mono-thread (l'équivalent d'un worker gunicorn synchrone)
+sert un PDF via delivery.SignedFileDelivery ; --clients connexions
+concurrentes enchaînent pendant --duration secondes des téléchargements
+complets, des reprises (Range sur la seconde moitié) et des revalidations
+(If-None-Match). En mode x-accel, seul le coût côté worker est mesuré (les
+octets seraient servis par nginx).
+
+Usage : python benchmarks/bench_download.py [--size-mb 8] [--clients 4] [--duration 5]
+                                            [--modes direct x-accel]
+"""
+import argparse
+import http.client
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from delivery import SignedFileDelivery
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args):
+        pass
+
+def make_app(folder, mode):
+    app = Flask(__name__)
+    files = SignedFileDelivery(folder, mode=mode)
+
+    @app.route('/download/<name>')
+    def download(name):
+        return files.send(name, 'document.pdf')
+
+    return app
+
+def run_clients(port, path, headers, clients, duration):
+    """Retourne (requêtes, octets reçus, latences) sur la durée"""
+    latencies = []
+    received = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        local, size = [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            size += len(response.read())
+            local.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            received[0] += size
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies), received[0], sorted(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=8)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--modes', nargs='+', default=['direct', 'x-accel'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        name = 'signed_bench.pdf'
+        size = args.size_mb * 1024 * 1024
+        with open(os.path.join(tmp, name), 'wb') as f:
+            f.write(b'%PDF-1.4\n' + os.urandom(size - 9))
+        etag = '"' + SignedFileDelivery(tmp).digest(os.path.join(tmp, name)) + '"'
+
+        scenarios = [
+            ('complet', {}),
+            ('reprise (Range)', {'Range': f'bytes={size // 2}-'}),
+            ('revalidation (304)', {'If-None-Match': etag}),
+        ]
+        print(f"Fichier {args.size_mb} Mo, {args.clients} clients, {args.duration:.0f} s par scénario")
+        print(f"{'mode':>10} {'scénario':>20} {'req/s':>8} {'Mo/s':>8} {'p50':>9} {'p95':>9}")
+        for mode in args.modes:
+            server = make_server('127.0.0.1', 0, make_app(tmp, mode), request_handler=QuietHandler)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                for label, headers in scenarios:
+                    count, received, latencies = run_clients(
+                        server.server_port, f'/download/{name}', headers, args.clients, args.duration)
+                    p50 = latencies[len(latencies) // 2]
+                    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                    print(f"{mode:>10} {label:>20} {count / args.duration:>8.1f} "
+                          f"{received / args.duration / 1024 / 1024:>8.1f} "
+                          f"{p50 * 1000:>7.2f}ms {p95 * 1000:>7.2f}ms")
+            finally:
+                server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark : taille et durée de l'optimisation des PDF signés, par mode
+
+Chaque document est signé --signatures fois de suite (comme un document
+repassé entre plusieurs signataires) en mode incrémental puis en réécriture
+complète, sans optimisation ; le résultat est ensuite optimisé dans chaque
+mode de OUTPUT_OPTIMIZE. Sans fichier en argument, des PDF synthétiques de
+--pages pages sont générés.
+
+Usage : python benchmarks/bench_optimize.py [fichier.pdf ...] [--pages 20 200]
+                                            [--signatures 3] [--modes compact linearize]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import optimizer
+import pdf_engine
+from bench_sign import make_pdf, make_signature
+
+def sign_repeatedly(input_path, output_path, signature, mode, count):
+    """Signe count fois le document (chaque passe repart du résultat précédent)"""
+    current = input_path
+    for i in range(count):
+        placements = [pdf_engine.Placement(0, 40 + 160 * (i % 3), 50 + 80 * (i // 3), 150, 75, 'signature')]
+        pdf_engine.stamp(current, output_path + '.tmp', placements, {'signature': signature},
+                         mode=mode, optimize='off')
+        os.replace(output_path + '.tmp', output_path)
+        current = output_path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--pages', type=int, nargs='+', default=[20, 200])
+    parser.add_argument('--signatures', type=int, default=3)
+    parser.add_argument('--modes', nargs='+', default=['compact', 'linearize'])
+    args = parser.parse_args()
+    if 'linearize' in args.modes and optimizer.pikepdf is None:
+        print("pikepdf non installé : mode linearize ignoré")
+        args.modes.remove('linearize')
+
+    signature = make_signature()
+    with tempfile.TemporaryDirectory() as tmp:
+        documents = [(os.path.basename(path), path) for path in args.files]
+        for pages in ([] if args.files else args.pages):
+            path = os.path.join(tmp, f'doc_{pages}p.pdf')
+            make_pdf(path, pages)
+            documents.append((f'{pages} pages', path))
+
+        print(f"{'document':>16} {'signature':>12} {'optimisation':>13} {'avant':>9} {'après':>9} "
+              f"{'gain':>7} {'durée':>9} {'doublons':>9} {'compressés':>11}")
+        for label, path in documents:
+            for sign_mode in ('incremental', 'rewrite'):
+                signed = os.path.join(tmp, f'signed_{sign_mode}.pdf')
+                sign_repeatedly(path, signed, signature, sign_mode, args.signatures)
+                for mode in args.modes:
+                    optimized = os.path.join(tmp, f'optimized_{mode}.pdf')
+                    shutil.copyfile(signed, optimized)
+                    report = optimizer.optimize(optimized, mode)
+                    if report.get('error'):
+                        print(f"{label:>16} {sign_mode:>12} {mode:>13} erreur : {report['error']}")
+                        continue
+                    print(f"{label:>16} {sign_mode:>12} {mode:>13} "
+                          f"{report['bytes_before'] // 1024:>7}KB {report['bytes_after'] // 1024:>7}KB "
+                          f"{report['saved_percent']:>6.1f}% {report['duration_ms']:>7.1f}ms "
+                          f"{report.get('duplicates', 0):>9} {report.get('streams_compressed', 0):>11}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark : signature incrémentale vs réécriture complète sur de gros PDF
+
+Usage : python benchmarks/bench_sign.py [--pages 50 200 500] [--repeat 5]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+import pdf_engine
+
+def make_pdf(path, pages):
+    """Génère un PDF de test avec du texte sur chaque page"""
+    can = canvas.Canvas(path, pagesize=A4)
+    for i in range(pages):
+        can.setFont('Helvetica', 10)
+        for line in range(60):
+            can.drawString(40, 800 - line * 12, f'Page {i + 1} - ligne {line + 1} : ' + 'lorem ipsum ' * 6)
+        can.showPage()
+    can.save()
+
+def make_signature():
+    """Génère une signature PNG transparente comparable à celle du canvas navigateur"""
+    img = Image.new('RGBA', (600, 300), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.line([(40, 200), (150, 80), (260, 220), (380, 90), (560, 180)], fill=(0, 0, 0, 255), width=6)
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def bench(mode, input_path, output_path, signature, page, repeat):
+    """Retourne la liste des durées (s) pour un mode donné"""
+    placements = [pdf_engine.Placement(page, 400, 50, 150, 75, 'signature')]
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pdf_engine.stamp(input_path, output_path, placements, {'signature': signature}, mode=mode)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def bench_image_source(signature, tmp, repeat):
+    """Compare l'ancien aller-retour disque (écriture/lecture/suppression) au décodage en mémoire"""
+    results = {}
+    for source in ('fichier', 'memoire'):
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if source == 'fichier':
+                path = os.path.join(tmp, 'signature_tmp.png')
+                with open(path, 'wb') as f:
+                    f.write(signature)
+                pdf_engine.image_xobjects(pdf_engine.load_image(path))
+                os.remove(path)
+            else:
+                pdf_engine.image_xobjects(pdf_engine.load_image(signature))
+            durations.append(time.perf_counter() - start)
+        durations.sort()
+        results[source] = durations[len(durations) // 2]
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    signature = make_signature()
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = bench_image_source(signature, tmp, max(args.repeat, 20))
+        print(f"Image de signature : fichier temporaire {sources['fichier'] * 1000:.2f}ms, "
+              f"mémoire {sources['memoire'] * 1000:.2f}ms ({len(signature)} octets écrits/relus évités)")
+        print()
+        print(f"{'pages':>6} {'taille':>10} {'mode':>12} {'médiane':>10} {'sortie':>10}")
+        for pages in args.pages:
+            input_path = os.path.join(tmp, f'doc_{pages}.pdf')
+            make_pdf(input_path, pages)
+            size = os.path.getsize(input_path)
+            for mode in ('rewrite', 'incremental'):
+                output_path = os.path.join(tmp, f'signed_{mode}_{pages}.pdf')
+                durations = sorted(bench(mode, input_path, output_path, signature, pages - 1, args.repeat))
+                median = durations[len(durations) // 2]
+                print(f"{pages:>6} {size // 1024:>8}KB {mode:>12} {median * 1000:>8.1f}ms "
+                      f"{os.path.getsize(output_path) // 1024:>8}KB")
+
+if __name__ == '__main__':
+    main()
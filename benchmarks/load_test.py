@@ -0,0 +1,490 @@
+"""
+Banc de charge de la chaîne de signature (upload, signature, téléchargement, authentification)
+
+Génère des PDF synthétiques (nombre de pages, formats et poids variés) et
+des images de signature, puis mesure les routes de l'application :
+
+- --mode client : en processus, via le client de test Flask ;
+- --mode http : --workers processus préforkés (comme gunicorn) partageant
+  une socket locale, interrogés par --concurrency clients HTTP.
+
+Pour chaque scénario : latences p50/p95/p99, débit et erreurs, plus le pic
+de mémoire (RSS) des processus serveur. --json écrit le résultat (avec le
+commit et les versions de PyPDF2/reportlab) pour comparer deux commits :
+
+    python benchmarks/load_test.py --json avant.json
+    git checkout autre-branche
+    python benchmarks/load_test.py --compare avant.json
+
+Usage : python benchmarks/load_test.py [--mode client|http] [--workers 4]
+                                       [--requests 40] [--concurrency 4]
+                                       [--json FICHIER] [--compare FICHIER]
+"""
+import argparse
+import base64
+import http.client
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from importlib import metadata
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from PIL import Image, ImageDraw
+from reportlab.lib.pagesizes import A3, A4, landscape, letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+# (nom, pages, format, image pleine page) : du contrat d'une page au gros document scanné
+DOCUMENTS = [
+    ('a4-1p', 1, A4, False),
+    ('letter-20p', 20, letter, False),
+    ('a3-paysage-5p', 5, landscape(A3), False),
+    ('a4-200p', 200, A4, False),
+    ('scan-10p', 10, A4, True),
+]
+
+# (nom, taille) : canvas du navigateur et signature haute définition
+SIGNATURES = [('canvas', (600, 300)), ('hd', (1800, 600))]
+
+PASSWORD = 'motdepasse-bench'
+
+# ---------------------------------------------------------------------------
+# Données synthétiques
+# ---------------------------------------------------------------------------
+
+def make_pdf(pages, pagesize, scanned):
+    """PDF de test : texte sur chaque page, ou une image bruitée par page (document scanné)"""
+    buffer = io.BytesIO()
+    can = canvas.Canvas(buffer, pagesize=pagesize)
+    width, height = pagesize
+    for i in range(pages):
+        if scanned:
+            noise = Image.frombytes('L', (400, 560), os.urandom(400 * 560))
+            can.drawImage(ImageReader(noise), 0, 0, width, height)
+        else:
+            can.setFont('Helvetica', 10)
+            for line in range(int(height // 14) - 4):
+                can.drawString(40, height - 40 - line * 12, f'Page {i + 1} - ligne {line + 1} : ' + 'lorem ipsum ' * 6)
+        can.showPage()
+    can.save()
+    return buffer.getvalue()
+
+def unique_copy(pdf):
+    """Variante du PDF au contenu unique (contourne le dédoublonnage des uploads)"""
+    return pdf + f'%bench-{uuid.uuid4().hex}\n'.encode('ascii')
+
+def make_signature(size):
+    """Signature PNG transparente, tracé proportionnel à la taille"""
+    width, height = size
+    img = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    points = [(width * x, height * y) for x, y in
+              ((0.07, 0.67), (0.25, 0.27), (0.43, 0.73), (0.63, 0.3), (0.93, 0.6))]
+    draw.line(points, fill=(0, 0, 0, 255), width=max(2, width // 100))
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+# ---------------------------------------------------------------------------
+# Clients : client de test Flask ou HTTP réel
+# ---------------------------------------------------------------------------
+
+def multipart(filename, content):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n').encode('ascii') + content + f'\r\n--{boundary}--\r\n'.encode('ascii')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+class TestClient:
+    """Requêtes via le client de test Flask (sans réseau)"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, content_type=None, headers=None):
+        response = self.client.open(path, method=method, data=body,
+                                    content_type=content_type, headers=headers or {})
+        return response.status_code, response.get_data()
+
+class HttpClient:
+    """Requêtes HTTP sur une connexion persistante (une par thread)"""
+
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, content_type=None, headers=None):
+        headers = dict(headers or {})
+        if content_type:
+            headers['Content-Type'] = content_type
+        for attempt in (1, 2):
+            conn = getattr(self.local, 'conn', None)
+            if conn is None:
+                conn = self.local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self.local.conn = None
+                if attempt == 2:
+                    raise
+
+def _json(data):
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None  # Page d'erreur HTML (500)
+
+def post_json(client, path, payload, headers=None):
+    status, data = client.request('POST', path, json.dumps(payload).encode('utf-8'), 'application/json', headers)
+    return status, _json(data)
+
+def upload(client, filename, content, headers=None):
+    body, content_type = multipart(filename, content)
+    status, data = client.request('POST', '/api/upload', body, content_type, headers)
+    return status, _json(data)
+
+# ---------------------------------------------------------------------------
+# Scénarios
+# ---------------------------------------------------------------------------
+
+class Fixtures:
+    """Données partagées par les scénarios (documents, signatures, compte de test)"""
+
+    def __init__(self, client):
+        self.documents = {name: make_pdf(pages, size, scanned) for name, pages, size, scanned in DOCUMENTS}
+        self.pages = {name: pages for name, pages, _, _ in DOCUMENTS}
+        self.signatures = {name: make_signature(size) for name, size in SIGNATURES}
+        self.email = f'bench-{uuid.uuid4().hex[:8]}@exemple.fr'
+        status, body = post_json(client, '/api/register', {'email': self.email, 'password': PASSWORD})
+        if status != 200:
+            raise RuntimeError(f'Inscription du compte de test impossible : {status} {body}')
+        self.auth = {'Authorization': f"Bearer {body['token']}"}
+        # Un upload et une signature préalables par document, pour les scénarios qui en dépendent
+        self.file_ids = {}
+        self.signed_ids = {}
+        for name, content in self.documents.items():
+            self.file_ids[name] = upload(client, f'{name}.pdf', content)[1]['file_id']
+            status, body = post_json(client, '/api/sign', {
+                'file_id': self.file_ids[name], 'signature': self.signatures['canvas']})
+            if status != 200:
+                raise RuntimeError(f'Signature préalable de {name} impossible : {status} {body}')
+            self.signed_ids[name] = body['signed_file_id']
+
+def scenarios(fixtures):
+    """(nom, fonction(client) -> statut HTTP) de chaque mesure"""
+    def upload_new(name):
+        return lambda client: upload(client, f'{name}.pdf', unique_copy(fixtures.documents[name]))[0]
+
+    def upload_known(name):
+        return lambda client: upload(client, f'{name}.pdf', fixtures.documents[name])[0]
+
+    def sign(name, signature):
+        return lambda client: post_json(client, '/api/sign', {
+            'file_id': fixtures.file_ids[name], 'signature': fixtures.signatures[signature],
+            'page': fixtures.pages[name] - 1})[0]
+
+    def sign_every_page(name):
+        return lambda client: post_json(client, '/api/sign/batch', {
+            'file_id': fixtures.file_ids[name],
+            'signatures': {'paraphe': fixtures.signatures['canvas']},
+            'placements': [{'page': page, 'signature': 'paraphe', 'width': 60, 'height': 30}
+                           for page in range(fixtures.pages[name])]})[0]
+
+    def download(name):
+        return lambda client: client.request('GET', f'/api/download/{fixtures.signed_ids[name]}')[0]
+
+    def login(client):
+        return post_json(client, '/api/login', {'email': fixtures.email, 'password': PASSWORD})[0]
+
+    def me(client):
+        return client.request('GET', '/api/me', headers=fixtures.auth)[0]
+
+    result = []
+    for name, *_ in DOCUMENTS:
+        result.append((f'upload {name}', upload_new(name)))
+    result.append(('upload a4-200p (dédoublonné)', upload_known('a4-200p')))
+    for name, *_ in DOCUMENTS:
+        result.append((f'sign {name}', sign(name, 'canvas')))
+    result.append(('sign a4-1p (signature hd)', sign('a4-1p', 'hd')))
+    result.append(('sign/batch letter-20p (toutes les pages)', sign_every_page('letter-20p')))
+    for name in ('a4-1p', 'a4-200p', 'scan-10p'):
+        result.append((f'download {name}', download(name)))
+    result.append(('auth login (bcrypt)', login))
+    result.append(('auth me (session)', me))
+    return result
+
+# ---------------------------------------------------------------------------
+# Mesure
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, q):
+    """Percentile au rang le plus proche"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def measure(client, call, requests, concurrency):
+    """Exécute requests appels répartis sur concurrency threads"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                status = call(client)
+            except Exception as e:
+                status = repr(e)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(status)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(max(1, concurrency))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'count': len(latencies),
+        'errors': len(errors),
+        'error_sample': [str(status) for status in errors[:3]],
+        'throughput': round(len(latencies) / wall, 2) if wall else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        'p50_ms': _ms(percentile(latencies, 0.50)),
+        'p95_ms': _ms(percentile(latencies, 0.95)),
+        'p99_ms': _ms(percentile(latencies, 0.99)),
+    }
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+def _children(pid):
+    """Descendants d'un processus (Linux, via /proc)"""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    parents.setdefault(int(f.read().rsplit(')', 1)[1].split()[1]), []).append(int(entry))
+            except OSError:
+                continue
+    found, stack = [], [pid]
+    while stack:
+        for child in parents.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+def peak_rss_kb(pid):
+    """Pic de mémoire résidente (VmHWM) d'un processus, en Ko"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def memory_report(pids):
+    """Pic RSS de chaque processus serveur et de ses processus de calcul"""
+    report = {}
+    for pid in pids:
+        children = [peak_rss_kb(child) for child in _children(pid)]
+        report[str(pid)] = {
+            'peak_rss_kb': peak_rss_kb(pid),
+            'children_peak_rss_kb': max([kb for kb in children if kb] or [0]),
+        }
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'processes': report,
+        'max_worker_peak_rss_kb': max((p['peak_rss_kb'] or 0 for p in report.values()), default=own),
+        'max_child_peak_rss_kb': max((p['children_peak_rss_kb'] for p in report.values()), default=0),
+    }
+
+# ---------------------------------------------------------------------------
+# Serveur local multi-workers
+# ---------------------------------------------------------------------------
+
+def _serve(fd):
+    """Processus worker : importe l'application et sert la socket partagée"""
+    os.setpgrp()  # Groupe propre : arrêté avec ses processus de calcul (stop_workers)
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args):
+            pass
+
+    from app import app
+    make_server('127.0.0.1', 0, app, request_handler=QuietHandler, fd=fd).serve_forever()
+
+def start_workers(count):
+    """Préforke count workers sur une socket locale ; retourne (port, processus)"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    context = multiprocessing.get_context('fork')
+    # Non démoniques : chaque worker crée ses propres pools de processus (executors)
+    workers = [context.Process(target=_serve, args=(listener.fileno(),)) for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    port = listener.getsockname()[1]
+
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/api/me')
+            conn.getresponse().read()
+            conn.close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError('Les workers ne répondent pas')
+            time.sleep(0.2)
+    return port, workers
+
+def stop_workers(workers):
+    for worker in workers:
+        try:
+            os.killpg(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        worker.join()
+
+# ---------------------------------------------------------------------------
+# Rapport
+# ---------------------------------------------------------------------------
+
+def environment():
+    try:
+        commit = subprocess.run(['git', '-C', REPO, 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    versions = {}
+    for package in ('PyPDF2', 'reportlab', 'Flask', 'Pillow', 'bcrypt'):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {'commit': commit, 'python': platform.python_version(), 'cpus': os.cpu_count(), 'packages': versions}
+
+def print_results(results, baseline=None):
+    print(f"{'scénario':<42} {'n':>4} {'err':>4} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, stats in results.items():
+        line = (f"{name:<42} {stats['count']:>4} {stats['errors']:>4} {stats['throughput'] or 0:>8.1f} "
+                f"{_fmt(stats['p50_ms'])} {_fmt(stats['p95_ms'])} {_fmt(stats['p99_ms'])}")
+        reference = (baseline or {}).get(name)
+        if reference and reference.get('p50_ms') and stats['p50_ms']:
+            delta = (stats['p50_ms'] - reference['p50_ms']) / reference['p50_ms'] * 100
+            line += f"   p50 {delta:+.0f}%"
+        print(line)
+
+def _fmt(ms):
+    return f"{ms:>7.1f}ms" if ms is not None else f"{'-':>9}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('client', 'http'), default='client')
+    parser.add_argument('--workers', type=int, default=4, help='processus serveur en mode http')
+    parser.add_argument('--requests', type=int, default=40, help='requêtes par scénario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--only', help='ne garder que les scénarios contenant ce texte')
+    parser.add_argument('--json', help='écrit le résultat dans ce fichier')
+    parser.add_argument('--compare', help='résultat JSON de référence (écarts de p50)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        baseline = reference['results']
+        print(f"Référence : commit {reference['environment']['commit']}, {reference['config']}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # L'application travaille dans le répertoire courant (uploads/, signed/) : base isolée
+        os.chdir(tmp)
+        os.environ['DATABASE_PATH'] = os.path.join(tmp, 'bench.db')
+        os.environ['RECAPTCHA_SECRET_KEY'] = ''
+        os.environ['JANITOR_INTERVAL'] = '0'
+        # Le banc mesure la capacité, pas la limitation de débit (un seul client, une seule IP)
+        os.environ['ADMISSION_ENABLED'] = '0'
+        os.environ['ADMISSION_DB'] = os.path.join(tmp, 'admission.db')
+        os.environ['EXECUTOR_SLOTS_DIR'] = os.path.join(tmp, 'slots')
+
+        workers = []
+        if args.mode == 'http':
+            port, workers = start_workers(args.workers)
+            client = HttpClient(port)
+        else:
+            from app import app
+            client = TestClient(app)
+
+        try:
+            start = time.perf_counter()
+            fixtures = Fixtures(client)
+            print(f"Données préparées en {time.perf_counter() - start:.1f} s "
+                  f"({', '.join(f'{name} {len(pdf) // 1024} Ko' for name, pdf in fixtures.documents.items())})")
+            results = {}
+            for name, call in scenarios(fixtures):
+                if args.only and args.only not in name:
+                    continue
+                results[name] = measure(client, call, args.requests, args.concurrency)
+            pids = [worker.pid for worker in workers] or [os.getpid()]
+            memory = memory_report(pids)
+        finally:
+            stop_workers(workers)
+            os.chdir(REPO)
+
+    report = {
+        'environment': environment(),
+        'config': {'mode': args.mode, 'workers': args.workers if args.mode == 'http' else 1,
+                   'requests': args.requests, 'concurrency': args.concurrency},
+        'results': results,
+        'memory': memory,
+    }
+    if baseline and reference['config'] != report['config']:
+        print("Attention : configuration différente de la référence, écarts non comparables")
+    print_results(results, baseline)
+    print(f"Pic RSS : worker {memory['max_worker_peak_rss_kb'] // 1024} Mo, "
+          f"processus de calcul {memory['max_child_peak_rss_kb'] // 1024} Mo")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Résultat écrit dans {args.json}")
+    return 1 if any(stats['errors'] for stats in results.values()) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+Signature en masse : plusieurs PDF (ou une archive ZIP) signés avec la même
+signature selon une règle de placement, renvoyés dans une archive ZIP
+
+Les fichiers reçus sont rangés dans un dossier de travail propre à la
+requête ; les membres d'une archive n'en sont extraits qu'au moment d'être
+signés. Au plus BULK_CONCURRENCY documents sont signés en même temps dans le
+pool de calcul 'pdf', et chaque PDF signé est ajouté à l'archive de réponse
+(envoyée en flux, par morceaux) dès qu'il est prêt, puis supprimé : ni les
+entrées ni les sorties ne sont jamais toutes en mémoire ou sur disque à la
+fois. L'archive se termine par rapport.json (résultat de chaque document).
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from werkzeug.utils import secure_filename
+
+import executors
+import metrics
+import pdf_engine
+from uploads import BULK_PREFIX
+
+BULK_MAX_FILES = int(os.environ.get('BULK_MAX_FILES', '500'))
+BULK_MAX_BYTES = int(os.environ.get('BULK_MAX_MB', '512')) * 1024 * 1024  # Corps de requête (archive comprise)
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', '2'))  # Documents signés simultanément par requête
+BULK_SATURATED_WAIT = float(os.environ.get('BULK_SATURATED_WAIT', '60'))  # Attente max d'une place dans le pool
+CHUNK_SIZE = 256 * 1024
+REPORT_NAME = 'rapport.json'
+
+ANCHORS = ('bottom-right', 'bottom-left', 'top-right', 'top-left', 'center')
+
+# Règle de placement : page ('first', 'last', 'all' ou numéro 0-indexé, négatif
+# depuis la fin), coin d'ancrage, taille et marge en points
+PlacementRule = namedtuple('PlacementRule', 'page anchor width height margin')
+
+# Document à signer : nom d'origine, fichier sur disque, membre de l'archive
+# (None pour un PDF envoyé directement) et erreur détectée à la réception
+BulkDocument = namedtuple('BulkDocument', 'name path member error')
+
+def parse_rule(values):
+    """Règle de placement à partir des champs du formulaire ; lève ValueError"""
+    page = str(values.get('page', 'last')).strip().lower()
+    if page not in ('first', 'last', 'all'):
+        try:
+            page = int(page)
+        except ValueError:
+            raise ValueError(f'Page invalide : {page}')
+    anchor = str(values.get('anchor', 'bottom-right')).strip().lower()
+    if anchor not in ANCHORS:
+        raise ValueError(f"Ancrage invalide : {anchor} (attendu : {', '.join(ANCHORS)})")
+    try:
+        width = float(values.get('width', 150))
+        height = float(values.get('height', 75))
+        margin = float(values.get('margin', 36))
+    except (TypeError, ValueError):
+        raise ValueError('Taille ou marge invalide')
+    if width <= 0 or height <= 0 or margin < 0:
+        raise ValueError('Taille ou marge invalide')
+    return PlacementRule(page, anchor, width, height, margin)
+
+def rule_pages(rule, num_pages):
+    """Pages (0-indexées) visées par la règle"""
+    if rule.page == 'all':
+        return range(num_pages)
+    if rule.page == 'first':
+        return [0]
+    if rule.page == 'last':
+        return [num_pages - 1]
+    page = rule.page + num_pages if rule.page < 0 else rule.page
+    if not 0 <= page < num_pages:
+        raise IndexError(f'Page {rule.page} inexistante ({num_pages} pages)')
+    return [page]
+
+def rule_placements(rule, document):
+    """Placements de la signature sur les pages d'un document (pdf_engine.ParsedDocument)
+
+    Les positions sont calculées dans l'espace affiché de chaque page (page
+    tournée comprise) ; la signature est réduite si la page est trop petite.
+    Seules les pages visées sont analysées.
+    """
+    num_pages = document.page_count()
+    if num_pages < 1:
+        raise ValueError('document sans page')
+    placements = []
+    for page_num in rule_pages(rule, num_pages):
+        page = document.page_geometry(page_num)
+        margin = min(rule.margin, page.width / 4, page.height / 4)
+        scale = min(1.0, (page.width - 2 * margin) / rule.width, (page.height - 2 * margin) / rule.height)
+        width, height = rule.width * scale, rule.height * scale
+        vertical, _, horizontal = rule.anchor.partition('-')
+        if rule.anchor == 'center':
+            x, y = (page.width - width) / 2, (page.height - height) / 2
+        else:
+            x = margin if horizontal == 'left' else page.width - width - margin
+            y = margin if vertical == 'bottom' else page.height - height - margin
+        placements.append(pdf_engine.Placement(page_num, x, y, width, height, 'signature'))
+    return placements
+
+def sign_document(input_path, output_path, rule, image):
+    """Signe un document selon la règle (exécuté dans le pool de calcul)
+
+    Retourne (pages signées, rapport d'optimisation).
+    """
+    # Le document analysé ici est repris du cache par pdf_engine.stamp
+    placements = rule_placements(rule, pdf_engine.load_document(input_path))
+    result = pdf_engine.stamp(input_path, output_path, placements, {'signature': image})
+    return len(placements), result.optimization
+
+class _Sink:
+    """Sortie non repositionnable de zipfile : les octets écrits sont récupérés par take()"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+class BulkJob:
+    """Documents d'une requête de signature en masse et leur dossier de travail"""
+
+    def __init__(self, folder, max_document_bytes):
+        self.max_document_bytes = max_document_bytes
+        self.workdir = tempfile.mkdtemp(dir=folder, prefix=BULK_PREFIX)
+        self.documents = []
+        self._archives = []
+
+    def _check_count(self):
+        if len(self.documents) > BULK_MAX_FILES:
+            raise ValueError(f'Maximum {BULK_MAX_FILES} documents par requête')
+
+    def add_upload(self, filename, stream):
+        """Range un fichier reçu (uploads.IngestStream terminé) : PDF ou archive ZIP
+
+        Lève ValueError si l'archive est illisible ou contient trop de documents.
+        """
+        name = secure_filename(filename) or 'document.pdf'
+        index = len(self.documents) + len(self._archives)
+        if name.lower().endswith('.zip'):
+            path = os.path.join(self.workdir, f'{index:04d}.zip')
+            stream.commit(path)
+            self._archives.append(path)
+            self._add_archive(path, name)
+        else:
+            path = os.path.join(self.workdir, f'{index:04d}.pdf')
+            stream.commit(path)
+            self.documents.append(BulkDocument(name, path, None, None))
+        self._check_count()
+
+    def _add_archive(self, path, name):
+        """Inscrit les PDF de l'archive (seul le répertoire central est lu)"""
+        try:
+            with zipfile.ZipFile(path) as archive:
+                members = archive.infolist()
+        except zipfile.BadZipFile:
+            raise ValueError(f'Archive ZIP illisible : {name}')
+        for member in members:
+            basename = member.filename.rsplit('/', 1)[-1]
+            if member.is_dir() or not basename.lower().endswith('.pdf') or member.filename.startswith('__MACOSX/'):
+                continue
+            error = None
+            if member.flag_bits & 0x1:
+                error = 'Membre chiffré'
+            elif member.file_size > self.max_document_bytes:
+                error = f'Fichier trop volumineux (maximum {self.max_document_bytes // (1024 * 1024)} Mo)'
+            self.documents.append(BulkDocument(secure_filename(basename) or 'document.pdf', path, member, error))
+            self._check_count()
+
+    def _extract(self, document, index):
+        """Fichier PDF du document sur disque (membre d'archive extrait à la demande)"""
+        if document.member is None:
+            return document.path
+        target = os.path.join(self.workdir, f'member-{index:04d}.pdf')
+        written = 0
+        with zipfile.ZipFile(document.path) as archive, archive.open(document.member) as source, \
+                open(target, 'wb') as f:
+            while chunk := source.read(CHUNK_SIZE):
+                written += len(chunk)
+                if written > self.max_document_bytes:
+                    raise ValueError('Fichier trop volumineux')
+                f.write(chunk)
+        return target
+
+    def _sign(self, index, rule, image):
+        """Extrait et signe un document ; retourne (chemin d'entrée, chemin signé, résultat de sign_document)"""
+        document = self.documents[index]
+        input_path = self._extract(document, index)
+        output_path = os.path.join(self.workdir, f'signed-{index:04d}.pdf')
+        deadline = time.monotonic() + BULK_SATURATED_WAIT
+        with metrics.stage('bulk_sign'):
+            while True:
+                try:
+                    result = executors.run('pdf', sign_document, input_path, output_path, rule, image)
+                    return input_path, output_path, result
+                except executors.Saturated:
+                    # Pool occupé par d'autres requêtes : on patiente plutôt que d'échouer
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.2)
+
+    def _archive_name(self, name, used):
+        stem, ext = os.path.splitext(name)
+        candidate = f'signed_{stem}{ext or ".pdf"}'
+        counter = 2
+        while candidate in used or candidate == REPORT_NAME:
+            candidate = f'signed_{stem}_{counter}{ext or ".pdf"}'
+            counter += 1
+        used.add(candidate)
+        return candidate
+
+    def _remove(self, *paths):
+        for path in paths:
+            if path and path not in self._archives and os.path.exists(path):
+                os.remove(path)
+
+    def stream(self, rule, image):
+        """Génère l'archive ZIP des documents signés, morceau par morceau
+
+        Les documents sont ajoutés dans l'ordre où leur signature se termine.
+        """
+        sink = _Sink()
+        report = []
+        used = set()
+        pending = {}
+        executor = ThreadPoolExecutor(max_workers=max(1, BULK_CONCURRENCY), thread_name_prefix='bulk')
+        try:
+            with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+                queue = iter(range(len(self.documents)))
+                exhausted = False
+                while pending or not exhausted:
+                    # Fenêtre bornée : deux documents en attente par signature en cours
+                    while not exhausted and len(pending) < 2 * max(1, BULK_CONCURRENCY):
+                        index = next(queue, None)
+                        if index is None:
+                            exhausted = True
+                            break
+                        document = self.documents[index]
+                        if document.error:
+                            report.append({'file': document.name, 'error': document.error})
+                            continue
+                        pending[executor.submit(self._sign, index, rule, image)] = index
+                    if not pending:
+                        continue
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = pending.pop(future)
+                        document = self.documents[index]
+                        try:
+                            input_path, output_path, (pages, optimization) = future.result()
+                        except Exception as e:
+                            print(f"Signature en masse : échec sur {document.name}: {e}")
+                            report.append({'file': document.name, 'error': str(e) or type(e).__name__})
+                            continue
+
+                        signed_name = self._archive_name(document.name, used)
+                        info = zipfile.ZipInfo(signed_name, time.localtime()[:6])
+                        info.compress_type = zipfile.ZIP_STORED
+                        info.file_size = os.path.getsize(output_path)
+                        with open(output_path, 'rb') as source, archive.open(info, 'w') as target:
+                            while chunk := source.read(CHUNK_SIZE):
+                                target.write(chunk)
+                                yield sink.take()
+                        entry = {'file': document.name, 'signed_file': signed_name,
+                                 'pages_signed': pages, 'size': info.file_size}
+                        if optimization:
+                            entry['optimization'] = optimization
+                        report.append(entry)
+                        self._remove(input_path, output_path)
+                        yield sink.take()
+
+                archive.writestr(REPORT_NAME, json.dumps({
+                    'documents': len(self.documents),
+                    'signed': sum(1 for entry in report if 'signed_file' in entry),
+                    'failed': sum(1 for entry in report if 'error' in entry),
+                    'results': report
+                }, ensure_ascii=False, indent=2))
+            yield sink.take()
+        finally:
+            # Client déconnecté ou erreur : les documents pas encore commencés sont abandonnés
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.cleanup()
+
+    def cleanup(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
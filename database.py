@@ -3,12 +3,21 @@ Gestion de la base de données SQLite pour l'application
 """
 import sqlite3
 import bcrypt
+import json
 import secrets
 import os
 import re
+import queue
+import sys
+import threading
+import time
 from datetime import datetime
 from contextlib import contextmanager
 
+import executors
+import metrics
+from cache import LRUCache
+
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'signature_app.db')
 
 def is_valid_email(email):
@@ -16,11 +25,123 @@ def is_valid_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+# Réglages du pool de connexions SQLite
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(64 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '8192'))
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', '128'))
+
+class ConnectionPool:
+    """Pool de connexions SQLite (mode WAL) partagé entre les threads d'un worker"""
+
+    def __init__(self, path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.path = path
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _connect(self):
+        """Ouvre une nouvelle connexion et applique les pragmas de performance"""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        conn.row_factory = sqlite3.Row
+        # Avant le passage en WAL : ne prend effet qu'à la création de la base
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def acquire(self):
+        """Emprunte une connexion (réutilisée si possible, sinon créée)
+
+        Chaque emprunt est compté dans signature_db_pool_acquire_total selon
+        son issue : reused, created, waited (pool plein) ou timeout.
+        """
+        try:
+            conn = self._idle.get_nowait()
+            result = 'reused'
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.max_size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+                result = 'created'
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                    result = 'waited'
+                except queue.Empty:
+                    metrics.inc('signature_db_pool_acquire_total', result='timeout')
+                    raise sqlite3.OperationalError(
+                        'Pool de connexions SQLite saturé'
+                    )
+        metrics.inc('signature_db_pool_acquire_total', result=result)
+        return conn
+
+    def release(self, conn):
+        """Rend une connexion au pool"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Ferme toutes les connexions inactives"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Retourne le pool du processus courant (recréé après un fork de gunicorn)"""
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid() or pool.path != DATABASE_PATH:
+        with _pool_lock:
+            pool = _pool
+            if pool is None or pool.pid != os.getpid() or pool.path != DATABASE_PATH:
+                pool = ConnectionPool(DATABASE_PATH)
+                _pool = pool
+    return pool
 @contextmanager
 def get_db():
-    """Context manager pour la connexion à la base de données"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+    """Context manager pour la connexion à la base de données
+
+    Le temps d'attente du pool et la durée d'utilisation de la connexion
+    sont mesurés, par fonction appelante (signature_db_duration_seconds).
+    """
+    caller = sys._getframe(2).f_code.co_name  # Fonction du module qui utilise la connexion
+    pool = get_pool()
+    start = time.perf_counter()
+    conn = pool.acquire()
+    acquired = time.perf_counter()
+    metrics.observe('signature_db_pool_wait_seconds', acquired - start)
     try:
         yield conn
         conn.commit()
@@ -28,7 +149,8 @@ def get_db():
         conn.rollback()
         raise e
     finally:
-        conn.close()
+        pool.release(conn)
+        metrics.observe('signature_db_duration_seconds', time.perf_counter() - acquired, function=caller)
 
 def init_db():
     """Initialise la base de données avec les tables nécessaires"""
@@ -85,19 +207,169 @@ def init_db():
             )
         ''')
         
+        # Contenus PDF uploadés, adressés par SHA-256 et comptés par référence
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                num_pages INTEGER NOT NULL,
+                geometry TEXT,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Uploads (un par file_id) pointant vers un contenu
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS uploads (
+                file_id TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                user_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (sha256) REFERENCES upload_blobs (sha256),
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE SET NULL
+            )
+        ''')
+        
+        # File d'attente des signatures asynchrones
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sign_jobs (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER,
+                status TEXT NOT NULL DEFAULT 'queued',
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                worker_pid INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE SET NULL
+            )
+        ''')
+        
+        migrate(conn)
+        
         print("Base de donnees initialisee avec succes")
 
-def hash_password(password):
-    """Hash un mot de passe avec bcrypt (12 rounds)"""
+# Migrations du schéma : (version, description, instructions SQL ou fonctions
+# recevant la connexion), appliquées dans l'ordre par migrate() ; la version
+# courante est PRAGMA user_version.
+# Ne jamais modifier une migration publiée : en ajouter une nouvelle.
+MIGRATIONS = [
+    (1, 'Index de l\'historique, des signatures et des sessions', [
+        # get_user_history : WHERE user_id = ? ORDER BY created_at DESC
+        'CREATE INDEX IF NOT EXISTS idx_history_user_created ON signature_history (user_id, created_at, id)',
+        # clean_old_files : historique anonyme uniquement (index partiel)
+        'CREATE INDEX IF NOT EXISTS idx_history_anonymous ON signature_history (created_at) WHERE user_id IS NULL',
+        # Nettoyage des PDF signés orphelins
+        'CREATE INDEX IF NOT EXISTS idx_history_signed_filename ON signature_history (signed_filename)',
+        # get_user_signatures
+        'CREATE INDEX IF NOT EXISTS idx_signatures_user_created ON saved_signatures (user_id, created_at)',
+        # Purge des sessions expirées, suppression des sessions d'un utilisateur
+        'CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id)',
+    ]),
+    (2, 'Index des uploads et de la file de signature', [
+        'CREATE INDEX IF NOT EXISTS idx_uploads_created ON uploads (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_uploads_sha256 ON uploads (sha256)',
+        'CREATE INDEX IF NOT EXISTS idx_sign_jobs_status ON sign_jobs (status, created_at)',
+    ]),
+    (3, 'Images des signatures sauvegardées dans signature_blobs', [
+        '''CREATE TABLE IF NOT EXISTS signature_blobs (
+               sha256 TEXT PRIMARY KEY,
+               data BLOB NOT NULL,
+               width INTEGER NOT NULL,
+               height INTEGER NOT NULL,
+               size INTEGER NOT NULL,
+               original_size INTEGER NOT NULL,
+               thumbnail BLOB,
+               ref_count INTEGER NOT NULL DEFAULT 0,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )''',
+        'ALTER TABLE saved_signatures ADD COLUMN blob_sha256 TEXT REFERENCES signature_blobs (sha256)',
+        lambda conn: _migrate_legacy_signatures(conn),
+    ]),
+    # Les contenus existants gardent content_box NULL : image non recadrée (cadre complet)
+    (4, 'Cadre des signatures recadrées sur leur encre', [
+        'ALTER TABLE signature_blobs ADD COLUMN content_box TEXT',
+    ]),
+    (5, 'Signe de vie des jobs de signature en cours', [
+        'ALTER TABLE sign_jobs ADD COLUMN heartbeat_at TIMESTAMP',
+    ]),
+    # Deux signatures de même encre mais de marges différentes partagent un
+    # contenu : le cadre est propre à chaque signature sauvegardée. Celles qui
+    # partageaient déjà un contenu gardent le cadre enregistré avec lui ;
+    # signature_blobs.content_box n'est plus écrite.
+    (6, 'Cadre des signatures porté par chaque signature sauvegardée', [
+        'ALTER TABLE saved_signatures ADD COLUMN content_box TEXT',
+        '''UPDATE saved_signatures SET content_box = (
+               SELECT b.content_box FROM signature_blobs b WHERE b.sha256 = saved_signatures.blob_sha256
+           )''',
+    ]),
+]
+
+def schema_version(conn):
+    """Version du schéma enregistrée dans la base"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def _migrate_legacy_signatures(conn):
+    import signatures  # Import tardif : signatures dépend de ce module
+    signatures.migrate_legacy(conn)
+
+def migrate(conn):
+    """Applique les migrations en attente ; retourne la liste des versions appliquées
+
+    Chaque migration s'exécute dans une transaction BEGIN IMMEDIATE : si
+    plusieurs workers démarrent en même temps, un seul l'applique.
+    """
+    applied = []
+    if conn.in_transaction:
+        conn.commit()
+    for version, description, statements in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migration {version} appliquée : {description}")
+        applied.append(version)
+    if applied:
+        conn.execute('ANALYZE')
+    return applied
+
+def _bcrypt_hash(password):
+    """Hachage bcrypt (exécuté dans le pool de processus 'auth')"""
     salt = bcrypt.gensalt(rounds=12)
     return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
 
+def _bcrypt_check(password, password_hash):
+    """Vérification bcrypt (exécutée dans le pool de processus 'auth')"""
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+def hash_password(password):
+    """Hash un mot de passe avec bcrypt (12 rounds), hors du worker HTTP"""
+    return executors.run('auth', _bcrypt_hash, password)
+
 def verify_password(password, password_hash):
     """Vérifie un mot de passe contre son hash (bcrypt ou ancien SHA-256)"""
     try:
         # Vérifier si c'est un hash bcrypt (commence par $2b$ ou $2a$ ou $2y$)
         if password_hash.startswith(('$2b$', '$2a$', '$2y$')):
-            return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+            return executors.run('auth', _bcrypt_check, password, password_hash)
         else:
             # Ancien format SHA-256 avec salt (format: hash:salt)
             import hashlib
@@ -108,6 +380,8 @@ def verify_password(password, password_hash):
             except ValueError:
                 # Si le format n'est pas reconnu, retourner False
                 return False
+    except executors.Saturated:
+        raise
     except Exception as e:
         print(f"Erreur de vérification du mot de passe: {e}")
         return False
@@ -122,10 +396,11 @@ def create_user(email, password, name=None):
     if len(password) < 6:
         raise ValueError("Le mot de passe doit contenir au moins 6 caractères")
     
+    # Hachage avant de prendre une connexion du pool (plusieurs centaines de ms)
+    password_hash = hash_password(password)
+    
     with get_db() as conn:
         cursor = conn.cursor()
-        password_hash = hash_password(password)
-        
         try:
             cursor.execute(
                 'INSERT INTO users (email, password_hash, name) VALUES (?, ?, ?)',
@@ -141,26 +416,32 @@ def authenticate_user(email, password):
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM users WHERE email = ?', (email.lower(),))  # Email en minuscules
         user = cursor.fetchone()
-        
-        if user and verify_password(password, user['password_hash']):
-            # Mise à jour du last_login
+    
+    # Vérification hors connexion : le pool n'est pas bloqué pendant bcrypt
+    if not user or not verify_password(password, user['password_hash']):
+        return None
+    
+    with get_db() as conn:
+        cursor = conn.cursor()
+        # Mise à jour du last_login
+        cursor.execute(
+            'UPDATE users SET last_login = ? WHERE id = ?',
+            (datetime.now(), user['id'])
+        )
+    
+    # Migration automatique du hash si nécessaire
+    # Si l'utilisateur a un ancien hash SHA-256, le migrer vers bcrypt
+    if not user['password_hash'].startswith(('$2b$', '$2a$', '$2y$')):
+        new_hash = hash_password(password)
+        with get_db() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                'UPDATE users SET last_login = ? WHERE id = ?',
-                (datetime.now(), user['id'])
+                'UPDATE users SET password_hash = ? WHERE id = ?',
+                (new_hash, user['id'])
             )
-            
-            # Migration automatique du hash si nécessaire
-            # Si l'utilisateur a un ancien hash SHA-256, le migrer vers bcrypt
-            if not user['password_hash'].startswith(('$2b$', '$2a$', '$2y$')):
-                new_hash = hash_password(password)
-                cursor.execute(
-                    'UPDATE users SET password_hash = ? WHERE id = ?',
-                    (new_hash, user['id'])
-                )
-                print(f"Mot de passe migré vers bcrypt pour l'utilisateur {email}")
-            
-            return dict(user)
-        return None
+        print(f"Mot de passe migré vers bcrypt pour l'utilisateur {email}")
+    
+    return dict(user)
 
 def create_session(user_id):
     """Crée une session pour un utilisateur"""
@@ -178,54 +459,163 @@ def create_session(user_id):
     
     return token
 
+# Cache des sessions (token -> utilisateur) devant get_user_by_token
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '4096'))
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', '60'))
+
+_session_cache = LRUCache(max_entries=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+_session_epoch = None
+
+def _session_epoch_path():
+    """Fichier témoin partagé par les workers pour propager les révocations"""
+    return DATABASE_PATH + '.sessions-epoch'
+
+def _bump_session_epoch():
+    """Signale aux autres workers qu'une session a été révoquée"""
+    path = _session_epoch_path()
+    try:
+        with open(path, 'a'):
+            os.utime(path, None)
+    except OSError as e:
+        print(f"Impossible de signaler la révocation de session: {e}")
+
+def _sync_session_epoch():
+    """Vide le cache local si une révocation a eu lieu dans un autre worker"""
+    global _session_epoch
+    try:
+        epoch = os.stat(_session_epoch_path()).st_mtime_ns
+    except OSError:
+        epoch = None
+    if epoch != _session_epoch:
+        _session_cache.clear()
+        _session_epoch = epoch
+
+def invalidate_user_sessions(user_id):
+    """Retire du cache toutes les sessions d'un utilisateur"""
+    _session_cache.delete_where(lambda token, entry: entry[0]['id'] == user_id)
+    _bump_session_epoch()
+
 def get_user_by_token(token):
     """Récupère un utilisateur par son token de session"""
+    _sync_session_epoch()
+    now = datetime.now()
+    
+    cached = _session_cache.get(token)
+    if cached is not None:
+        user, expires_at = cached
+        if expires_at > now:
+            metrics.inc('signature_session_cache_total', result='hit')
+            return dict(user)
+        _session_cache.delete(token)
+    metrics.inc('signature_session_cache_total', result='miss')
+    
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT u.* FROM users u
+            SELECT u.id, u.email, u.name, u.created_at, u.last_login, s.expires_at
+            FROM users u
             JOIN sessions s ON u.id = s.user_id
             WHERE s.token = ? AND s.expires_at > ?
-        ''', (token, datetime.now()))
+        ''', (token, now))
         
-        user = cursor.fetchone()
-        return dict(user) if user else None
+        row = cursor.fetchone()
+        if not row:
+            return None
+    
+    user = dict(row)
+    expires_at = user.pop('expires_at')
+    if isinstance(expires_at, str):
+        expires_at = datetime.fromisoformat(expires_at)
+    _session_cache.set(token, (user, expires_at))
+    return dict(user)
 
 def delete_session(token):
     """Supprime une session (déconnexion)"""
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM sessions WHERE token = ?', (token,))
+    
+    _session_cache.delete(token)
+    _bump_session_epoch()
 
-def save_signature(user_id, name, signature_data):
-    """Sauvegarde une signature pour un utilisateur"""
+def upsert_signature_blob(conn, image):
+    """Enregistre un contenu de signature (ou incrémente son compteur de références)"""
+    conn.execute(
+        '''INSERT INTO signature_blobs
+           (sha256, data, width, height, size, original_size, thumbnail, ref_count)
+           VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+           ON CONFLICT (sha256) DO UPDATE SET ref_count = ref_count + 1''',
+        (image.sha256, image.data, image.width, image.height, len(image.data),
+         image.original_size, image.thumbnail)
+    )
+
+def save_signature(user_id, name, image):
+    """Sauvegarde une signature (image normalisée) pour un utilisateur
+
+    Le contenu est partagé entre signatures d'encre identique ; le cadre
+    (content_box), qui dépend des marges de l'image envoyée, reste propre à
+    la signature.
+    """
     with get_db() as conn:
         cursor = conn.cursor()
+        upsert_signature_blob(conn, image)
         cursor.execute(
-            'INSERT INTO saved_signatures (user_id, name, signature_data) VALUES (?, ?, ?)',
-            (user_id, name, signature_data)
+            '''INSERT INTO saved_signatures (user_id, name, signature_data, blob_sha256, content_box)
+               VALUES (?, ?, '', ?, ?)''',
+            (user_id, name, image.sha256, json.dumps(image.box))
         )
         return cursor.lastrowid
 
 def get_user_signatures(user_id):
-    """Récupère toutes les signatures sauvegardées d'un utilisateur"""
+    """Récupère les signatures sauvegardées d'un utilisateur (métadonnées et miniatures)"""
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            'SELECT * FROM saved_signatures WHERE user_id = ? ORDER BY created_at DESC',
+            '''SELECT s.id, s.name, s.created_at, s.blob_sha256 AS sha256,
+                      b.width, b.height, b.size, b.original_size, b.thumbnail
+               FROM saved_signatures s
+               LEFT JOIN signature_blobs b ON b.sha256 = s.blob_sha256
+               WHERE s.user_id = ? ORDER BY s.created_at DESC''',
             (user_id,)
         )
         return [dict(row) for row in cursor.fetchall()]
 
+def get_signature(signature_id, user_id):
+    """Récupère une signature sauvegardée d'un utilisateur, avec son image (data)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''SELECT s.*, b.data
+               FROM saved_signatures s
+               LEFT JOIN signature_blobs b ON b.sha256 = s.blob_sha256
+               WHERE s.id = ? AND s.user_id = ?''',
+            (signature_id, user_id)
+        )
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
 def delete_signature(signature_id, user_id):
-    """Supprime une signature sauvegardée"""
+    """Supprime une signature sauvegardée (et son image si plus référencée)"""
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            'DELETE FROM saved_signatures WHERE id = ? AND user_id = ?',
+            'SELECT blob_sha256 FROM saved_signatures WHERE id = ? AND user_id = ?',
             (signature_id, user_id)
         )
-        return cursor.rowcount > 0
+        row = cursor.fetchone()
+        if not row:
+            return False
+        cursor.execute('DELETE FROM saved_signatures WHERE id = ?', (signature_id,))
+        if row['blob_sha256']:
+            cursor.execute(
+                'UPDATE signature_blobs SET ref_count = ref_count - 1 WHERE sha256 = ?',
+                (row['blob_sha256'],)
+            )
+            cursor.execute(
+                'DELETE FROM signature_blobs WHERE sha256 = ? AND ref_count <= 0',
+                (row['blob_sha256'],)
+            )
+        return True
 
 def add_to_history(user_id, original_filename, signed_filename, file_path, signature_page):
     """Ajoute une entrée à l'historique des signatures"""
@@ -239,43 +629,373 @@ def add_to_history(user_id, original_filename, signed_filename, file_path, signa
         )
         return cursor.lastrowid
 
-def get_user_history(user_id, limit=50):
-    """Récupère l'historique des signatures d'un utilisateur"""
+HISTORY_FIELDS = ('id', 'user_id', 'original_filename', 'signed_filename',
+                  'file_path', 'signature_page', 'created_at')
+
+def get_user_history(user_id, limit=50, before=None, fields=None):
+    """Récupère une page de l'historique des signatures d'un utilisateur
+
+    Pagination par clé : before = (created_at, id) de la dernière entrée de la
+    page précédente. fields restreint les colonnes retournées (id et
+    created_at sont toujours inclus, ils servent de curseur).
+    """
+    columns = [f for f in HISTORY_FIELDS if not fields or f in fields or f in ('id', 'created_at')]
+    query = f'SELECT {", ".join(columns)} FROM signature_history WHERE user_id = ?'
+    params = [user_id]
+    if before is not None:
+        query += ' AND (created_at, id) < (?, ?)'
+        params.extend(before)
+    query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+    params.append(limit)
+    
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+def count_user_history(user_id):
+    """Nombre d'entrées de l'historique d'un utilisateur"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM signature_history WHERE user_id = ?', (user_id,))
+        return cursor.fetchone()[0]
+
+def get_history_entry(user_id, history_id):
+    """Récupère une entrée de l'historique d'un utilisateur"""
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            '''SELECT * FROM signature_history 
-               WHERE user_id = ? 
-               ORDER BY created_at DESC 
-               LIMIT ?''',
-            (user_id, limit)
+            'SELECT * FROM signature_history WHERE id = ? AND user_id = ?',
+            (history_id, user_id)
         )
-        return [dict(row) for row in cursor.fetchall()]
+        row = cursor.fetchone()
+        return dict(row) if row else None
 
-def clean_old_files():
-    """Nettoie les fichiers non associés à un utilisateur de plus de 24h"""
-    from datetime import timedelta
-    
+def get_upload_blob(sha256):
+    """Récupère les métadonnées d'un contenu uploadé par son empreinte"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM upload_blobs WHERE sha256 = ?', (sha256,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+def add_upload(file_id, sha256, size, num_pages, geometry, filename, user_id=None):
+    """Enregistre un upload et incrémente le compteur de références de son contenu"""
     with get_db() as conn:
         cursor = conn.cursor()
-        cutoff_date = datetime.now() - timedelta(hours=24)
-        
-        # Récupère les fichiers à supprimer
         cursor.execute(
-            '''SELECT file_path FROM signature_history 
-               WHERE user_id IS NULL AND created_at < ?''',
-            (cutoff_date,)
+            '''INSERT INTO upload_blobs (sha256, size, num_pages, geometry, ref_count)
+               VALUES (?, ?, ?, ?, 1)
+               ON CONFLICT (sha256) DO UPDATE SET ref_count = ref_count + 1''',
+            (sha256, size, num_pages, geometry)
         )
-        
-        files_to_delete = [row['file_path'] for row in cursor.fetchall()]
-        
-        # Supprime les entrées de l'historique
         cursor.execute(
-            'DELETE FROM signature_history WHERE user_id IS NULL AND created_at < ?',
-            (cutoff_date,)
+            'INSERT INTO uploads (file_id, sha256, filename, user_id) VALUES (?, ?, ?, ?)',
+            (file_id, sha256, filename, user_id)
         )
-        
-        return files_to_delete
+
+def get_upload(file_id):
+    """Récupère un upload et les métadonnées de son contenu"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''SELECT u.*, b.size, b.num_pages, b.geometry
+               FROM uploads u JOIN upload_blobs b ON b.sha256 = u.sha256
+               WHERE u.file_id = ?''',
+            (file_id,)
+        )
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+def delete_upload(file_id):
+    """Supprime un upload ; retourne l'empreinte du contenu s'il n'est plus référencé"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT sha256 FROM uploads WHERE file_id = ?', (file_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        sha256 = row['sha256']
+        cursor.execute('DELETE FROM uploads WHERE file_id = ?', (file_id,))
+        cursor.execute(
+            'UPDATE upload_blobs SET ref_count = ref_count - 1 WHERE sha256 = ?',
+            (sha256,)
+        )
+        cursor.execute(
+            'DELETE FROM upload_blobs WHERE sha256 = ? AND ref_count <= 0',
+            (sha256,)
+        )
+        return sha256 if cursor.rowcount > 0 else None
+
+def create_sign_job(job_id, user_id, payload):
+    """Ajoute un job de signature à la file d'attente"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT INTO sign_jobs (id, user_id, payload) VALUES (?, ?, ?)',
+            (job_id, user_id, payload)
+        )
+
+def get_sign_job(job_id):
+    """Récupère un job de signature"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM sign_jobs WHERE id = ?', (job_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+# Horodatage UTC (comme CURRENT_TIMESTAMP des colonnes created_at), à la milliseconde
+SQL_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+def claim_sign_job(worker_pid):
+    """Réclame le plus ancien job en attente ; None si la file est vide
+
+    La mise à jour conditionnelle (status = 'queued') garantit qu'un job n'est
+    réclamé que par un seul worker, même si plusieurs le voient en même temps.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT id FROM sign_jobs WHERE status = ? ORDER BY created_at, rowid LIMIT 1',
+            ('queued',)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        cursor.execute(
+            f'''UPDATE sign_jobs SET status = 'running', worker_pid = ?,
+                       started_at = {SQL_NOW}, heartbeat_at = {SQL_NOW}
+                WHERE id = ? AND status = ?''',
+            (worker_pid, row['id'], 'queued')
+        )
+        if cursor.rowcount == 0:
+            return None
+        cursor.execute('SELECT * FROM sign_jobs WHERE id = ?', (row['id'],))
+        return dict(cursor.fetchone())
+
+def finish_sign_job(job_id, result):
+    """Marque un job comme terminé"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''UPDATE sign_jobs SET status = 'done', result = ?, finished_at = {SQL_NOW}
+                WHERE id = ?''',
+            (result, job_id)
+        )
+
+def fail_sign_job(job_id, error):
+    """Marque un job comme échoué"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''UPDATE sign_jobs SET status = 'failed', error = ?, finished_at = {SQL_NOW}
+                WHERE id = ?''',
+            (error, job_id)
+        )
+
+def requeue_sign_job(job_id):
+    """Remet en attente un job réclamé mais jamais lancé (pool de calcul indisponible)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''UPDATE sign_jobs SET status = 'queued', worker_pid = NULL, started_at = NULL,
+                      heartbeat_at = NULL
+               WHERE id = ? AND status = ?''',
+            (job_id, 'running')
+        )
+
+def touch_sign_jobs(job_ids):
+    """Signe de vie des jobs en cours d'exécution par le worker courant"""
+    job_ids = list(job_ids)
+    if not job_ids:
+        return
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''UPDATE sign_jobs SET heartbeat_at = {SQL_NOW}
+                WHERE status = 'running' AND id IN ({','.join('?' * len(job_ids))})''',
+            job_ids
+        )
+
+def requeue_stale_sign_jobs(timeout_seconds):
+    """Remet en attente les jobs en cours sans signe de vie depuis timeout_seconds (worker mort)
+
+    Un job dont le worker est vivant est rafraîchi par touch_sign_jobs, quelle
+    que soit sa durée : il n'est jamais exécuté deux fois.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''UPDATE sign_jobs SET status = 'queued', worker_pid = NULL, started_at = NULL,
+                       heartbeat_at = NULL
+                WHERE status = 'running'
+                  AND COALESCE(heartbeat_at, started_at) < strftime('%Y-%m-%d %H:%M:%f', 'now', ?)''',
+            (f'-{int(timeout_seconds)} seconds',)
+        )
+        return cursor.rowcount
+
+def count_sign_jobs(status):
+    """Nombre de jobs dans un état donné"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM sign_jobs WHERE status = ?', (status,))
+        return cursor.fetchone()[0]
+
+def sign_job_position(job_id):
+    """Position (1 = prochain) d'un job en attente dans la file"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''SELECT COUNT(*) FROM sign_jobs
+               WHERE status = 'queued'
+                 AND rowid <= (SELECT rowid FROM sign_jobs WHERE id = ?)''',
+            (job_id,)
+        )
+        return cursor.fetchone()[0]
+
+def sign_job_counts():
+    """Nombre de jobs par état et âge (secondes) du plus ancien job en attente"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT status, COUNT(*) AS n FROM sign_jobs GROUP BY status')
+        counts = {status: 0 for status in ('queued', 'running', 'done', 'failed')}
+        counts.update({row['status']: row['n'] for row in cursor.fetchall()})
+        cursor.execute(
+            """SELECT (julianday('now') - julianday(MIN(created_at))) * 86400
+               FROM sign_jobs WHERE status = 'queued'"""
+        )
+        age = cursor.fetchone()[0]
+        return {'jobs': counts, 'oldest_queued_age': round(age, 3) if age is not None else None}
+
+def clean_old_files(hours=24, batch_size=500):
+    """Nettoie les fichiers non associés à un utilisateur de plus de 24h
+
+    Les entrées sont supprimées par lots de batch_size pour ne pas verrouiller
+    la base longtemps ; retourne les chemins des fichiers à effacer.
+    """
+    files_to_delete = []
+    while True:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            # Récupère un lot de fichiers à supprimer
+            cursor.execute(
+                '''SELECT id, file_path FROM signature_history 
+                   WHERE user_id IS NULL AND created_at < datetime('now', ?)
+                   LIMIT ?''',
+                (f'-{hours} hours', batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return files_to_delete
+            
+            # Supprime les entrées de l'historique
+            cursor.executemany(
+                'DELETE FROM signature_history WHERE id = ?',
+                [(row['id'],) for row in rows]
+            )
+            files_to_delete.extend(row['file_path'] for row in rows)
+        if len(rows) < batch_size:
+            return files_to_delete
+
+def delete_expired_sessions(batch_size=1000):
+    """Supprime les sessions expirées par lots ; retourne le nombre supprimé"""
+    deleted = 0
+    while True:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''DELETE FROM sessions WHERE id IN (
+                       SELECT id FROM sessions WHERE expires_at < ? LIMIT ?
+                   )''',
+                (datetime.now(), batch_size)
+            )
+            deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
+
+def get_expired_uploads(hours, limit=500):
+    """Identifiants des uploads de plus de hours heures"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''SELECT file_id FROM uploads
+               WHERE created_at < datetime('now', ?)
+               LIMIT ?''',
+            (f'-{hours} hours', limit)
+        )
+        return [row['file_id'] for row in cursor.fetchall()]
+
+def get_referenced_signed_files(filenames):
+    """Parmi filenames, ceux encore référencés par l'historique"""
+    referenced = set()
+    filenames = list(filenames)
+    with get_db() as conn:
+        cursor = conn.cursor()
+        for i in range(0, len(filenames), 500):
+            chunk = filenames[i:i + 500]
+            cursor.execute(
+                f'''SELECT signed_filename FROM signature_history
+                    WHERE signed_filename IN ({','.join('?' * len(chunk))})''',
+                chunk
+            )
+            referenced.update(row['signed_filename'] for row in cursor.fetchall())
+    return referenced
+
+def delete_finished_sign_jobs(hours, batch_size=1000):
+    """Supprime les jobs de signature terminés depuis plus de hours heures"""
+    deleted = 0
+    while True:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''DELETE FROM sign_jobs WHERE id IN (
+                       SELECT id FROM sign_jobs
+                       WHERE status IN ('done', 'failed') AND created_at < datetime('now', ?)
+                       LIMIT ?
+                   )''',
+                (f'-{hours} hours', batch_size)
+            )
+            deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
+
+def optimize_db(vacuum_pages=None):
+    """PRAGMA optimize puis vacuum incrémental ; retourne les pages libérées et leur taille"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+        freelist_before = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+        auto_vacuum = cursor.execute('PRAGMA auto_vacuum').fetchone()[0]
+        cursor.execute('PRAGMA optimize')
+    
+    # incremental_vacuum ne fonctionne qu'en mode auto_vacuum = INCREMENTAL (2)
+    if auto_vacuum == 2 and freelist_before:
+        # executescript exécute le pragma jusqu'au bout (execute ne libère qu'une page)
+        with get_db() as conn:
+            if vacuum_pages:
+                conn.executescript(f'PRAGMA incremental_vacuum({int(vacuum_pages)});')
+            else:
+                conn.executescript('PRAGMA incremental_vacuum;')
+    
+    with get_db() as conn:
+        freelist_after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return {
+        'auto_vacuum': auto_vacuum,
+        'freelist_pages': freelist_after,
+        'reclaimed_bytes': max(0, freelist_before - freelist_after) * page_size
+    }
+
+def enable_incremental_vacuum():
+    """Passe une base existante en auto_vacuum INCREMENTAL (VACUUM complet, à faire hors charge)"""
+    with get_db() as conn:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return False
+    with get_db() as conn:
+        conn.commit()
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.commit()
+        conn.execute('VACUUM')
+    return True
 
 def delete_user_history(user_id):
     """Supprime tout l'historique d'un utilisateur"""
@@ -296,6 +1016,7 @@ def delete_user(user_id):
             # Les DELETE CASCADE dans le schema s'occupent de supprimer
             # les signatures, l'historique et les sessions
             cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        invalidate_user_sessions(user_id)
         return True
     except Exception as e:
         print(f"Erreur lors de la suppression de l'utilisateur: {e}")
@@ -0,0 +1,102 @@
+"""
+Téléchargement des PDF signés
+
+Les réponses portent un ETag fort dérivé du SHA-256 du fichier et un
+Last-Modified, si bien qu'un client qui a déjà le document reçoit un 304,
+et les requêtes Range (reprise d'un téléchargement interrompu) sont servies
+en 206. Trois modes (DELIVERY_MODE) :
+
+- direct : le worker envoie le fichier (via wsgi.file_wrapper, donc
+  sendfile() sous gunicorn) ;
+- x-accel : nginx sert le fichier depuis une location interne
+  (X-Accel-Redirect vers X_ACCEL_PREFIX + nom du fichier) ;
+- x-sendfile : Apache (mod_xsendfile) ou lighttpd sert le fichier.
+
+Dans les deux derniers modes, le worker ne fait que vérifier les droits et
+les en-têtes conditionnels ; les octets (et les Range) sont gérés par le
+proxy sans passer par Python.
+"""
+import hashlib
+import os
+from urllib.parse import quote
+
+from flask import Response, request, send_file
+
+import metrics
+from cache import LRUCache
+
+DELIVERY_MODE = os.environ.get('DELIVERY_MODE', 'direct')  # direct, x-accel ou x-sendfile
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/_signed/')
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+def _content_disposition(download_name):
+    """En-tête Content-Disposition d'une pièce jointe (nom non ASCII encodé selon RFC 5987)"""
+    try:
+        download_name.encode('ascii')
+        return f'attachment; filename="{download_name}"'
+    except UnicodeEncodeError:
+        fallback = download_name.encode('ascii', 'ignore').decode('ascii') or 'document.pdf'
+        return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(download_name, safe='')}"
+
+class SignedFileDelivery:
+    """Sert les PDF d'un dossier avec ETag (SHA-256), Range et délégation au proxy"""
+
+    def __init__(self, folder, mode=DELIVERY_MODE, accel_prefix=X_ACCEL_PREFIX):
+        if mode not in ('direct', 'x-accel', 'x-sendfile'):
+            raise ValueError(f'DELIVERY_MODE inconnu : {mode}')
+        self.folder = os.path.abspath(folder)
+        self.mode = mode
+        self.accel_prefix = accel_prefix.rstrip('/') + '/'
+        # (chemin, inode, taille, mtime) -> SHA-256 : un fichier réécrit change d'entrée
+        self._digests = LRUCache(max_entries=4096)
+
+    def resolve(self, name):
+        """Chemin d'un fichier du dossier, ou None s'il n'existe pas"""
+        if not name or os.path.basename(name) != name:
+            return None
+        path = os.path.join(self.folder, name)
+        return path if os.path.isfile(path) else None
+
+    def digest(self, path, stat=None):
+        """SHA-256 du fichier, calculé une fois par version du fichier"""
+        stat = stat or os.stat(path)
+        key = (path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            sha256 = hashlib.sha256()
+            with metrics.stage('download_digest'), open(path, 'rb') as f:
+                while chunk := f.read(DIGEST_CHUNK_SIZE):
+                    sha256.update(chunk)
+            digest = sha256.hexdigest()
+            self._digests.set(key, digest)
+        return digest
+
+    def send(self, name, download_name):
+        """Réponse de téléchargement du fichier name (200, 206, 304 ou 416)"""
+        path = os.path.join(self.folder, name)
+        stat = os.stat(path)
+        etag = self.digest(path, stat)
+
+        if self.mode == 'direct':
+            response = send_file(path, mimetype='application/pdf', as_attachment=True,
+                                 download_name=download_name, etag=etag,
+                                 last_modified=stat.st_mtime, conditional=True)
+            response.accept_ranges = 'bytes'  # Annoncé dès la réponse complète (reprise possible)
+        else:
+            response = Response(mimetype='application/pdf')
+            response.headers['Content-Disposition'] = _content_disposition(download_name)
+            response.set_etag(etag)
+            response.last_modified = stat.st_mtime
+            response = response.make_conditional(request)
+            if response.status_code != 304:
+                # Corps et Range servis par le proxy ; le worker ne lit pas le fichier
+                if self.mode == 'x-accel':
+                    response.headers['X-Accel-Redirect'] = self.accel_prefix + quote(name)
+                else:
+                    response.headers['X-Sendfile'] = path
+
+        # Document d'un utilisateur : jamais dans un cache partagé, revalidé par ETag
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
@@ -0,0 +1,244 @@
+"""
+Exécution des tâches CPU (fusion PDF, hachage bcrypt) hors du worker HTTP
+
+Chaque type de tâche dispose de son propre pool de processus, borné en
+nombre de tâches en cours et en attente : une rafale de connexions (bcrypt)
+ne peut donc pas affamer la signature, et inversement. Quand un pool est
+saturé, la tâche est refusée immédiatement (Saturated, traduit en 503 +
+Retry-After) plutôt que de laisser les requêtes s'empiler.
+
+Ces bornes sont propres à chaque worker ; le travail PDF est en plus plafonné
+globalement (PDF_GLOBAL_CONCURRENCY tâches, tous workers confondus) par un
+SlotPool : chaque tâche tient un verrou flock() sur l'un des fichiers de
+place de EXECUTOR_SLOTS_DIR, libéré par le noyau si le processus meurt.
+"""
+import bisect
+import fcntl
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+EXECUTOR_MODE = os.environ.get('EXECUTOR_MODE', 'process')  # process ou inline (débogage)
+EXECUTOR_TIMEOUT = float(os.environ.get('EXECUTOR_TIMEOUT', '60'))
+EXECUTOR_RETRY_AFTER = int(os.environ.get('EXECUTOR_RETRY_AFTER', '5'))
+EXECUTOR_SLOTS_DIR = os.environ.get('EXECUTOR_SLOTS_DIR') or os.path.join(tempfile.gettempdir(), 'signature-slots')
+PDF_GLOBAL_CONCURRENCY = int(os.environ.get('PDF_GLOBAL_CONCURRENCY', str(os.cpu_count() or 2)))
+PDF_SLOT_WAIT = float(os.environ.get('PDF_SLOT_WAIT', '2'))  # Attente max d'une place globale avant 503
+
+# Bornes (en secondes) des histogrammes de latence
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Saturated(Exception):
+    """Le pool de ce type de tâche est plein (ou n'a pas répondu à temps)"""
+
+    def __init__(self, kind, retry_after=EXECUTOR_RETRY_AFTER):
+        super().__init__(f'Pool {kind} saturé')
+        self.kind = kind
+        self.retry_after = retry_after
+
+class LatencyHistogram:
+    """Histogramme cumulatif de latences, à bornes fixes"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Dernière case : au-delà de la plus grande borne
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def quantile(self, q):
+        """Estimation d'un quantile (borne supérieure du seau qui le contient)"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for bound, n in zip(self.buckets, self.counts):
+                seen += n
+                if seen >= rank:
+                    return bound
+            return float('inf')
+
+    def snapshot(self):
+        with self._lock:
+            cumulative = []
+            seen = 0
+            for bound, n in zip(self.buckets, self.counts):
+                seen += n
+                cumulative.append((bound, seen))
+            count, total = self.count, self.sum
+        return {
+            'count': count,
+            'sum': round(total, 6),
+            'buckets': [[bound, n] for bound, n in cumulative],  # [borne, nombre cumulé]
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99)
+        }
+
+class SlotPool:
+    """Plafond de tâches simultanées partagé entre processus : un verrou flock() par place"""
+
+    def __init__(self, name, slots, folder=EXECUTOR_SLOTS_DIR):
+        self.slots = max(1, slots)
+        self.paths = [os.path.join(folder, f'{name}-{i}.lock') for i in range(self.slots)]
+        self.folder = folder
+
+    def _try_acquire(self):
+        start = random.randrange(self.slots)  # Répartit les essais entre les places
+        for path in self.paths[start:] + self.paths[:start]:
+            try:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+            except FileNotFoundError:
+                os.makedirs(self.folder, exist_ok=True)
+                fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def acquire(self, timeout=PDF_SLOT_WAIT):
+        """Descripteur de la place obtenue, ou None si aucune ne se libère avant timeout"""
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while True:
+            fd = self._try_acquire()
+            if fd is not None or time.monotonic() >= deadline:
+                return fd
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def release(self, fd):
+        # Déverrouillage explicite : un processus forké entre-temps (pool de calcul)
+        # a hérité du descripteur, le fermer ici ne suffirait pas
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+class TaskPool:
+    """Pool de processus d'un type de tâche, avec file d'attente bornée"""
+
+    def __init__(self, kind, workers, max_pending, global_slots=None):
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.max_pending = max(0, max_pending)
+        self.global_slots = global_slots
+        self.latency = LatencyHistogram()
+        self.submitted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.in_flight = 0
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        """Pool du processus courant (recréé après un fork)"""
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            self._executor = None
+
+    def run(self, fn, *args, timeout=EXECUTOR_TIMEOUT):
+        """Exécute fn(*args) dans le pool et retourne son résultat
+
+        Lève Saturated si le pool est plein, si aucune place globale ne se libère
+        à temps ou si la tâche dépasse timeout.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise Saturated(self.kind)
+        lease = None
+        if self.global_slots is not None:
+            lease = self.global_slots.acquire()
+            if lease is None:
+                self._slots.release()
+                with self._lock:
+                    self.rejected += 1
+                raise Saturated(self.kind)
+        with self._lock:
+            self.submitted += 1
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            if EXECUTOR_MODE == 'inline':
+                return fn(*args)
+            future = self._get_executor().submit(fn, *args)
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeout:
+                future.cancel()
+                raise Saturated(self.kind)
+        except BrokenProcessPool:
+            # Un processus du pool est mort (OOM...) : le pool sera recréé
+            self._reset_executor()
+            with self._lock:
+                self.failed += 1
+            raise
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - start)
+            with self._lock:
+                self.in_flight -= 1
+            if lease is not None:
+                self.global_slots.release(lease)
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'global_slots': self.global_slots.slots if self.global_slots else None,
+                'in_flight': self.in_flight,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'failed': self.failed
+            }
+        stats['latency'] = self.latency.snapshot()
+        return stats
+
+PDF_SLOTS = SlotPool('pdf', PDF_GLOBAL_CONCURRENCY)
+
+POOLS = {
+    'pdf': TaskPool(
+        'pdf',
+        int(os.environ.get('EXECUTOR_PDF_WORKERS', '2')),
+        int(os.environ.get('EXECUTOR_PDF_PENDING', '8')),
+        global_slots=PDF_SLOTS
+    ),
+    'auth': TaskPool(
+        'auth',
+        int(os.environ.get('EXECUTOR_AUTH_WORKERS', '2')),
+        int(os.environ.get('EXECUTOR_AUTH_PENDING', '16'))
+    )
+}
+
+def run(kind, fn, *args, timeout=EXECUTOR_TIMEOUT):
+    """Exécute fn(*args) dans le pool du type de tâche kind ('pdf' ou 'auth')"""
+    return POOLS[kind].run(fn, *args, timeout=timeout)
+
+def stats():
+    """Statistiques de tous les pools du worker courant"""
+    return {kind: pool.stats() for kind, pool in POOLS.items()}
@@ -0,0 +1,246 @@
+"""
+File d'attente des signatures asynchrones
+
+Les jobs sont stockés dans la table sign_jobs de la base SQLite : n'importe
+quel worker gunicorn peut en créer, et le répartiteur de chaque worker en
+réclame (de façon atomique) puis les exécute dans un pool de processus, si
+bien qu'un gros document n'immobilise plus un worker HTTP pendant la
+signature. Le client suit l'avancement via /api/jobs/<job_id>. Le
+répartiteur rafraîchit toutes les SIGN_JOB_HEARTBEAT secondes le signe de vie
+de ses jobs en cours ; seul un job sans signe de vie depuis SIGN_JOB_TIMEOUT
+secondes (worker mort) est remis en attente. Chaque job
+occupe une place du plafond global de travail PDF (executors.PDF_SLOTS) :
+un job n'est réclamé que lorsqu'une place est libre. Si le pool de calcul
+est cassé (processus mort) ou arrêté, le job réclamé retourne dans la file,
+sa place est rendue et le pool est recréé.
+"""
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import database as db
+import executors
+import pdf_engine
+
+SIGN_JOB_WORKERS = int(os.environ.get('SIGN_JOB_WORKERS', '2'))
+SIGN_JOB_MAX_QUEUE = int(os.environ.get('SIGN_JOB_MAX_QUEUE', '100'))
+SIGN_JOB_TIMEOUT = int(os.environ.get('SIGN_JOB_TIMEOUT', '60'))  # Sans signe de vie : worker mort
+SIGN_JOB_HEARTBEAT = max(1, SIGN_JOB_TIMEOUT // 6)
+POLL_INTERVAL = 0.5
+
+class QueueFull(Exception):
+    """La file d'attente a atteint SIGN_JOB_MAX_QUEUE jobs en attente"""
+
+def _dump_image(image):
+    """Image (octets ou pdf_engine.SignatureImage) sérialisable en JSON"""
+    if isinstance(image, pdf_engine.SignatureImage):
+        return {'data': base64.b64encode(image.data).decode('ascii'), 'box': list(image.box)}
+    return base64.b64encode(image).decode('ascii')
+
+def _load_image(image):
+    if isinstance(image, dict):
+        return pdf_engine.SignatureImage(base64.b64decode(image['data']), box=image['box'])
+    return base64.b64decode(image)
+
+def _execute(payload):
+    """Exécuté dans un processus du pool : appose les signatures décrites par le job"""
+    placements = [pdf_engine.Placement(*placement) for placement in payload['placements']]
+    images = {key: _load_image(image) for key, image in payload['images'].items()}
+    start = time.perf_counter()
+    result = pdf_engine.stamp(payload['input_path'], payload['output_path'], placements, images)
+    return {
+        'mode': result.mode,
+        'optimization': result.optimization,
+        'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+        'size': os.path.getsize(payload['output_path'])
+    }
+
+class JobDispatcher:
+    """Réclame les jobs en attente et les exécute dans un pool de processus borné"""
+
+    def __init__(self, workers=SIGN_JOB_WORKERS):
+        self.workers = max(1, workers)
+        self.pid = os.getpid()
+        self.wake = threading.Event()
+        self._slots = threading.Semaphore(self.workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self._running_ids = set()
+        self._thread = threading.Thread(target=self._loop, name='sign-jobs', daemon=True)
+        self._thread.start()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='sign-jobs-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def _get_executor(self):
+        """Pool de calcul (recréé après la mort d'un de ses processus)"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _reset_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(SIGN_JOB_HEARTBEAT)
+            with self._lock:
+                job_ids = list(self._running_ids)
+            try:
+                db.touch_sign_jobs(job_ids)
+            except Exception as e:
+                print(f"Erreur du signe de vie des jobs: {e}")
+
+    def _loop(self):
+        last_recovery = 0
+        while True:
+            self._slots.acquire()
+            lease = executors.PDF_SLOTS.acquire(POLL_INTERVAL)
+            if lease is None:
+                # Plafond global atteint : on réessaie sans réclamer de job
+                self._slots.release()
+                continue
+            try:
+                if time.monotonic() - last_recovery > SIGN_JOB_TIMEOUT / 2:
+                    db.requeue_stale_sign_jobs(SIGN_JOB_TIMEOUT)
+                    last_recovery = time.monotonic()
+                job = db.claim_sign_job(self.pid)
+            except Exception as e:
+                print(f"Erreur de la file de signature: {e}")
+                job = None
+            if job is None:
+                executors.PDF_SLOTS.release(lease)
+                self._slots.release()
+                self.wake.wait(POLL_INTERVAL)
+                self.wake.clear()
+                continue
+            with self._lock:
+                self.running += 1
+                self._running_ids.add(job['id'])
+            executor = self._get_executor()
+            try:
+                future = executor.submit(_execute, json.loads(job['payload']))
+            except Exception as e:
+                # Pool cassé (processus mort) ou arrêté : le job, jamais lancé,
+                # retourne dans la file et le pool est recréé
+                print(f"Pool de signature indisponible ({e or type(e).__name__}) : job remis en attente")
+                self._reset_executor(executor)
+                try:
+                    db.requeue_sign_job(job['id'])
+                except Exception as e:
+                    print(f"Erreur de la file de signature: {e}")
+                self._release(job, lease)
+                time.sleep(POLL_INTERVAL)
+                continue
+            future.add_done_callback(
+                lambda f, job=job, lease=lease, executor=executor: self._done(job, f, lease, executor)
+            )
+
+    def _done(self, job, future, lease, executor):
+        try:
+            result = future.result()
+            history = json.loads(job['payload'])['history']
+            db.add_to_history(history['user_id'], history['original_filename'],
+                              history['signed_filename'], history['signed_path'], history['page'])
+            db.finish_sign_job(job['id'], json.dumps(result))
+            with self._lock:
+                self.completed += 1
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # Processus mort pendant le job (OOM...) : job échoué, pool recréé
+                self._reset_executor(executor)
+            db.fail_sign_job(job['id'], str(e) or type(e).__name__)
+            with self._lock:
+                self.failed += 1
+        finally:
+            self._release(job, lease)
+
+    def _release(self, job, lease):
+        """Libère la place (globale et locale) d'un job terminé ou jamais lancé"""
+        with self._lock:
+            self.running -= 1
+            self._running_ids.discard(job['id'])
+        executors.PDF_SLOTS.release(lease)
+        self._slots.release()
+        self.wake.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pid': self.pid,
+                'workers': self.workers,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
+    """Démarre (une fois par processus) le répartiteur de jobs"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None or _dispatcher.pid != os.getpid():
+            _dispatcher = JobDispatcher()
+        return _dispatcher
+
+def enqueue(user_id, file_id, input_path, output_path, placements, images):
+    """Crée un job de signature et retourne son identifiant"""
+    if db.count_sign_jobs('queued') >= SIGN_JOB_MAX_QUEUE:
+        raise QueueFull()
+    original_filename = file_id.split('_', 1)[1] if '_' in file_id else file_id
+    payload = {
+        'input_path': input_path,
+        'output_path': output_path,
+        'placements': [list(placement) for placement in placements],
+        'images': {key: _dump_image(image) for key, image in images.items()},
+        'history': {
+            'user_id': user_id,
+            'original_filename': original_filename,
+            'signed_filename': os.path.basename(output_path),
+            'signed_path': output_path,
+            'page': min(placement.page for placement in placements)
+        }
+    }
+    job_id = str(uuid.uuid4())
+    db.create_sign_job(job_id, user_id, json.dumps(payload))
+    get_dispatcher().wake.set()
+    return job_id
+
+def job_status(job):
+    """Représentation JSON d'un job (sans sa charge utile)"""
+    status = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
+    if job['status'] == 'queued':
+        get_dispatcher()  # Reprend les jobs laissés en attente (redémarrage, autre worker)
+        status['position'] = db.sign_job_position(job['id'])
+    elif job['status'] == 'done':
+        status['signed_file_id'] = json.loads(job['payload'])['history']['signed_filename']
+        status['result'] = json.loads(job['result'])
+    elif job['status'] == 'failed':
+        status['error'] = job['error']
+    return status
+
+def queue_stats():
+    """Profondeur de la file et état du répartiteur du worker courant"""
+    stats = db.sign_job_counts()
+    stats['max_queue'] = SIGN_JOB_MAX_QUEUE
+    stats['dispatcher'] = _dispatcher.stats() if _dispatcher and _dispatcher.pid == os.getpid() else None
+    return stats
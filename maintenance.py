@@ -0,0 +1,211 @@
+"""
+Nettoyage périodique : sessions expirées, uploads et PDF signés anonymes périmés
+
+Le nettoyage tourne soit dans un thread de l'application (JANITOR_INTERVAL
+secondes, un seul worker gunicorn à la fois grâce à un verrou de fichier),
+soit à la demande en ligne de commande :
+
+    python maintenance.py [--enable-incremental-vacuum]
+"""
+import fcntl
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import admission
+import database as db
+import metrics
+from storage import UploadStore
+from uploads import BULK_PREFIX, PARTIAL_PREFIX, PARTIAL_SUFFIX
+
+JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', '3600'))  # 0 = désactivé
+UPLOAD_RETENTION_HOURS = int(os.environ.get('UPLOAD_RETENTION_HOURS', '24'))
+ANONYMOUS_RETENTION_HOURS = int(os.environ.get('ANONYMOUS_RETENTION_HOURS', '24'))
+JOB_RETENTION_HOURS = int(os.environ.get('JOB_RETENTION_HOURS', '24'))
+PARTIAL_RETENTION_SECONDS = 3600  # Upload interrompu (fichier .part abandonné)
+BULK_RETENTION_SECONDS = 6 * 3600  # Dossier de signature en masse d'un worker arrêté en cours de route
+JANITOR_BATCH_SIZE = int(os.environ.get('JANITOR_BATCH_SIZE', '500'))
+
+def _remove(path):
+    """Supprime un fichier ; retourne le nombre d'octets libérés"""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except OSError:
+        return 0
+
+def _older_than(path, seconds, now):
+    try:
+        return now - os.path.getmtime(path) > seconds
+    except OSError:
+        return False
+
+class Janitor:
+    """Supprime les données périmées et compte ce qui a été récupéré"""
+
+    def __init__(self, upload_store, signed_folder, batch_size=JANITOR_BATCH_SIZE):
+        self.upload_store = upload_store
+        self.signed_folder = signed_folder
+        self.batch_size = batch_size
+
+    def purge_sessions(self, report):
+        report['sessions'] = db.delete_expired_sessions(self.batch_size)
+
+    def purge_uploads(self, report):
+        """Uploads périmés (les contenus partagés ne sont effacés qu'à la dernière référence)"""
+        released = blobs = 0
+        freed = 0
+        while True:
+            file_ids = db.get_expired_uploads(UPLOAD_RETENTION_HOURS, self.batch_size)
+            for file_id in file_ids:
+                path = self.upload_store.resolve(file_id)
+                size = os.path.getsize(path) if path else 0
+                if self.upload_store.release(file_id):
+                    blobs += 1
+                    freed += size
+                released += 1
+            if len(file_ids) < self.batch_size:
+                break
+
+        # Anciens uploads non dédoublonnés et fichiers partiels abandonnés
+        now = time.time()
+        legacy = partial = 0
+        for entry in os.scandir(self.upload_store.folder):
+            if entry.is_dir() and entry.name.startswith(BULK_PREFIX):
+                if _older_than(entry.path, BULK_RETENTION_SECONDS, now):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    partial += 1
+                continue
+            if not entry.is_file():
+                continue
+            if entry.name.startswith(PARTIAL_PREFIX) and entry.name.endswith(PARTIAL_SUFFIX):
+                if _older_than(entry.path, PARTIAL_RETENTION_SECONDS, now):
+                    freed += _remove(entry.path)
+                    partial += 1
+            elif _older_than(entry.path, UPLOAD_RETENTION_HOURS * 3600, now):
+                freed += _remove(entry.path)
+                legacy += 1
+
+        report['uploads'] = released
+        report['upload_blobs'] = blobs
+        report['legacy_uploads'] = legacy
+        report['partial_uploads'] = partial
+        report['upload_bytes'] = freed
+
+    def purge_signed(self, report):
+        """PDF signés anonymes périmés, puis fichiers signés qui ne sont plus dans l'historique"""
+        freed = 0
+        paths = db.clean_old_files(ANONYMOUS_RETENTION_HOURS, self.batch_size)
+        for path in paths:
+            freed += _remove(path)
+
+        now = time.time()
+        candidates = [
+            entry.name for entry in os.scandir(self.signed_folder)
+            if entry.is_file() and _older_than(entry.path, ANONYMOUS_RETENTION_HOURS * 3600, now)
+        ]
+        referenced = db.get_referenced_signed_files(candidates)
+        orphans = [name for name in candidates if name not in referenced]
+        for name in orphans:
+            freed += _remove(os.path.join(self.signed_folder, name))
+
+        report['anonymous_history'] = len(paths)
+        report['orphan_signed'] = len(orphans)
+        report['signed_bytes'] = freed
+
+    def purge_jobs(self, report):
+        report['sign_jobs'] = db.delete_finished_sign_jobs(JOB_RETENTION_HOURS, self.batch_size)
+
+    def purge_metrics(self, report):
+        report['metrics_files'] = metrics.purge_stale()
+
+    def purge_throttle(self, report):
+        report['throttle_buckets'] = admission.store.purge()
+
+    def run(self):
+        """Exécute toutes les étapes et retourne le rapport"""
+        start = time.perf_counter()
+        report = {}
+        for step in (self.purge_sessions, self.purge_uploads, self.purge_signed, self.purge_jobs,
+                     self.purge_metrics, self.purge_throttle):
+            try:
+                step(report)
+            except Exception as e:
+                print(f"Erreur de nettoyage ({step.__name__}): {e}")
+                report.setdefault('errors', []).append(f'{step.__name__}: {e}')
+        try:
+            report['database'] = db.optimize_db()
+        except Exception as e:
+            print(f"Erreur d'optimisation de la base: {e}")
+            report.setdefault('errors', []).append(f'optimize_db: {e}')
+        report['duration_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return report
+
+def _lock_path():
+    return db.DATABASE_PATH + '.janitor-lock'
+
+def run_locked(janitor, min_interval=0):
+    """Exécute le nettoyage si aucun autre processus ne le fait déjà (None sinon)
+
+    Avec min_interval, la passe est aussi sautée si un autre worker en a
+    terminé une il y a moins de min_interval secondes.
+    """
+    with open(_lock_path(), 'a+') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return None
+        try:
+            if min_interval and time.time() - os.fstat(lock.fileno()).st_mtime < min_interval:
+                return None
+            report = janitor.run()
+            os.utime(lock.fileno())  # Date de la dernière passe, partagée entre workers
+            return report
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+_last_report = None
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def last_report():
+    """Dernier rapport de nettoyage de ce processus"""
+    return _last_report
+
+def start_scheduler(janitor, interval=JANITOR_INTERVAL):
+    """Démarre (une fois par processus) le thread de nettoyage périodique"""
+    global _scheduler
+    if interval <= 0:
+        return None
+    with _scheduler_lock:
+        if _scheduler is not None and _scheduler.is_alive():
+            return _scheduler
+
+        def loop():
+            global _last_report
+            while True:
+                time.sleep(interval)
+                report = run_locked(janitor, min_interval=interval / 2)
+                if report is not None:
+                    _last_report = report
+                    print(f"Nettoyage: {json.dumps(report)}")
+
+        _scheduler = threading.Thread(target=loop, name='janitor', daemon=True)
+        _scheduler.start()
+        return _scheduler
+
+if __name__ == '__main__':
+    db.init_db()
+    if '--enable-incremental-vacuum' in sys.argv:
+        if db.enable_incremental_vacuum():
+            print("Base convertie en auto_vacuum INCREMENTAL")
+    janitor = Janitor(UploadStore('uploads'), 'signed')
+    report = run_locked(janitor)
+    if report is None:
+        print("Nettoyage déjà en cours dans un autre processus")
+        sys.exit(1)
+    print(json.dumps(report, indent=2))
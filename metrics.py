@@ -0,0 +1,228 @@
+"""
+Métriques de l'application au format Prometheus (/metrics)
+
+Chaque processus (workers gunicorn et processus de calcul des pools)
+accumule ses compteurs et histogrammes en mémoire et les écrit toutes les
+METRICS_FLUSH_INTERVAL secondes dans METRICS_DIR/<pid>.json ; /metrics
+additionne les fichiers de tous les processus, quel que soit le worker qui
+reçoit la requête. Les fichiers des processus terminés sont conservés (les
+compteurs restent croissants) puis supprimés par le nettoyage périodique
+après METRICS_RETENTION_HOURS.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from executors import LATENCY_BUCKETS
+
+METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'signature-metrics')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '2'))
+METRICS_RETENTION_HOURS = int(os.environ.get('METRICS_RETENTION_HOURS', '24'))
+
+SIZE_BUCKETS = (10e3, 100e3, 500e3, 1e6, 5e6, 10e6, 16e6, 50e6)
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# nom -> (type, description, bornes des histogrammes)
+METRICS = {
+    'signature_http_requests_total': ('counter', 'Requêtes HTTP par route, méthode et statut', None),
+    'signature_http_request_duration_seconds': ('histogram', 'Durée des requêtes HTTP par route', LATENCY_BUCKETS),
+    'signature_stage_duration_seconds': ('histogram', 'Durée de chaque étape upload/signature/téléchargement', LATENCY_BUCKETS),
+    'signature_db_duration_seconds': ('histogram', 'Durée des accès à la base par fonction de database.py', LATENCY_BUCKETS),
+    'signature_db_pool_acquire_total': ('counter', 'Emprunts de connexion au pool SQLite (reused, created, waited, timeout)', None),
+    'signature_db_pool_wait_seconds': ('histogram', "Attente d'une connexion du pool SQLite", LATENCY_BUCKETS),
+    'signature_pdf_bytes': ('histogram', 'Taille des PDF (uploadés, signés)', SIZE_BUCKETS),
+    'signature_pdf_pages': ('histogram', 'Nombre de pages des PDF uploadés, de pages signées par requête', PAGE_BUCKETS),
+    'signature_session_cache_total': ('counter', 'Accès au cache des sessions devant get_user_by_token', None),
+    'signature_render_cache_total': ('counter', 'Accès aux caches de rendu des signatures (XObjects, calques)', None),
+    'signature_document_cache_total': ('counter', 'Accès aux caches des documents analysés et de leur géométrie (signature, prévisualisation)', None),
+    'signature_normalization_bytes_total': ('counter', 'Octets des images de signature reçues puis embarquées après normalisation', None),
+    'signature_throttled_total': ('counter', "Requêtes refusées (429) par le contrôle d'admission, par classe de coût", None),
+}
+
+class Registry:
+    """Compteurs et histogrammes du processus courant"""
+
+    def __init__(self):
+        self._reset()
+        # Un processus forké (worker, pool de calcul) hérite des valeurs du parent
+        # et peut-être d'un verrou pris : il repart de zéro
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self.pid = os.getpid()
+        self.counters = {}    # (nom, étiquettes) -> valeur
+        self.histograms = {}  # (nom, étiquettes) -> [comptes par seau..., somme]
+        self._dirty = False
+        self._flusher = None
+
+    def _start_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics', daemon=True)
+            self._flusher.start()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._start_flusher()
+            self.counters[key] = self.counters.get(key, 0) + value
+            self._dirty = True
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._start_flusher()
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [0] * (len(buckets) + 2)
+            series[bisect_left(buckets, value)] += 1
+            series[-1] += value
+            self._dirty = True
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(series)] for (name, labels), series in self.histograms.items()],
+            }
+
+    def flush(self):
+        """Écrit l'état du processus dans METRICS_DIR (remplacement atomique)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+        data = json.dumps(self.snapshot())
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f'{self.pid}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Écriture des métriques impossible: {e}")
+
+registry = Registry()
+atexit.register(lambda: registry.flush())
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+@contextmanager
+def stage(name):
+    """Mesure la durée d'une étape du traitement (signature_stage_duration_seconds)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe('signature_stage_duration_seconds', time.perf_counter() - start, stage=name)
+
+def _load_snapshots():
+    """États de tous les processus (fichiers de METRICS_DIR)"""
+    registry.flush()
+    snapshots = []
+    try:
+        entries = list(os.scandir(METRICS_DIR))
+    except FileNotFoundError:
+        return snapshots
+    for entry in entries:
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # Fichier en cours de remplacement
+    return snapshots
+
+def _labels(pairs, extra=None):
+    pairs = list(pairs) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    """Métriques agrégées de tous les processus, au format texte Prometheus"""
+    counters = {}
+    histograms = {}
+    for snapshot in _load_snapshots():
+        for name, labels, value in snapshot.get('counters', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, series in snapshot.get('histograms', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            total = histograms.get(key)
+            if total is None or len(total) != len(series):
+                histograms[key] = list(series)
+            else:
+                histograms[key] = [a + b for a, b in zip(total, series)]
+
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+            continue
+        for (metric, labels), series in sorted(histograms.items()):
+            if metric != name or len(series) != len(buckets) + 2:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, series):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, ("le", _number(bound)))} {cumulative}')
+            count = sum(series[:-1])
+            lines.append(f'{name}_bucket{_labels(labels, ("le", "+Inf"))} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(series[-1])}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def purge_stale(hours=METRICS_RETENTION_HOURS):
+    """Supprime les fichiers des processus terminés depuis plus de hours heures"""
+    removed = 0
+    now = time.time()
+    try:
+        entries = list(os.scandir(METRICS_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        pid = entry.name.split('.', 1)[0]
+        if not pid.isdigit() or _alive(int(pid)):
+            continue
+        try:
+            if now - entry.stat().st_mtime > hours * 3600:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,344 @@
+"""
+Optimisation des PDF signés avant leur mise à disposition
+
+Les PDF produits par la signature grossissent au fil des passes : la
+réécriture complète (PyPDF2) écrit les flux de contenu fusionnés sans
+compression, et chaque mise à jour incrémentale ajoute une copie de l'image
+de signature et des versions remplacées des pages. Le compactage réécrit le
+document avec uniquement les objets encore référencés, fusionne les flux
+(images, polices) et dictionnaires de police identiques, compresse les flux
+qui ne l'étaient pas et range les autres objets dans des flux d'objets
+(PDF 1.5, table xref en flux). La linéarisation (« affichage web rapide »)
+nécessite pikepdf : sans lui, OUTPUT_OPTIMIZE=linearize est refusé au
+démarrage.
+
+Modes (OUTPUT_OPTIMIZE) : off, compact ou linearize. Chaque optimisation
+retourne un rapport (tailles avant/après, durée, objets fusionnés...) ;
+benchmarks/bench_optimize.py compare les modes sur des documents réels.
+"""
+import hashlib
+import io
+import os
+import time
+import zlib
+from collections import deque
+
+try:
+    from PyPDF2 import PdfReader
+except ImportError:
+    from PyPDF2 import PdfFileReader as PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+import metrics
+
+OUTPUT_OPTIMIZE = os.environ.get('OUTPUT_OPTIMIZE', 'off')  # off, compact ou linearize
+OPTIMIZE_OBJSTM_SIZE = int(os.environ.get('OPTIMIZE_OBJSTM_SIZE', '100'))  # Objets par flux d'objets
+OPTIMIZE_ZLIB_LEVEL = int(os.environ.get('OPTIMIZE_ZLIB_LEVEL', '6'))
+MODES = ('off', 'compact', 'linearize')
+MIN_COMPRESS_SIZE = 64  # En dessous, l'en-tête Flate coûte plus qu'il ne rapporte
+# Dictionnaires (hors flux) fusionnés quand ils sont identiques
+DEDUP_TYPES = ('/Font', '/FontDescriptor', '/ExtGState')
+DEDUP_ROUNDS = 4  # Une fusion peut en révéler une autre (image + masque, police + fichier)
+
+def check_mode(mode):
+    """Vérifie qu'un mode d'optimisation est utilisable ; lève ValueError sinon"""
+    if mode not in MODES:
+        raise ValueError(f'OUTPUT_OPTIMIZE inconnu : {mode}')
+    if mode == 'linearize' and pikepdf is None:
+        raise ValueError('OUTPUT_OPTIMIZE=linearize nécessite pikepdf (pip install pikepdf)')
+
+check_mode(OUTPUT_OPTIMIZE)  # Configuration invalide : refus au démarrage plutôt qu'en silence
+
+class OptimizeError(Exception):
+    """Le document ne peut pas être compacté (chiffré, illisible...)"""
+
+def _serialize(obj):
+    """Sérialise un objet PyPDF2 direct (nombre, nom, chaîne...) en octets PDF"""
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+# Catégorie de chaque classe PyPDF2, calculée une fois : isinstance() sur ces
+# classes (protocoles typing) coûte cher sur des milliers d'objets
+REFERENCE, DICTIONARY, STREAM, ARRAY, OTHER = range(5)
+_kinds = {}
+
+def _kind(obj):
+    cls = type(obj)
+    kind = _kinds.get(cls)
+    if kind is None:
+        if issubclass(cls, IndirectObject):
+            kind = REFERENCE
+        elif issubclass(cls, StreamObject):
+            kind = STREAM
+        elif issubclass(cls, DictionaryObject):
+            kind = DICTIONARY
+        elif issubclass(cls, ArrayObject):
+            kind = ARRAY
+        else:
+            kind = OTHER
+        _kinds[cls] = kind
+    return kind
+
+def _page_count(path):
+    """Nombre de pages annoncé par l'arbre des pages (/Count), sans le parcourir"""
+    return int(PdfReader(path).trailer['/Root']['/Pages']['/Count'])
+
+class Compactor:
+    """Réécrit un PDF : objets atteignables, fusion des doublons, flux compressés,
+    objets rangés dans des flux d'objets"""
+
+    def __init__(self, input_path, objstm_size=OPTIMIZE_OBJSTM_SIZE, level=OPTIMIZE_ZLIB_LEVEL):
+        self.reader = PdfReader(input_path)
+        if self.reader.is_encrypted:
+            raise OptimizeError('document chiffré')
+        self.objstm_size = max(1, objstm_size)
+        self.level = level
+        self.objects = {}    # (numéro, génération) -> objet, dans l'ordre de parcours
+        self.canonical = {}  # clé d'un doublon -> clé conservée
+        self.compressed = {}  # clé d'un flux -> données compressées
+        self.stats = {'objects_before': 0, 'objects_after': 0, 'duplicates': 0,
+                      'streams_compressed': 0, 'objects_packed': 0}
+
+    @staticmethod
+    def _key(reference):
+        return (reference.idnum, reference.generation)
+
+    def _children(self, obj):
+        """Références indirectes contenues dans un objet (hors /Length des flux)"""
+        stack = [obj]
+        while stack:
+            item = stack.pop()
+            kind = _kind(item)
+            if kind == REFERENCE:
+                yield item
+            elif kind == DICTIONARY or kind == STREAM:
+                for key, value in dict.items(item):
+                    if key == '/Length' and kind == STREAM:
+                        continue
+                    stack.append(value)
+            elif kind == ARRAY:
+                stack.extend(item)
+
+    def collect(self):
+        """Objets atteignables depuis le catalogue et les métadonnées"""
+        trailer = self.reader.trailer
+        queue = deque(trailer.raw_get(key) for key in ('/Root', '/Info') if key in trailer)
+        while queue:
+            reference = queue.popleft()
+            if _kind(reference) != REFERENCE:
+                continue
+            key = self._key(reference)
+            if key in self.objects:
+                continue
+            obj = self.reader.get_object(reference)
+            if obj is None:
+                continue  # Référence pendante : écrite null
+            self.objects[key] = obj
+            queue.extend(self._children(obj))
+        if '/Root' not in trailer or _kind(trailer.raw_get('/Root')) != REFERENCE:
+            raise OptimizeError('catalogue introuvable')
+        self.stats['objects_before'] = len(self.objects)
+
+    def _resolve(self, key):
+        while key in self.canonical:
+            key = self.canonical[key]
+        return key
+
+    def _dump(self, obj, ref):
+        """Sérialise obj ; ref(clé) donne l'écriture d'une référence indirecte"""
+        kind = _kind(obj)
+        if kind == REFERENCE:
+            key = self._resolve(self._key(obj))
+            return ref(key) if key in self.objects else b'null'
+        if kind == DICTIONARY or kind == STREAM:
+            parts = [b'<<']
+            for key, value in dict.items(obj):
+                if key == '/Length' and kind == STREAM:
+                    continue
+                parts.append(_serialize(NameObject(key)) + b' ' + self._dump(value, ref))
+            return b' '.join(parts) + b' >>'
+        if kind == ARRAY:
+            return b'[' + b' '.join(self._dump(value, ref) for value in obj) + b']'
+        return _serialize(obj)
+
+    def deduplicate(self):
+        """Fusionne les flux et dictionnaires de police identiques"""
+        data_digests = {
+            key: hashlib.sha256(obj._data or b'').digest()
+            for key, obj in self.objects.items() if _kind(obj) == STREAM
+        }
+        candidates = [
+            key for key, obj in self.objects.items()
+            if _kind(obj) == STREAM or (
+                _kind(obj) == DICTIONARY and obj.get('/Type') in DEDUP_TYPES)
+        ]
+        ref = lambda key: f'{key[0]}.{key[1]} R'.encode()
+        for _ in range(DEDUP_ROUNDS):
+            seen = {}
+            merged = 0
+            for key in candidates:
+                if key in self.canonical:
+                    continue
+                obj = self.objects[key]
+                digest = hashlib.sha256(self._dump(obj, ref) + data_digests.get(key, b'')).digest()
+                if digest in seen:
+                    self.canonical[key] = seen[digest]
+                    merged += 1
+                else:
+                    seen[digest] = key
+            self.stats['duplicates'] += merged
+            if not merged:
+                break
+        for key in self.canonical:
+            del self.objects[key]
+
+    def compress(self):
+        """Compresse (Flate) les flux écrits sans filtre"""
+        for key, obj in self.objects.items():
+            if not _kind(obj) == STREAM or '/Filter' in obj:
+                continue
+            data = obj._data or b''
+            if len(data) < MIN_COMPRESS_SIZE:
+                continue
+            packed = zlib.compress(data, self.level)
+            if len(packed) < len(data):
+                self.compressed[key] = packed
+                self.stats['streams_compressed'] += 1
+
+    def _stream(self, dictionary, data):
+        return dictionary[:-2] + b'/Length ' + str(len(data)).encode() + b' >>\nstream\n' + data + b'\nendstream'
+
+    def write(self, output_path):
+        numbers = {key: i for i, key in enumerate(self.objects, start=1)}
+        ref = lambda key: f'{numbers[key]} 0 R'.encode()
+        streams = [key for key, obj in self.objects.items() if _kind(obj) == STREAM]
+        packed = [key for key, obj in self.objects.items() if not _kind(obj) == STREAM]
+        next_id = len(numbers) + 1
+        entries = {}  # numéro -> (type, champ 2, champ 3) de la table xref en flux
+
+        version = self.reader.pdf_header[5:8] if self.reader.pdf_header.startswith('%PDF-') else '1.4'
+        header = f'%PDF-{max(version, "1.5")}\n'.encode() + b'%\xe2\xe3\xcf\xd3\n'
+        with open(output_path, 'wb') as output:
+            output.write(header)
+            position = len(header)
+
+            def emit(number, body):
+                nonlocal position
+                chunk = f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+                entries[number] = (1, position, 0)
+                output.write(chunk)
+                position += len(chunk)
+
+            for key in streams:
+                obj = self.objects[key]
+                dictionary = self._dump(obj, ref)
+                data = self.compressed.get(key)
+                if data is not None:
+                    dictionary = dictionary[:-2] + b'/Filter /FlateDecode >>'
+                else:
+                    data = obj._data or b''
+                emit(numbers[key], self._stream(dictionary, data))
+
+            for start in range(0, len(packed), self.objstm_size):
+                group = packed[start:start + self.objstm_size]
+                stream_id = next_id
+                next_id += 1
+                offsets, bodies, offset = [], [], 0
+                for index, key in enumerate(group):
+                    body = self._dump(self.objects[key], ref) + b'\n'
+                    offsets.append(f'{numbers[key]} {offset}')
+                    bodies.append(body)
+                    offset += len(body)
+                    entries[numbers[key]] = (2, stream_id, index)
+                table = ' '.join(offsets).encode() + b'\n'
+                data = zlib.compress(table + b''.join(bodies), self.level)
+                emit(stream_id, self._stream(
+                    f'<< /Type /ObjStm /N {len(group)} /First {len(table)} /Filter /FlateDecode >>'.encode(), data))
+            self.stats['objects_packed'] = len(packed)
+
+            xref_id = next_id
+            entries[xref_id] = (1, position, 0)
+            rows = [b'\x00' + (0).to_bytes(4, 'big') + (65535).to_bytes(2, 'big')]
+            for number in range(1, xref_id + 1):
+                kind, field2, field3 = entries[number]
+                rows.append(bytes([kind]) + field2.to_bytes(4, 'big') + field3.to_bytes(2, 'big'))
+            trailer = self.reader.trailer
+            dictionary = f'<< /Type /XRef /Size {xref_id + 1} /W [1 4 2] '.encode()
+            dictionary += b'/Root ' + self._dump(trailer.raw_get('/Root'), ref)
+            if '/Info' in trailer:
+                dictionary += b' /Info ' + self._dump(trailer.raw_get('/Info'), ref)
+            if '/ID' in trailer:
+                dictionary += b' /ID ' + self._dump(trailer.raw_get('/ID'), ref)
+            dictionary += b' /Filter /FlateDecode >>'
+            output.write(f'{xref_id} 0 obj\n'.encode()
+                         + self._stream(dictionary, zlib.compress(b''.join(rows), self.level))
+                         + b'\nendobj\n')
+            output.write(f'startxref\n{position}\n%%EOF\n'.encode())
+        self.stats['objects_after'] = len(self.objects)
+
+def compact(input_path, output_path):
+    """Écrit la version compactée de input_path ; retourne les compteurs"""
+    compactor = Compactor(input_path)
+    compactor.collect()
+    compactor.deduplicate()
+    compactor.compress()
+    compactor.write(output_path)
+    return compactor.stats
+
+def linearize(input_path, output_path):
+    """Linéarise (affichage web rapide) avec pikepdf, en conservant les flux d'objets"""
+    with pikepdf.open(input_path) as pdf:
+        pdf.save(output_path, linearize=True, compress_streams=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate)
+
+def optimize(path, mode=None):
+    """Optimise le PDF path sur place selon mode (OUTPUT_OPTIMIZE par défaut)
+
+    Retourne le rapport, ou None en mode off. En cas d'échec, ou si le
+    compactage n'apporte rien, le fichier d'origine est conservé.
+    """
+    mode = mode or OUTPUT_OPTIMIZE
+    if mode == 'off':
+        return None
+    check_mode(mode)
+    start = time.perf_counter()
+    before = os.path.getsize(path)
+    report = {'mode': mode, 'bytes_before': before, 'linearized': False}
+    compacted = f'{path}.compact'
+    linearized = f'{path}.linear'
+    try:
+        with metrics.stage('sign_optimize'):
+            report.update(compact(path, compacted))
+            result = compacted
+            if mode == 'linearize':
+                linearize(compacted, linearized)
+                result = linearized
+                report['linearized'] = True
+            # Relecture du résultat : table xref, flux d'objets et arbre des pages
+            if _page_count(result) != _page_count(path):
+                raise OptimizeError('nombre de pages différent après optimisation')
+            after = os.path.getsize(result)
+            # Un document linéarisé est conservé même un peu plus gros (c'est le but)
+            if after < before or report['linearized']:
+                os.replace(result, path)
+            else:
+                report['kept_original'] = True
+                after = before
+    except Exception as e:
+        print(f"Optimisation impossible ({os.path.basename(path)}): {e}")
+        report['error'] = str(e) or type(e).__name__
+        after = before
+    finally:
+        for leftover in (compacted, linearized):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    report['bytes_after'] = after
+    report['saved_percent'] = round(100 * (before - after) / before, 1) if before else 0.0
+    report['duration_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return report
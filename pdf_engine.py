@@ -0,0 +1,806 @@
+"""
+Moteur de signature PDF
+
+Deux stratégies sont disponibles :
+- incrémentale : le PDF d'origine est copié tel quel puis une mise à jour
+  incrémentale (nouveaux objets + nouvelle section xref) est ajoutée à la fin,
+  seule la page signée est réécrite ;
+- réécriture : l'ancienne méthode PdfReader/PdfWriter qui resérialise tout le
+  document (utilisée en repli si la mise à jour incrémentale est impossible).
+"""
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+try:
+    from PyPDF2 import PdfReader, PdfWriter
+except ImportError:
+    from PyPDF2 import PdfFileReader as PdfReader, PdfFileWriter as PdfWriter
+from PyPDF2.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NameObject, RectangleObject
+)
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from PIL import Image, UnidentifiedImageError
+
+import metrics
+import optimizer
+from cache import LRUCache
+
+SIGN_MODE = os.environ.get('SIGN_MODE', 'incremental')  # 'incremental' ou 'rewrite'
+OVERLAY_CACHE_ENTRIES = int(os.environ.get('OVERLAY_CACHE_ENTRIES', '256'))
+OVERLAY_CACHE_MAX_BYTES = int(os.environ.get('OVERLAY_CACHE_MB', '64')) * 1024 * 1024
+SIGNATURE_NORMALIZE = os.environ.get('SIGNATURE_NORMALIZE', '1') == '1'
+SIGNATURE_DPI = int(os.environ.get('SIGNATURE_DPI', '200'))  # Résolution max à la taille du placement
+SIGNATURE_COLORS = int(os.environ.get('SIGNATURE_COLORS', '16'))  # Couleurs (avec transparence) conservées
+
+# Rendu des signatures, adressé par contenu :
+# - XObjects image (mode incrémental) : clé = empreinte de l'image, la position
+#   n'intervenant que dans le flux de dessin de quelques octets ;
+# - calques PDF rendus par reportlab (mode réécriture) : clé = empreintes,
+#   positions, tailles et géométrie de chaque page signée.
+_xobject_cache = LRUCache(
+    max_entries=OVERLAY_CACHE_ENTRIES,
+    max_bytes=OVERLAY_CACHE_MAX_BYTES // 2,
+    sizeof=lambda value: len(value[0]) + len(value[1]) + len(value[2] or b'')
+)
+_overlay_cache = LRUCache(
+    max_entries=OVERLAY_CACHE_ENTRIES,
+    max_bytes=OVERLAY_CACHE_MAX_BYTES // 2,
+    sizeof=len
+)
+
+# Placement d'une signature : page (0-indexée), position/taille en points, clé de l'image
+Placement = namedtuple('Placement', 'page x y width height signature')
+
+# Résultat d'une signature : méthode utilisée et rapport d'optimisation (None si désactivée)
+SignResult = namedtuple('SignResult', 'mode optimization')
+
+class IncrementalUpdateError(Exception):
+    """Le document ne se prête pas à une mise à jour incrémentale"""
+
+def _find_startxref(data):
+    """Retourne l'offset de la dernière section xref du fichier"""
+    tail = data[-2048:]
+    match = None
+    for match in re.finditer(rb'startxref\s+(\d+)', tail):
+        pass
+    if match is None:
+        raise IncrementalUpdateError('startxref introuvable')
+    offset = int(match.group(1))
+    if offset >= len(data):
+        raise IncrementalUpdateError('startxref invalide')
+    return offset
+
+def _num(value):
+    """Formate un nombre pour un flux de contenu PDF"""
+    return f'{float(value):.4f}'.rstrip('0').rstrip('.')
+
+def _serialize(obj):
+    """Sérialise un objet PyPDF2 en octets PDF"""
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+def _stream_object(dictionary, data):
+    """Construit le corps d'un objet stream à partir d'un dictionnaire (octets) et de données"""
+    return b'<< ' + dictionary + b' /Length ' + str(len(data)).encode() + b' >>\nstream\n' + data + b'\nendstream'
+
+def decode_signature(signature_data):
+    """Décode une signature base64 (data URL ou base64 brut) en octets"""
+    image_data = signature_data.split(',')[1] if ',' in signature_data else signature_data
+    try:
+        return base64.b64decode(image_data)
+    except (binascii.Error, ValueError):
+        raise ValueError('Image de signature invalide')
+
+def load_image(source):
+    """Charge une image en mémoire (octets, flux, chemin ou image PIL), sans fichier temporaire"""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        img = Image.open(source)
+        img.load()
+    except (UnidentifiedImageError, OSError):
+        raise ValueError('Image de signature invalide')
+    return img
+
+# Cadre complet d'une image : (gauche, haut, droite, bas) en fractions
+FULL_FRAME = (0.0, 0.0, 1.0, 1.0)
+
+class SignatureImage:
+    """Image de signature : octets d'origine, empreinte SHA-256 et image PIL décodée à la demande
+
+    box situe l'image dans le cadre d'origine de la signature (fractions
+    gauche, haut, droite, bas) : une image recadrée sur l'encre est ainsi
+    dessinée exactement là où elle l'aurait été sans recadrage.
+    """
+
+    def __init__(self, source, box=None, digest=None):
+        self._image = None
+        self.box = tuple(box) if box else FULL_FRAME
+        if isinstance(source, Image.Image):
+            self.data = None
+            self._image = source
+        elif isinstance(source, (bytes, bytearray)):
+            self.data = bytes(source)
+        elif hasattr(source, 'read'):
+            self.data = source.read()
+        else:
+            with open(source, 'rb') as f:
+                self.data = f.read()
+        if digest is None and self.data is not None:
+            digest = hashlib.sha256(self.data).hexdigest()
+        self.digest = digest
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = load_image(self.data)
+        return self._image
+
+_normalized_cache = LRUCache(max_entries=OVERLAY_CACHE_ENTRIES)
+
+def normalize_signature(img, target_size=None, colors=SIGNATURE_COLORS, dpi=SIGNATURE_DPI):
+    """Recadre une signature sur son encre, plafonne sa résolution et réduit sa palette
+
+    target_size : taille (points) du plus grand placement de l'image, qui
+    borne la résolution à dpi. Seules les images avec transparence sont
+    recadrées et réduites en palette (une image opaque masque ce qu'elle
+    recouvre : son cadre doit être conservé). Retourne (image, cadre) où
+    cadre est la zone conservée en fractions de l'image d'origine.
+    """
+    box = FULL_FRAME
+    has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+    if has_alpha:
+        img = img.convert('RGBA')
+        has_alpha = img.getchannel('A').getextrema()[0] < 255
+    if has_alpha:
+        bbox = img.getchannel('A').getbbox()
+        if bbox is None:
+            raise ValueError('Signature vide')
+        if bbox != (0, 0, img.width, img.height):
+            box = (bbox[0] / img.width, bbox[1] / img.height, bbox[2] / img.width, bbox[3] / img.height)
+            img = img.crop(bbox)
+    elif img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    if target_size:
+        # L'image est étirée sur son placement : chaque axe est plafonné séparément
+        max_width = max(1, round(target_size[0] * (box[2] - box[0]) / 72 * dpi))
+        max_height = max(1, round(target_size[1] * (box[3] - box[1]) / 72 * dpi))
+        size = (min(img.width, max_width), min(img.height, max_height))
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS)
+
+    if has_alpha and colors:
+        img = img.quantize(colors, method=Image.Quantize.FASTOCTREE)
+    return img, box
+
+def _compose_box(outer, inner):
+    """Cadre inner (relatif à outer) exprimé dans le cadre d'origine"""
+    width, height = outer[2] - outer[0], outer[3] - outer[1]
+    return (outer[0] + inner[0] * width, outer[1] + inner[1] * height,
+            outer[0] + inner[2] * width, outer[1] + inner[3] * height)
+
+def _place_in_box(placement, box):
+    """Réduit un placement à la zone box de son cadre (y vers le haut en PDF)"""
+    if box == FULL_FRAME:
+        return placement
+    return placement._replace(
+        x=placement.x + placement.width * box[0],
+        y=placement.y + placement.height * (1 - box[3]),
+        width=placement.width * (box[2] - box[0]),
+        height=placement.height * (box[3] - box[1])
+    )
+
+def normalize_placements(placements, images):
+    """Normalise chaque image pour son plus grand placement et ajuste les placements
+
+    Retourne (placements, images) prêts à être apposés.
+    """
+    targets = {}
+    for placement in placements:
+        width, height = targets.get(placement.signature, (0, 0))
+        targets[placement.signature] = (max(width, abs(placement.width)), max(height, abs(placement.height)))
+
+    normalized = {}
+    for key, target in targets.items():
+        signature = images[key]
+        target = (round(target[0], 1), round(target[1], 1))
+        cache_key = (signature.digest, target) if signature.digest else None
+        entry = _normalized_cache.get(cache_key) if cache_key else None
+        if entry is None:
+            img, inner = normalize_signature(signature.image, target)
+            digest = f'{signature.digest}:{target[0]}x{target[1]}' if signature.digest else None
+            entry = SignatureImage(img, box=_compose_box(signature.box, inner), digest=digest)
+            if cache_key:
+                _normalized_cache.set(cache_key, entry)
+            # Compté dans le processus qui signe (pool de calcul) : agrégé par /metrics
+            metrics.inc('signature_normalization_bytes_total', len(signature.data or b''), stage='received')
+        normalized[key] = entry
+
+    placements = [_place_in_box(p, normalized[p.signature].box) for p in placements]
+    return placements, normalized
+
+def cached_image_xobjects(signature):
+    """XObject image d'une signature, rendu une seule fois par contenu"""
+    if signature.digest is None:
+        return image_xobjects(signature.image)
+    xobjects = _xobject_cache.get(signature.digest)
+    # Compté dans le processus qui signe (pool de calcul) : agrégé par /metrics
+    metrics.inc('signature_render_cache_total', cache='xobject', result='hit' if xobjects else 'miss')
+    if xobjects is None:
+        xobjects = image_xobjects(signature.image)
+        _xobject_cache.set(signature.digest, xobjects)
+        metrics.inc('signature_normalization_bytes_total', len(xobjects[1]) + len(xobjects[2] or b''),
+                    stage='embedded')
+    return xobjects
+
+def image_xobjects(img):
+    """Convertit une image PIL en XObject compressé (RGB ou palette indexée) + SMask éventuel"""
+    if img.mode == 'P':
+        return _indexed_xobjects(img)
+    alpha = None
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        alpha = img.getchannel('A')
+        if alpha.getextrema() == (255, 255):
+            alpha = None
+    rgb = img.convert('RGB')
+    width, height = rgb.size
+    header = (
+        f'/Type /XObject /Subtype /Image /Width {width} /Height {height} '
+        f'/BitsPerComponent 8 /Filter /FlateDecode'
+    ).encode()
+    image_data = zlib.compress(rgb.tobytes())
+    smask = None
+    if alpha is not None:
+        smask = _stream_object(header + b' /ColorSpace /DeviceGray', zlib.compress(alpha.tobytes()))
+    return header + b' /ColorSpace /DeviceRGB', image_data, smask
+
+def _indexed_xobjects(img):
+    """XObject en palette indexée + SMask depuis la transparence de la palette
+
+    Les entrées de palette qui ne diffèrent que par leur transparence sont
+    fusionnées : une encre d'une seule couleur donne une image de 1 bit par
+    pixel, la finesse du tracé restant portée par le SMask.
+    """
+    alpha = img.convert('RGBA').getchannel('A')
+    if alpha.getextrema() == (255, 255):
+        alpha = None
+    palette = img.getpalette('RGB')
+    colors = []
+    lut = []
+    for index in range(256):
+        rgb = bytes(palette[index * 3:index * 3 + 3]) if index * 3 < len(palette) else b'\x00\x00\x00'
+        if rgb not in colors:
+            colors.append(rgb)
+        lut.append(colors.index(rgb))
+    indices = Image.frombytes('L', img.size, img.tobytes()).point(lut)
+    if len(colors) <= 2:
+        bits = 1
+        data = indices.point(lambda v: 255 if v else 0).convert('1').tobytes()
+    else:
+        bits = 8
+        data = indices.tobytes()
+    width, height = img.size
+    header = (
+        f'/Type /XObject /Subtype /Image /Width {width} /Height {height} /Filter /FlateDecode'
+    ).encode()
+    colorspace = (
+        f' /BitsPerComponent {bits} /ColorSpace [/Indexed /DeviceRGB {len(colors) - 1} '
+        f'<{b"".join(colors).hex()}>]'
+    ).encode()
+    smask = None
+    if alpha is not None:
+        smask = _stream_object(header + b' /BitsPerComponent 8 /ColorSpace /DeviceGray',
+                               zlib.compress(alpha.tobytes()))
+    return header + colorspace, zlib.compress(data), smask
+
+INHERITABLE_ATTRIBUTES = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+GEOMETRY_CACHE_ENTRIES = int(os.environ.get('GEOMETRY_CACHE_ENTRIES', '512'))
+
+# Géométrie d'une page : boîtes en points (llx, lly, urx, ury), rotation
+# d'affichage et dimensions telles que vues par l'utilisateur (après rotation)
+PageGeometry = namedtuple('PageGeometry', 'media_box crop_box rotate width height')
+
+_geometry_cache = LRUCache(max_entries=GEOMETRY_CACHE_ENTRIES)
+
+def _box(value):
+    """Normalise un rectangle PDF en tuple (llx, lly, urx, ury)"""
+    llx, lly, urx, ury = (float(v) for v in value.get_object())
+    return (min(llx, urx), min(lly, ury), max(llx, urx), max(lly, ury))
+
+def page_geometry(attributes):
+    """Calcule la géométrie d'une page à partir de ses attributs (hérités compris)"""
+    media_box = _box(attributes['/MediaBox']) if '/MediaBox' in attributes else (0.0, 0.0) + tuple(letter)
+    crop_box = media_box
+    if '/CropBox' in attributes:
+        crop = _box(attributes['/CropBox'])
+        # La CropBox est bornée par la MediaBox
+        crop_box = (max(crop[0], media_box[0]), max(crop[1], media_box[1]),
+                    min(crop[2], media_box[2]), min(crop[3], media_box[3]))
+    rotate = int(attributes['/Rotate'].get_object()) % 360 if '/Rotate' in attributes else 0
+    if rotate % 90:
+        rotate = 0
+    width = crop_box[2] - crop_box[0]
+    height = crop_box[3] - crop_box[1]
+    if rotate in (90, 270):
+        width, height = height, width
+    return PageGeometry(media_box, crop_box, rotate, width, height)
+
+def _geometry_key(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def compute_geometry(reader):
+    """Géométrie de toutes les pages (seuls les dictionnaires de page sont lus, pas leur contenu)"""
+    return [page_geometry(page) for page in reader.pages]
+
+def cache_geometry(path, geometry):
+    """Mémorise la géométrie calculée pour un fichier (par exemple à l'upload)"""
+    _geometry_cache.set(_geometry_key(path), geometry)
+
+def document_geometry(path, reader=None):
+    """Géométrie de toutes les pages d'un fichier, mise en cache par (chemin, mtime, taille)"""
+    key = _geometry_key(path)
+    geometry = _geometry_cache.get(key)
+    metrics.inc('signature_document_cache_total', cache='geometry', result='miss' if geometry is None else 'hit')
+    if geometry is None:
+        if reader is None:
+            document = load_document(path)
+            with document.lock:
+                geometry = compute_geometry(document.reader)
+            _document_cache.set(key, document)  # Taille réévaluée : toutes les pages sont analysées
+        else:
+            geometry = compute_geometry(reader)
+        _geometry_cache.set(key, geometry)
+    return geometry
+
+DOCUMENT_CACHE_ENTRIES = int(os.environ.get('DOCUMENT_CACHE_ENTRIES', '64'))
+DOCUMENT_CACHE_MAX_BYTES = int(os.environ.get('DOCUMENT_CACHE_MB', '128')) * 1024 * 1024
+DOCUMENT_CACHE_TTL = int(os.environ.get('DOCUMENT_CACHE_TTL', '900'))
+PARSED_OBJECT_BYTES = 3 * 1024  # Mémoire moyenne d'un objet analysé par PyPDF2 (mesurée)
+
+class ParsedDocument:
+    """Document analysé une fois par processus : contenu, table xref (PdfReader),
+    pages déjà localisées
+
+    Les objets sont lus à la demande et mémorisés par le PdfReader ; une
+    signature suivante (nouvel essai, autre page, autre signataire) repart de
+    ce travail. PyPDF2 n'étant pas thread-safe, les accès passent par lock.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.reader = PdfReader(io.BytesIO(data))
+        self.lock = threading.RLock()
+        self._pages = {}
+
+    def memory(self):
+        """Estimation de la mémoire occupée (octets du fichier + objets analysés)"""
+        return len(self.data) + PARSED_OBJECT_BYTES * len(self.reader.resolved_objects)
+
+    def page_count(self):
+        with self.lock:
+            return page_count(self.reader)
+
+    def locate(self, page_num):
+        """(référence, dictionnaire, attributs hérités) d'une page, voir locate_page"""
+        with self.lock:
+            location = self._pages.get(page_num)
+            if location is None:
+                location = self._pages[page_num] = locate_page(self.reader, page_num)
+            return location
+
+    def page_geometry(self, page_num):
+        """Géométrie d'une page, sans aplatir l'arbre des pages"""
+        with self.lock:
+            return page_geometry(self.locate(page_num)[2])
+
+_document_cache = LRUCache(
+    max_entries=DOCUMENT_CACHE_ENTRIES,
+    ttl=DOCUMENT_CACHE_TTL,
+    max_bytes=DOCUMENT_CACHE_MAX_BYTES,
+    sizeof=lambda document: document.memory()
+)
+
+def load_document(path):
+    """Document analysé d'un fichier, mis en cache par (chemin, mtime, taille)
+
+    Les uploads étant rangés par SHA-256, la clé identifie aussi le contenu.
+    """
+    key = _geometry_key(path)
+    document = _document_cache.get(key)
+    metrics.inc('signature_document_cache_total', cache='pdf', result='hit' if document else 'miss')
+    if document is None:
+        with metrics.stage('document_parse'):
+            with open(path, 'rb') as f:
+                document = ParsedDocument(f.read())
+        _document_cache.set(key, document)
+    return document
+
+def remember_document(path, document):
+    """Remet un document dans le cache après usage (sa taille a pu grandir)"""
+    _document_cache.set(_geometry_key(path), document)
+
+def geometry_as_dict(geometry):
+    """Représentation JSON d'une géométrie de page"""
+    return {
+        'width': round(geometry.width, 2),
+        'height': round(geometry.height, 2),
+        'rotate': geometry.rotate,
+        'media_box': [round(v, 2) for v in geometry.media_box],
+        'crop_box': [round(v, 2) for v in geometry.crop_box]
+    }
+
+def _to_user_space(geometry, x, y):
+    """Convertit un point de l'espace affiché (origine en bas à gauche de la page visible)
+    vers l'espace utilisateur PDF de la page"""
+    llx, lly, urx, ury = geometry.crop_box
+    if geometry.rotate == 90:
+        return urx - y, lly + x
+    if geometry.rotate == 180:
+        return urx - x, ury - y
+    if geometry.rotate == 270:
+        return llx + y, ury - x
+    return llx + x, lly + y
+
+def placement_matrix(geometry, placement):
+    """Matrice (a, b, c, d, e, f) qui envoie le carré unité de l'image sur le
+    rectangle de signature, droit dans le sens de lecture de la page"""
+    x0, y0 = _to_user_space(geometry, placement.x, placement.y)
+    x1, y1 = _to_user_space(geometry, placement.x + placement.width, placement.y)
+    x2, y2 = _to_user_space(geometry, placement.x, placement.y + placement.height)
+    return (x1 - x0, y1 - y0, x2 - x0, y2 - y0, x0, y0)
+
+def page_count(reader):
+    """Nombre de pages lu dans /Count de l'arbre des pages (sans l'aplatir)"""
+    return int(reader.trailer['/Root']['/Pages']['/Count'])
+
+def locate_page(reader, page_num):
+    """Trouve une page en descendant l'arbre des pages grâce aux /Count
+
+    Seuls les nœuds traversés sont analysés, contrairement à reader.pages qui
+    aplatit tout l'arbre. Retourne (référence, dictionnaire, attributs hérités).
+    """
+    node_ref = reader.trailer['/Root'].raw_get('/Pages')
+    node = node_ref.get_object()
+    if not 0 <= page_num < int(node.get('/Count', 0)):
+        raise IndexError(f'Page {page_num} inexistante')
+    inherited = {}
+    remaining = page_num
+    while True:
+        for attr in INHERITABLE_ATTRIBUTES:
+            if attr in node:
+                inherited[attr] = node.raw_get(attr)
+        if node.get('/Type') != '/Pages':
+            return node_ref, node, inherited
+        kids = node['/Kids']
+        if int(node['/Count']) == len(kids):
+            # Tous les enfants sont des feuilles : accès direct
+            node_ref = kids[remaining]
+            node = node_ref.get_object()
+            remaining = 0
+            continue
+        for kid_ref in kids:
+            kid = kid_ref.get_object()
+            count = int(kid.get('/Count', 1)) if kid.get('/Type') == '/Pages' else 1
+            if remaining < count:
+                node_ref, node = kid_ref, kid
+                break
+            remaining -= count
+        else:
+            raise IncrementalUpdateError('arbre des pages incohérent')
+
+class IncrementalUpdate:
+    """Accumule les objets ajoutés/remplacés puis les écrit après le PDF d'origine"""
+
+    def __init__(self, data, reader):
+        self.data = data
+        self.reader = reader
+        self.prev = _find_startxref(data)
+        head = data[self.prev:self.prev + 32]
+        if head.startswith(b'xref'):
+            self.uses_xref_stream = False
+        elif re.match(rb'\d+\s+\d+\s+obj', head):
+            self.uses_xref_stream = True
+        else:
+            raise IncrementalUpdateError('section xref introuvable à startxref')
+        self.next_id = self._size(reader)
+        self.objects = {}  # idnum -> (generation, corps)
+
+    @staticmethod
+    def _size(reader):
+        """/Size du document (PyPDF2 ne le conserve pas pour les xref en flux)"""
+        if '/Size' in reader.trailer:
+            return int(reader.trailer['/Size'])
+        ids = set(reader.xref_objStm)
+        for objects in reader.xref.values():
+            ids.update(objects)
+        return max(ids, default=0) + 1
+
+    def reserve(self):
+        """Réserve un nouveau numéro d'objet"""
+        idnum = self.next_id
+        self.next_id += 1
+        return idnum
+
+    def add(self, body, idnum=None):
+        """Ajoute un nouvel objet et retourne son numéro"""
+        if idnum is None:
+            idnum = self.reserve()
+        self.objects[idnum] = (0, body)
+        return idnum
+
+    def replace(self, reference, body):
+        """Remplace un objet existant (même numéro et génération)"""
+        self.objects[reference.idnum] = (reference.generation, body)
+
+    def _trailer_entries(self):
+        trailer = self.reader.trailer
+        entries = b'/Size ' + str(self.next_id).encode()
+        for key in ('/Root', '/Info', '/ID'):
+            if key in trailer:
+                entries += b' ' + key.encode() + b' ' + _serialize(trailer.raw_get(key))
+        entries += b' /Prev ' + str(self.prev).encode()
+        return entries
+
+    @staticmethod
+    def _subsections(ids):
+        """Regroupe des numéros d'objets triés en plages contiguës"""
+        groups = []
+        for idnum in ids:
+            if groups and groups[-1][-1] == idnum - 1:
+                groups[-1].append(idnum)
+            else:
+                groups.append([idnum])
+        return groups
+
+    def write(self, output):
+        """Écrit la mise à jour à la suite du flux output (déjà rempli avec le PDF d'origine)"""
+        position = len(self.data)
+        if not self.data.endswith((b'\n', b'\r')):
+            output.write(b'\n')
+            position += 1
+        offsets = {}
+        for idnum in sorted(self.objects):
+            generation, body = self.objects[idnum]
+            chunk = f'{idnum} {generation} obj\n'.encode() + body + b'\nendobj\n'
+            offsets[idnum] = (position, generation)
+            output.write(chunk)
+            position += len(chunk)
+
+        if self.uses_xref_stream:
+            xref_id = self.reserve()
+            offsets[xref_id] = (position, 0)
+            ids = sorted(offsets)
+            rows = b''.join(
+                b'\x01' + offsets[i][0].to_bytes(4, 'big') + offsets[i][1].to_bytes(2, 'big')
+                for i in ids
+            )
+            index = b' '.join(
+                f'{group[0]} {len(group)}'.encode() for group in self._subsections(ids)
+            )
+            dictionary = (
+                b'/Type /XRef /W [1 4 2] /Index [' + index + b'] ' + self._trailer_entries()
+            )
+            output.write(
+                f'{xref_id} 0 obj\n'.encode() + _stream_object(dictionary, rows) + b'\nendobj\n'
+            )
+        else:
+            output.write(b'xref\n')
+            for group in self._subsections(sorted(offsets)):
+                output.write(f'{group[0]} {len(group)}\n'.encode())
+                for idnum in group:
+                    offset, generation = offsets[idnum]
+                    output.write(f'{offset:010d} {generation:05d} n\r\n'.encode())
+            output.write(b'trailer\n<< ' + self._trailer_entries() + b' >>\n')
+        output.write(f'startxref\n{position}\n%%EOF\n'.encode())
+
+def group_by_page(placements):
+    """Regroupe les placements par numéro de page (ordre croissant)"""
+    pages = {}
+    for placement in placements:
+        pages.setdefault(int(placement.page), []).append(placement)
+    return dict(sorted(pages.items()))
+
+def stamp_incremental(input_path, output_path, placements, images):
+    """Appose les signatures via une seule mise à jour incrémentale
+
+    Chaque image n'est embarquée qu'une fois et partagée par toutes les pages
+    qui l'utilisent ; chaque page signée n'est réécrite qu'une fois.
+    """
+    document = load_document(input_path)
+    # Le document analysé est partagé par les signatures suivantes du processus
+    with document.lock:
+        with metrics.stage('sign_read'):
+            data, reader = document.data, document.reader
+            if reader.is_encrypted:
+                raise IncrementalUpdateError('document chiffré')
+            by_page = group_by_page(placements)
+            targets = {page_num: document.locate(page_num) for page_num in by_page}
+            for reference, _, _ in targets.values():
+                if not isinstance(reference, IndirectObject):
+                    raise IncrementalUpdateError('page sans référence indirecte')
+
+        update = IncrementalUpdate(data, reader)
+
+        # XObjects image des signatures (et leur masque alpha), une seule fois chacun
+        xobject_names = {}
+        with metrics.stage('sign_embed'):
+            for key in {placement.signature for placement in placements}:
+                image_header, image_data, smask = cached_image_xobjects(images[key])
+                if smask is not None:
+                    smask_id = update.add(smask)
+                    image_header += f' /SMask {smask_id} 0 R'.encode()
+                image_id = update.add(_stream_object(image_header, image_data))
+                xobject_names[key] = (NameObject(f'/Sig{image_id}'), IndirectObject(image_id, 0, reader))
+
+        # Flux d'ouverture partagé : le contenu original est isolé entre q/Q
+        open_id = update.add(_stream_object(b'', b'q'))
+
+        pages_start = time.perf_counter()
+        for page_num, page_placements in by_page.items():
+            reference, page, inherited = targets[page_num]
+            geometry = page_geometry(inherited)
+
+            draw = [b'Q']
+            used = {}
+            for placement in page_placements:
+                name, image_ref = xobject_names[placement.signature]
+                used[name] = image_ref
+                matrix = ' '.join(_num(v) for v in placement_matrix(geometry, placement))
+                draw.append(f'q {matrix} cm {name} Do Q'.encode())
+            draw_id = update.add(_stream_object(b'', b'\n'.join(draw)))
+
+            contents = ArrayObject([IndirectObject(open_id, 0, reader)])
+            original = page.raw_get('/Contents') if '/Contents' in page else None
+            if isinstance(original, IndirectObject) and isinstance(original.get_object(), ArrayObject):
+                original = original.get_object()
+            if isinstance(original, ArrayObject):
+                contents.extend(original)
+            elif original is not None:
+                contents.append(original)
+            contents.append(IndirectObject(draw_id, 0, reader))
+
+            # Ressources : copie des ressources de la page + XObjects de signature
+            resources = DictionaryObject()
+            if '/Resources' in inherited:
+                for key, value in inherited['/Resources'].get_object().items():
+                    resources[NameObject(key)] = value
+            xobjects = DictionaryObject()
+            if '/XObject' in resources:
+                for key, value in resources['/XObject'].get_object().items():
+                    xobjects[NameObject(key)] = value
+            xobjects.update(used)
+            resources[NameObject('/XObject')] = xobjects
+
+            new_page = DictionaryObject()
+            for key, value in inherited.items():
+                new_page[NameObject(key)] = value
+            for key in page:
+                new_page[NameObject(key)] = page.raw_get(key)
+            new_page[NameObject('/Contents')] = contents
+            new_page[NameObject('/Resources')] = resources
+            update.replace(reference, _serialize(new_page))
+        metrics.observe('signature_stage_duration_seconds', time.perf_counter() - pages_start, stage='sign_pages')
+
+        with metrics.stage('sign_write'):
+            with open(output_path, 'wb') as output:
+                output.write(data)
+                update.write(output)
+    remember_document(input_path, document)
+
+def render_overlays(by_page, images, geometries):
+    """Rend (ou reprend du cache) le PDF de calques : une page par page signée,
+    au format de la page cible"""
+    key = tuple(
+        (geometries[page_num], tuple(
+            (images[p.signature].digest, p.x, p.y, p.width, p.height) for p in page_placements
+        ))
+        for page_num, page_placements in by_page.items()
+    )
+    cacheable = all(images[p.signature].digest for pages in by_page.values() for p in pages)
+    if cacheable:
+        overlay = _overlay_cache.get(key)
+        metrics.inc('signature_render_cache_total', cache='overlay', result='hit' if overlay else 'miss')
+        if overlay is not None:
+            return overlay
+
+    readers = {}
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet)
+    for page_num, page_placements in by_page.items():
+        geometry = geometries[page_num]
+        can.setPageSize((geometry.media_box[2] - geometry.media_box[0],
+                         geometry.media_box[3] - geometry.media_box[1]))
+        for placement in page_placements:
+            if placement.signature not in readers:
+                img = images[placement.signature].image
+                readers[placement.signature] = ImageReader(img.convert('RGBA') if img.mode == 'P' else img)
+            can.saveState()
+            can.transform(*placement_matrix(geometry, placement))
+            can.drawImage(readers[placement.signature], 0, 0, width=1, height=1, mask='auto')
+            can.restoreState()
+        can.showPage()
+    can.save()
+    overlay = packet.getvalue()
+    if cacheable:
+        _overlay_cache.set(key, overlay)
+    return overlay
+
+def stamp_rewrite(input_path, output_path, placements, images):
+    """Appose les signatures en réécrivant tout le document (méthode historique)"""
+    by_page = group_by_page(placements)
+    with metrics.stage('sign_read'):
+        existing_pdf = PdfReader(input_path)
+        for page_num in by_page:
+            if not 0 <= page_num < len(existing_pdf.pages):
+                raise IndexError(f'Page {page_num} inexistante')
+        geometries = {page_num: page_geometry(existing_pdf.pages[page_num]) for page_num in by_page}
+
+    # Fusionner avec le PDF original
+    with metrics.stage('sign_render'):
+        signature_pdf = PdfReader(io.BytesIO(render_overlays(by_page, images, geometries)))
+    merge_start = time.perf_counter()
+    overlays = {}
+    for i, page_num in enumerate(by_page):
+        # Le calque est dessiné en coordonnées absolues : il reprend la MediaBox
+        # de la page cible pour ne pas être rogné lors de la fusion
+        overlay = signature_pdf.pages[i]
+        overlay.mediabox = RectangleObject(geometries[page_num].media_box)
+        overlays[page_num] = overlay
+    output = PdfWriter()
+
+    for i, page in enumerate(existing_pdf.pages):
+        if i in overlays:
+            page.merge_page(overlays[i])
+        output.add_page(page)
+    metrics.observe('signature_stage_duration_seconds', time.perf_counter() - merge_start, stage='sign_merge')
+
+    with metrics.stage('sign_write'):
+        with open(output_path, 'wb') as output_file:
+            output.write(output_file)
+
+def stamp(input_path, output_path, placements, images, mode=None, optimize=None):
+    """Appose des signatures selon le mode configuré, avec repli sur la réécriture complète
+
+    Le document signé passe ensuite par optimizer.optimize (OUTPUT_OPTIMIZE
+    par défaut). Retourne un SignResult.
+    """
+    if not placements:
+        raise ValueError('Aucun placement de signature')
+    mode = mode or SIGN_MODE
+    images = {
+        key: source if isinstance(source, SignatureImage) else SignatureImage(source)
+        for key, source in images.items()
+    }
+    if SIGNATURE_NORMALIZE:
+        with metrics.stage('sign_normalize'):
+            placements, images = normalize_placements(placements, images)
+    if mode == 'incremental':
+        try:
+            stamp_incremental(input_path, output_path, placements, images)
+            mode = 'incremental'
+        except IncrementalUpdateError as e:
+            print(f"Mise à jour incrémentale impossible ({e}), réécriture complète")
+            mode = 'rewrite'
+    if mode != 'incremental':
+        stamp_rewrite(input_path, output_path, placements, images)
+        mode = 'rewrite'
+    optimization = optimizer.optimize(output_path, optimize)
+    metrics.observe('signature_pdf_bytes', os.path.getsize(output_path), kind='signed')
+    metrics.observe('signature_pdf_pages', len({placement.page for placement in placements}), kind='signed')
+    return SignResult(mode, optimization)
@@ -0,0 +1,219 @@
+"""
+Prévisualisation des pages PDF
+
+Les pages sont rastérisées par pdfium dans un thread de rendu dédié (pdfium
+n'est pas thread-safe), puis stockées dans un cache disque adressé par
+contenu : la clé combine l'empreinte du PDF, la page, la résolution et le
+format, si bien qu'un même document n'est jamais rendu deux fois.
+"""
+import hashlib
+import io
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+import metrics
+from cache import LRUCache
+
+PREVIEW_FOLDER = os.environ.get('PREVIEW_FOLDER', 'previews')
+PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('PREVIEW_CACHE_MB', '256')) * 1024 * 1024
+PREVIEW_DEFAULT_DPI = int(os.environ.get('PREVIEW_DEFAULT_DPI', '96'))
+PREVIEW_MIN_DPI = 36
+PREVIEW_MAX_DPI = int(os.environ.get('PREVIEW_MAX_DPI', '200'))
+PREVIEW_TIMEOUT = float(os.environ.get('PREVIEW_TIMEOUT', '30'))
+PREVIEW_FORMATS = {'png': 'image/png', 'webp': 'image/webp'}
+PREVIEW_DOCUMENT_ENTRIES = int(os.environ.get('PREVIEW_DOCUMENT_ENTRIES', '16'))  # Documents gardés ouverts
+PREVIEW_DOCUMENT_TTL = int(os.environ.get('DOCUMENT_CACHE_TTL', '900'))
+
+class PreviewUnavailable(Exception):
+    """Le rendu des pages n'est pas disponible (pypdfium2 absent)"""
+
+_digest_cache = LRUCache(max_entries=1024)
+
+def _digest_key(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def remember_digest(path, digest):
+    """Mémorise l'empreinte d'un fichier déjà hachée ailleurs (à la réception de l'upload)"""
+    _digest_cache.set(_digest_key(path), digest)
+
+def file_digest(path):
+    """SHA-256 d'un fichier, mémorisé par (chemin, mtime, taille)"""
+    key = _digest_key(path)
+    digest = _digest_cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        _digest_cache.set(key, digest)
+    return digest
+
+def preview_key(digest, page, dpi, fmt):
+    """Clé de cache (et ETag) d'une prévisualisation"""
+    return hashlib.sha256(f'{digest}:{page}:{dpi}:{fmt}'.encode()).hexdigest()
+
+class PreviewCache:
+    """Cache disque des prévisualisations, évincé par taille (les moins récemment lues d'abord)"""
+
+    def __init__(self, folder=PREVIEW_FOLDER, max_bytes=PREVIEW_CACHE_MAX_BYTES):
+        # Chemin absolu : send_file résout les chemins relatifs depuis app.root_path, pas le cwd
+        self.folder = os.path.abspath(folder)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._scan())
+
+    def path_for(self, key, fmt):
+        return os.path.join(self.folder, key[:2], f'{key}.{fmt}')
+
+    def get(self, key, fmt):
+        """Retourne le chemin d'une prévisualisation en cache, ou None"""
+        path = self.path_for(key, fmt)
+        try:
+            os.utime(path, None)  # Marque l'entrée comme récemment utilisée
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, fmt, data):
+        """Enregistre une prévisualisation (écriture atomique) puis évince si nécessaire"""
+        path = self.path_for(key, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+        return path
+
+    def _scan(self):
+        """Liste (mtime, taille, chemin) de toutes les entrées du cache"""
+        entries = []
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        """Supprime les entrées les plus anciennes jusqu'à repasser sous 90 % du plafond"""
+        entries = sorted(self._scan())
+        self._size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        return {'folder': self.folder, 'bytes': self._size, 'max_bytes': self.max_bytes}
+
+class PreviewRenderer:
+    """Thread de rendu en arrière-plan, avec dédoublonnage des rendus en cours"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preview')
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Documents pdfium ouverts (structure déjà analysée), utilisés par le
+        # seul thread de rendu : la page suivante et les autres résolutions
+        # ne rouvrent pas le fichier. Fermés par pdfium quand ils sont évincés.
+        self._documents = LRUCache(max_entries=PREVIEW_DOCUMENT_ENTRIES, ttl=PREVIEW_DOCUMENT_TTL)
+
+    def _open(self, pdf_path):
+        key = _digest_key(pdf_path)
+        document = self._documents.get(key)
+        metrics.inc('signature_document_cache_total', cache='preview', result='hit' if document else 'miss')
+        if document is None:
+            document = pdfium.PdfDocument(pdf_path)
+            self._documents.set(key, document)
+        return document
+
+    def _render(self, pdf_path, page, dpi, fmt, key):
+        try:
+            document = self._open(pdf_path)
+            if not 0 <= page < len(document):
+                raise IndexError(f'Page {page} inexistante')
+            pdf_page = document[page]
+            try:
+                image = pdf_page.render(scale=dpi / 72).to_pil()
+            finally:
+                pdf_page.close()
+            buffer = io.BytesIO()
+            if fmt == 'webp':
+                image.save(buffer, 'WEBP', quality=80, method=4)
+            else:
+                image.save(buffer, 'PNG', compress_level=6)
+            return self.cache.put(key, fmt, buffer.getvalue())
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def submit(self, pdf_path, page, dpi, fmt, key):
+        """Planifie un rendu (ou rejoint un rendu déjà en cours pour la même clé)"""
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._render, pdf_path, page, dpi, fmt, key)
+                self._pending[key] = future
+            return future
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+def get_renderer():
+    """Retourne le moteur de rendu du processus courant"""
+    global _renderer
+    if pdfium is None:
+        raise PreviewUnavailable('pypdfium2 non installé')
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = PreviewRenderer(PreviewCache())
+        return _renderer
+
+def normalize_options(dpi, fmt):
+    """Borne la résolution et valide le format demandé"""
+    dpi = max(PREVIEW_MIN_DPI, min(PREVIEW_MAX_DPI, dpi or PREVIEW_DEFAULT_DPI))
+    fmt = (fmt or 'png').lower()
+    if fmt not in PREVIEW_FORMATS:
+        raise ValueError(f"Format non supporté : {fmt}")
+    return dpi, fmt
+
+def get_preview(pdf_path, page, dpi, fmt):
+    """Retourne (chemin, ETag) de la prévisualisation, en la rendant si nécessaire
+
+    La page suivante est rendue en arrière-plan pour accélérer la navigation.
+    """
+    renderer = get_renderer()
+    digest = file_digest(pdf_path)
+    key = preview_key(digest, page, dpi, fmt)
+    path = renderer.cache.get(key, fmt)
+    if path is None:
+        path = renderer.submit(pdf_path, page, dpi, fmt, key).result(timeout=PREVIEW_TIMEOUT)
+
+    next_key = preview_key(digest, page + 1, dpi, fmt)
+    if renderer.cache.get(next_key, fmt) is None:
+        future = renderer.submit(pdf_path, page + 1, dpi, fmt, next_key)
+        future.add_done_callback(lambda f: f.exception())  # Erreurs de préchargement ignorées
+    return path, key
@@ -0,0 +1,175 @@
+"""
+Client de vérification reCAPTCHA v3
+
+Une session HTTP persistante réutilise les connexions TLS vers l'API Google,
+les tokens déjà présentés sont mémorisés quelques minutes et refusés sans
+appel s'ils reviennent (un token ne sert qu'une fois, comme côté Google : un
+token accepté ne peut pas être rejoué), et un disjoncteur coupe les appels
+quand l'API est dégradée : après RECAPTCHA_BREAKER_FAILURES échecs
+consécutifs, les vérifications sont court-circuitées pendant
+RECAPTCHA_BREAKER_COOLDOWN secondes au lieu de bloquer chaque worker
+jusqu'au timeout. L'appel à Google reste synchrone dans le thread de la
+requête, borné par RECAPTCHA_TIMEOUT et par le disjoncteur.
+"""
+import hashlib
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import LRUCache
+from executors import LatencyHistogram
+
+RECAPTCHA_SECRET_KEY = os.environ.get('RECAPTCHA_SECRET_KEY', '')
+RECAPTCHA_VERIFY_URL = os.environ.get('RECAPTCHA_VERIFY_URL', 'https://www.google.com/recaptcha/api/siteverify')
+RECAPTCHA_MIN_SCORE = float(os.environ.get('RECAPTCHA_MIN_SCORE', '0.5'))
+RECAPTCHA_TIMEOUT = float(os.environ.get('RECAPTCHA_TIMEOUT', '2'))
+RECAPTCHA_BREAKER_FAILURES = int(os.environ.get('RECAPTCHA_BREAKER_FAILURES', '5'))
+RECAPTCHA_BREAKER_COOLDOWN = float(os.environ.get('RECAPTCHA_BREAKER_COOLDOWN', '30'))
+RECAPTCHA_CACHE_TTL = 120  # Durée de validité d'un token reCAPTCHA (2 minutes)
+
+class CircuitBreaker:
+    """Disjoncteur : fermé, ouvert (appels refusés) puis semi-ouvert (un appel d'essai)"""
+
+    def __init__(self, max_failures=RECAPTCHA_BREAKER_FAILURES, cooldown=RECAPTCHA_BREAKER_COOLDOWN):
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """L'appel peut-il être tenté ? (un seul appel d'essai en semi-ouvert)"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None or self.failures >= self.max_failures:
+                if self.opened_at is None:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures, 'trips': self.trips}
+
+class RecaptchaClient:
+    """Vérifie les tokens reCAPTCHA v3 (session partagée, cache, disjoncteur)"""
+
+    def __init__(self, secret_key=RECAPTCHA_SECRET_KEY, verify_url=RECAPTCHA_VERIFY_URL,
+                 min_score=RECAPTCHA_MIN_SCORE, timeout=RECAPTCHA_TIMEOUT):
+        self.secret_key = secret_key
+        self.verify_url = verify_url
+        self.min_score = min_score
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=16))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=16))
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyHistogram()
+        self._consumed = LRUCache(max_entries=4096, ttl=RECAPTCHA_CACHE_TTL)  # Tokens déjà présentés
+        self._lock = threading.Lock()
+        self.counters = {'accepted': 0, 'rejected': 0, 'cached': 0, 'errors': 0, 'short_circuited': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def verify(self, token):
+        """True si le token est valide (ou si la vérification est indisponible)"""
+        if not self.secret_key:
+            # Si pas de clé configurée, on accepte (mode dev)
+            return True
+        if not token:
+            self._count('rejected')
+            return False
+
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        if self._consumed.get(key) is not None:
+            # Token refusé ou déjà utilisé : jamais accepté une seconde fois
+            self._count('cached')
+            return False
+        self._consumed.set(key, True)
+
+        if not self.breaker.allow():
+            # API dégradée : on accepte sans attendre pour ne pas bloquer les vrais users
+            self._count('short_circuited')
+            return True
+
+        start = time.perf_counter()
+        try:
+            response = self.session.post(
+                self.verify_url,
+                data={'secret': self.secret_key, 'response': token},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            result = response.json()
+        except Exception as e:
+            self.breaker.record_failure()
+            self._count('errors')
+            print(f"Erreur vérification reCAPTCHA: {e}")
+            # En cas d'erreur, on accepte pour ne pas bloquer les vrais users
+            return True
+        finally:
+            self.latency.observe(time.perf_counter() - start)
+        self.breaker.record_success()
+
+        # reCAPTCHA v3 retourne un score de 0.0 à 1.0
+        # Score >= min_score = probablement humain
+        accepted = bool(result.get('success')) and result.get('score', 0) >= self.min_score
+        if accepted:
+            self._count('accepted')
+        else:
+            self._count('rejected')
+            print(f"reCAPTCHA failed: score={result.get('score', 0)}")
+        return accepted
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['breaker'] = self.breaker.stats()
+        stats['latency'] = self.latency.snapshot()
+        return stats
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Client reCAPTCHA du processus courant"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RecaptchaClient()
+        return _client
+
+def verify(token):
+    """Vérifie un token reCAPTCHA v3 avec le client partagé"""
+    return get_client().verify(token)
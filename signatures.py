@@ -0,0 +1,137 @@
+"""
+Stockage des signatures sauvegardées
+
+Les images ne sont plus conservées en data URL dans saved_signatures : elles
+sont normalisées en PNG compressé, dédoublonnées par SHA-256 dans la table
+signature_blobs (avec une miniature calculée une fois pour toutes), et
+saved_signatures ne garde qu'une référence vers ce contenu.
+"""
+import base64
+import hashlib
+import io
+import json
+from collections import namedtuple
+
+import database as db
+import pdf_engine
+
+THUMBNAIL_SIZE = (160, 80)
+MAX_SIZE = (1200, 600)  # Résolution max conservée (le placement réel n'est pas encore connu)
+
+StoredImage = namedtuple('StoredImage', 'sha256 data width height original_size thumbnail box')
+
+def _png_bytes(img):
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+def normalize(signature_data):
+    """Décode une signature (data URL ou base64) et la normalise en PNG compressé
+
+    L'image est recadrée sur l'encre et réduite en palette (voir
+    pdf_engine.normalize_signature) ; box situe la zone conservée dans le
+    cadre d'origine. Lève ValueError si l'image est invalide ou vide.
+    """
+    raw = pdf_engine.decode_signature(signature_data)
+    img = pdf_engine.load_image(raw)
+    if img.width > MAX_SIZE[0] or img.height > MAX_SIZE[1]:
+        img = img.convert('RGBA') if 'A' in img.getbands() or 'transparency' in img.info else img
+        img.thumbnail(MAX_SIZE, pdf_engine.Image.LANCZOS)
+    img, box = pdf_engine.normalize_signature(img)
+    data = _png_bytes(img)
+
+    thumbnail = img.convert('RGBA') if img.mode == 'P' else img.copy()
+    thumbnail.thumbnail(THUMBNAIL_SIZE)
+    return StoredImage(
+        sha256=hashlib.sha256(data).hexdigest(),
+        data=data,
+        width=img.width,
+        height=img.height,
+        original_size=len(raw),
+        thumbnail=_png_bytes(thumbnail),
+        box=box
+    )
+
+def thumbnail_url(thumbnail):
+    """Miniature PNG sous forme de data URL (affichable directement dans une <img>)"""
+    if not thumbnail:
+        return None
+    return 'data:image/png;base64,' + base64.b64encode(thumbnail).decode('ascii')
+
+def save(user_id, name, signature_data):
+    """Normalise et enregistre une signature ; retourne son identifiant"""
+    image = normalize(signature_data)
+    return db.save_signature(user_id, name, image)
+
+def list_for_user(user_id):
+    """Métadonnées et miniatures des signatures d'un utilisateur (sans les images complètes)"""
+    signatures = []
+    for row in db.get_user_signatures(user_id):
+        row['thumbnail'] = thumbnail_url(row.pop('thumbnail'))
+        row['image_url'] = f"/api/signatures/{row['id']}/image"
+        signatures.append(row)
+    return signatures
+
+def load(signature_id, user_id):
+    """Image complète d'une signature sauvegardée (pdf_engine.SignatureImage), ou None"""
+    signature = db.get_signature(signature_id, user_id)
+    if not signature:
+        return None
+    if signature['data'] is None:
+        # Ancienne signature restée en data URL (non convertible à la migration)
+        return pdf_engine.SignatureImage(pdf_engine.decode_signature(signature['signature_data']))
+    box = json.loads(signature['content_box']) if signature['content_box'] else None
+    return pdf_engine.SignatureImage(signature['data'], box=box, digest=signature['blob_sha256'])
+
+def _legacy_image(signature_data):
+    """Conversion d'une data URL telle que publiée avec la migration 3 : PNG sans recadrage"""
+    raw = pdf_engine.decode_signature(signature_data)
+    img = pdf_engine.load_image(raw)
+    if img.mode not in ('RGBA', 'LA', 'RGB', 'L'):
+        img = img.convert('RGBA')
+    data = _png_bytes(img)
+
+    thumbnail = img.copy()
+    thumbnail.thumbnail(THUMBNAIL_SIZE)
+    return StoredImage(
+        sha256=hashlib.sha256(data).hexdigest(),
+        data=data,
+        width=img.width,
+        height=img.height,
+        original_size=len(raw),
+        thumbnail=_png_bytes(thumbnail),
+        box=None
+    )
+
+def migrate_legacy(conn):
+    """Migration 3 : convertit les data URL de saved_signatures en contenus dédoublonnés
+
+    Figée comme à sa publication : elle ne dépend ni du recadrage ni des
+    colonnes ajoutées depuis (content_box, migration 4), afin qu'une base
+    neuve et une base déjà en version 3 aient le même contenu.
+    """
+    rows = conn.execute(
+        "SELECT id, signature_data FROM saved_signatures WHERE blob_sha256 IS NULL AND signature_data != ''"
+    ).fetchall()
+    converted = 0
+    for row in rows:
+        try:
+            image = _legacy_image(row['signature_data'])
+        except ValueError:
+            print(f"Signature {row['id']} illisible, laissée en data URL")
+            continue
+        conn.execute(
+            '''INSERT INTO signature_blobs
+               (sha256, data, width, height, size, original_size, thumbnail, ref_count)
+               VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+               ON CONFLICT (sha256) DO UPDATE SET ref_count = ref_count + 1''',
+            (image.sha256, image.data, image.width, image.height, len(image.data),
+             image.original_size, image.thumbnail)
+        )
+        conn.execute(
+            "UPDATE saved_signatures SET blob_sha256 = ?, signature_data = '' WHERE id = ?",
+            (image.sha256, row['id'])
+        )
+        converted += 1
+    if rows:
+        print(f"{converted}/{len(rows)} signatures converties")
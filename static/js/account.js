@@ -78,9 +78,9 @@ async function loadUserStats() {
     
     try {
         // Charger l'historique
-        const historyResponse = await apiCall('/api/history?limit=1000');
+        const historyResponse = await apiCall('/api/history?limit=1&fields=id&count=1');
         const historyData = await historyResponse.json();
-        userStats.totalSignedDocs = historyData.history?.length || 0;
+        userStats.totalSignedDocs = historyData.total || 0;
         
         // Charger les signatures
         const signaturesResponse = await apiCall('/api/signatures');
@@ -6,6 +6,7 @@ let currentFileId = null;
 let signatureCanvas = null;
 let savedSignatures = [];
 let selectedSavedSignature = null;
+let currentPages = [];
 
 // ============================================
 // CALLBACKS FROM COMMON.JS
@@ -127,7 +128,8 @@ async function handleFile(file) {
             // Afficher la section signature
             document.getElementById('signatureSection')?.classList.remove('hidden');
             
-            // Remplir le sélecteur de pages
+            // Remplir le sélecteur de pages (avec le format réel de chaque page)
+            currentPages = data.pages || [];
             populatePageSelect(data.num_pages);
         } else {
             showMessage(data.error || 'Erreur lors du chargement', 'error');
@@ -146,9 +148,40 @@ function populatePageSelect(numPages) {
     for (let i = 0; i < numPages; i++) {
         const option = document.createElement('option');
         option.value = i;
-        option.textContent = `Page ${i + 1}`;
+        const geometry = currentPages[i];
+        option.textContent = geometry
+            ? `Page ${i + 1} (${Math.round(geometry.width)} × ${Math.round(geometry.height)} pt)`
+            : `Page ${i + 1}`;
         select.appendChild(option);
     }
+    select.onchange = () => {
+        updatePositionLimits();
+        updatePagePreview();
+    };
+    updatePositionLimits();
+    updatePagePreview();
+}
+
+function updatePagePreview() {
+    // Aperçu rendu côté serveur (/api/preview), mis en cache par le navigateur
+    const img = document.getElementById('pagePreview');
+    if (!img || !currentFileId) return;
+    
+    const page = parseInt(document.getElementById('pageSelect')?.value || 0);
+    img.onload = () => img.classList.remove('hidden');
+    img.onerror = () => img.classList.add('hidden');
+    img.src = `/api/preview/${encodeURIComponent(currentFileId)}/${page}?dpi=72`;
+}
+
+function updatePositionLimits() {
+    // Les positions sont exprimées dans le sens de lecture de la page (rotation comprise)
+    const geometry = currentPages[parseInt(document.getElementById('pageSelect')?.value || 0)];
+    if (!geometry) return;
+    
+    const xInput = document.getElementById('xPosition');
+    const yInput = document.getElementById('yPosition');
+    if (xInput) xInput.max = Math.floor(geometry.width);
+    if (yInput) yInput.max = Math.floor(geometry.height);
 }
 
 // ============================================
@@ -219,7 +252,7 @@ function displaySavedSignaturesForSelection() {
         item.className = 'signature-item';
         item.onclick = () => selectSavedSignature(sig.id);
         item.innerHTML = `
-            <img src="${sig.signature_data}" alt="${sig.name}" class="signature-preview">
+            <img src="${sig.thumbnail}" alt="${sig.name}" class="signature-preview">
             <div class="signature-name">${sig.name}</div>
         `;
         container.appendChild(item);
@@ -286,11 +319,13 @@ async function signPDF() {
         return;
     }
     
-    let signatureData;
+    let signatureData = null;
+    let signatureId = null;
     
     // Vérifier si on utilise une signature sauvegardée ou dessinée
     if (selectedSavedSignature) {
-        signatureData = selectedSavedSignature.signature_data;
+        // L'image complète reste sur le serveur : seul son identifiant est envoyé
+        signatureId = selectedSavedSignature.id;
     } else {
         if (!signatureCanvas || signatureCanvas.isEmpty()) {
             showMessage('Veuillez créer une signature', 'error');
@@ -321,6 +356,7 @@ async function signPDF() {
             body: JSON.stringify({
                 file_id: currentFileId,
                 signature: signatureData,
+                signature_id: signatureId,
                 position: position,
                 page: page
             })
@@ -172,7 +172,7 @@ function displaySavedSignatures() {
             const item = document.createElement('div');
             item.className = 'signature-item';
             item.innerHTML = `
-                <img src="${signature.signature_data}" alt="${signature.name}" class="signature-preview">
+                <img src="${signature.thumbnail}" alt="${signature.name}" class="signature-preview">
                 <div class="signature-name">${signature.name}</div>
                 <button class="signature-delete" onclick="confirmDeleteSignature(${signature.id})" title="Supprimer">
                     ×
@@ -0,0 +1,84 @@
+"""
+Stockage des PDF uploadés, adressé par contenu
+
+Chaque contenu est stocké une seule fois sous uploads/blobs/<ab>/<sha256>.pdf ;
+chaque upload (file_id) n'est qu'une ligne de la table uploads pointant vers
+ce contenu. Le nombre de pages et la géométrie calculés au premier upload
+sont conservés dans upload_blobs et réutilisés par les uploads identiques.
+"""
+import json
+import os
+
+import database as db
+from cache import LRUCache
+
+class UploadStore:
+    """Magasin de PDF uploadés, dédoublonnés par SHA-256 et comptés par référence"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.blob_folder = os.path.join(folder, 'blobs')
+        os.makedirs(self.blob_folder, exist_ok=True)
+        self._paths = LRUCache(max_entries=4096)  # file_id -> chemin (correspondance immuable)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blob_folder, sha256[:2], f'{sha256}.pdf')
+
+    def find(self, sha256):
+        """Métadonnées d'un contenu déjà stocké, ou None"""
+        blob = db.get_upload_blob(sha256)
+        if blob and os.path.exists(self.blob_path(sha256)):
+            return blob
+        return None
+
+    def store(self, stream, sha256):
+        """Range le fichier partiel d'un upload comme contenu sha256"""
+        path = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stream.commit(path)
+        return path
+
+    def register(self, file_id, sha256, size, num_pages, geometry, filename, user_id=None):
+        """Enregistre un upload (file_id) pointant vers un contenu stocké"""
+        db.add_upload(file_id, sha256, size, num_pages, json.dumps(geometry), filename, user_id)
+        path = self.blob_path(sha256)
+        self._paths.set(file_id, path)
+        return path
+
+    def resolve(self, file_id):
+        """Chemin du PDF d'un file_id (ou d'un ancien upload non dédoublonné), ou None"""
+        if not file_id or os.path.basename(file_id) != file_id:
+            return None
+        path = self._paths.get(file_id)
+        if path is None:
+            upload = db.get_upload(file_id)
+            if upload:
+                path = self.blob_path(upload['sha256'])
+            else:
+                path = os.path.join(self.folder, file_id)
+        if not os.path.isfile(path):
+            return None
+        self._paths.set(file_id, path)
+        return path
+
+    def geometry(self, file_id):
+        """Géométrie des pages enregistrée à l'upload (liste de dictionnaires), ou None"""
+        upload = db.get_upload(file_id)
+        if not upload or not upload['geometry']:
+            return None
+        return json.loads(upload['geometry'])
+
+    def release(self, file_id):
+        """Supprime un upload ; retourne True si son contenu, plus référencé, a été effacé"""
+        self._paths.delete(file_id)
+        sha256 = db.delete_upload(file_id)
+        if sha256 is None:
+            legacy = os.path.join(self.folder, os.path.basename(file_id))
+            if os.path.isfile(legacy):
+                os.remove(legacy)
+            return False
+        try:
+            os.remove(self.blob_path(sha256))
+        except OSError:
+            pass
+        return True
@@ -0,0 +1,97 @@
+"""
+Configuration commune des tests : base, dossiers et état partagé isolés
+
+Les modules lisent leur configuration à l'import : l'environnement est donc
+fixé ici, avant tout import de l'application. L'application tourne comme en
+production derrière un proxy (TRUSTED_PROXIES=1), avec le calcul PDF dans le
+processus (EXECUTOR_MODE=inline).
+"""
+import base64
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+from PIL import Image, ImageDraw
+from reportlab.pdfgen import canvas
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='signature-tests-')
+
+os.environ.update({
+    'DATABASE_PATH': os.path.join(WORKDIR, 'signature_app.db'),
+    'ADMISSION_DB': os.path.join(WORKDIR, 'admission.db'),
+    'EXECUTOR_SLOTS_DIR': os.path.join(WORKDIR, 'slots'),
+    'METRICS_DIR': os.path.join(WORKDIR, 'metrics'),
+    'EXECUTOR_MODE': 'inline',
+    'JANITOR_INTERVAL': '0',
+    'TRUSTED_PROXIES': '1',
+    'RECAPTCHA_SECRET_KEY': '',
+})
+os.chdir(WORKDIR)  # uploads/, signed/ et previews/ sont relatifs au répertoire courant
+sys.path.insert(0, ROOT)
+
+def pytest_addoption(parser):
+    parser.addoption('--plan-rows', type=int, default=20_000,
+                     help="lignes d'historique de la base de test_query_plans (2000000 pour un gros volume)")
+    parser.addoption('--plan-users', type=int, default=500,
+                     help='utilisateurs de la base de test_query_plans')
+
+def _pdf_bytes(pages=1):
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+    for number in range(pages):
+        pdf.drawString(72, 720, f'Page {number + 1}')
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+def _signature_data(padding=0):
+    img = Image.new('RGBA', (300 + 2 * padding, 100 + 2 * padding), (255, 255, 255, 0))
+    stroke = [(20 + padding, 70 + padding), (120 + padding, 30 + padding), (280 + padding, 60 + padding)]
+    ImageDraw.Draw(img).line(stroke, fill=(0, 0, 0, 255), width=6)
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+@pytest.fixture
+def make_pdf():
+    """Fabrique de PDF de test : make_pdf(pages) -> octets"""
+    return _pdf_bytes
+
+@pytest.fixture
+def make_signature():
+    """Fabrique de signatures (data URL PNG) ; padding = marge transparente en pixels"""
+    return _signature_data
+
+@pytest.fixture(scope='session', autouse=True)
+def application():
+    """Application importée une fois pour toute la session : base créée, migrations appliquées"""
+    import app as appmod
+    return appmod.app
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch, application):
+    """Base vide (migrations appliquées) propre au test, à la place de la base de la session"""
+    import database as db
+    monkeypatch.setattr(db, 'DATABASE_PATH', str(tmp_path / 'test.db'))
+    db.init_db()
+    return db
+
+@pytest.fixture
+def client(application):
+    return application.test_client()
+
+@pytest.fixture
+def upload(client):
+    """Envoie un PDF par /api/upload et retourne son file_id"""
+    def upload(content, filename='contrat.pdf', headers=None):
+        response = client.post('/api/upload', data={'file': (io.BytesIO(content), filename)}, headers=headers)
+        assert response.status_code == 200, response.json
+        return response.json['file_id']
+    return upload
+
+@pytest.fixture
+def file_id(upload):
+    return upload(_pdf_bytes())
@@ -0,0 +1,65 @@
+"""
+Signature multiple (/api/sign/batch) : plusieurs pages et signatures en une passe
+"""
+import io
+
+import pytest
+from PyPDF2 import PdfReader
+
+import app as appmod
+
+def signature_names(reader, page_num):
+    """Noms des XObjects de signature d'une page"""
+    resources = reader.pages[page_num]['/Resources']
+    xobjects = resources['/XObject'] if '/XObject' in resources else {}
+    return sorted(name for name in xobjects if name.startswith('/Sig'))
+
+def test_batch_signs_several_pages(client, upload, make_pdf, make_signature):
+    file_id = upload(make_pdf(pages=4))
+    response = client.post('/api/sign/batch', json={
+        'file_id': file_id,
+        'signatures': {'paraphe': make_signature(), 'signature': make_signature(padding=20)},
+        'placements': [
+            {'page': 0, 'x': 450, 'y': 40, 'width': 80, 'height': 30, 'signature': 'paraphe'},
+            {'page': 1, 'x': 450, 'y': 40, 'width': 80, 'height': 30, 'signature': 'paraphe'},
+            {'page': 3, 'x': 450, 'y': 40, 'width': 80, 'height': 30, 'signature': 'paraphe'},
+            {'page': '3', 'x': '300', 'y': '100', 'width': '200', 'height': '70', 'signature': 'signature'},
+        ]
+    })
+    assert response.status_code == 200, response.json
+    assert response.json['signatures_applied'] == 4
+    assert response.json['pages_signed'] == 3
+
+    download = client.get(f"/api/download/{response.json['signed_file_id']}")
+    assert download.status_code == 200
+    reader = PdfReader(io.BytesIO(download.data))
+    assert len(reader.pages) == 4
+    assert [len(signature_names(reader, page)) for page in range(4)] == [1, 1, 0, 2]
+    # Une image embarquée une seule fois, partagée par les pages qui l'utilisent
+    assert signature_names(reader, 0) == signature_names(reader, 1)
+
+@pytest.mark.parametrize('placement, status', [
+    ({'page': 0, 'signature': 'inconnue'}, 400),
+    ({'page': 0, 'x': 'droite', 'signature': 'paraphe'}, 400),
+    ({'page': 9, 'signature': 'paraphe'}, 400),
+    ({'page': 0, 'signature_id': 1}, 401),
+    ('paraphe', 400),
+])
+def test_batch_rejects_invalid_item(client, upload, make_pdf, make_signature, placement, status):
+    file_id = upload(make_pdf(pages=2))
+    response = client.post('/api/sign/batch', json={
+        'file_id': file_id,
+        'signatures': {'paraphe': make_signature()},
+        'placements': [{'page': 0, 'signature': 'paraphe'}, placement]
+    })
+    assert response.status_code == status
+    assert 'error' in response.json
+    # Aucun document signé partiellement
+    assert client.get(f'/api/download/signed_{file_id}').status_code == 404
+
+def test_batch_requires_placements(client, file_id, monkeypatch):
+    assert client.post('/api/sign/batch', json={'file_id': file_id, 'placements': []}).status_code == 400
+    monkeypatch.setattr(appmod, 'BATCH_MAX_PLACEMENTS', 2)
+    placements = [{'page': 0, 'signature': 'paraphe'}] * 3
+    response = client.post('/api/sign/batch', json={'file_id': file_id, 'placements': placements})
+    assert response.status_code == 400
@@ -0,0 +1,84 @@
+"""
+Signature en masse (/api/sign/bulk) : archive ZIP envoyée en flux
+"""
+import io
+import json
+import zipfile
+
+import pytest
+from PyPDF2 import PdfReader
+
+import database as db
+
+@pytest.fixture
+def auth_headers():
+    with db.get_db() as conn:
+        # Compte inséré directement : connexion par jeton, sans bcrypt
+        user_id = conn.execute(
+            "INSERT INTO users (email, password_hash) VALUES ('masse@example.fr', 'x') "
+            "ON CONFLICT (email) DO UPDATE SET name = NULL RETURNING id"
+        ).fetchone()[0]
+    return {'Authorization': f'Bearer {db.create_session(user_id)}'}
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+def test_bulk_streams_signed_archive(client, auth_headers, make_pdf, make_signature):
+    first, second, third = make_pdf(pages=2), make_pdf(pages=3), make_pdf(pages=1)
+    archive = zip_bytes({
+        'lot/annexe.pdf': third,
+        'lot/notes.txt': b'ignore',
+        'lot/abime.pdf': b'%PDF-1.4 tronque',
+        '__MACOSX/lot/._annexe.pdf': b'metadonnees',
+    })
+    response = client.post('/api/sign/bulk', headers=auth_headers, data={
+        'files': [(io.BytesIO(first), 'contrat.pdf'), (io.BytesIO(second), 'contrat.pdf'),
+                  (io.BytesIO(archive), 'lot.zip')],
+        'signature': make_signature(),
+        'page': 'last',
+    })
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/zip'
+
+    with zipfile.ZipFile(io.BytesIO(response.data)) as result:
+        assert result.testzip() is None
+        names = result.namelist()
+        assert sorted(names) == ['rapport.json', 'signed_annexe.pdf', 'signed_contrat.pdf', 'signed_contrat_2.pdf']
+        assert names[-1] == 'rapport.json'  # Rapport écrit à la fin du flux
+        report = json.loads(result.read('rapport.json'))
+        originals = {'contrat.pdf': [first, second], 'annexe.pdf': [third]}
+        matched = []
+        for entry in report['results']:
+            if 'signed_file' not in entry:
+                continue
+            content = result.read(entry['signed_file'])
+            assert entry['size'] == len(content)
+            # Document signé par mise à jour incrémentale : il prolonge son original
+            original = next(o for o in originals[entry['file']] if content.startswith(o))
+            matched.append(original)
+            assert len(PdfReader(io.BytesIO(content)).pages) == len(PdfReader(io.BytesIO(original)).pages)
+            assert entry['pages_signed'] == 1
+
+    assert sorted(map(len, matched)) == sorted(map(len, (first, second, third)))
+    assert report['documents'] == 4 and report['signed'] == 3 and report['failed'] == 1
+    assert [entry['file'] for entry in report['results'] if 'error' in entry] == ['abime.pdf']
+
+def test_bulk_rejects_unreadable_archive(client, auth_headers, make_signature):
+    response = client.post('/api/sign/bulk', headers=auth_headers, data={
+        'files': [(io.BytesIO(b'pas une archive'), 'lot.zip')],
+        'signature': make_signature(),
+    })
+    assert response.status_code == 400
+    assert 'ZIP' in response.json['error']
+
+def test_bulk_requires_login(client, make_pdf, make_signature):
+    response = client.post('/api/sign/bulk', data={
+        'files': [(io.BytesIO(make_pdf()), 'contrat.pdf')],
+        'signature': make_signature(),
+    })
+    assert response.status_code == 401
@@ -0,0 +1,77 @@
+"""
+Téléchargement des PDF signés : ETag SHA-256, Range et délégation au proxy
+"""
+import hashlib
+import os
+import uuid
+
+import pytest
+
+import app as appmod
+import delivery
+
+@pytest.fixture
+def signed_file(make_pdf):
+    """PDF signé déposé dans le dossier servi par /api/download : (nom, contenu)"""
+    name = f'signed_{uuid.uuid4()}_contrat.pdf'
+    content = make_pdf(pages=3)
+    with open(os.path.join(appmod.signed_files.folder, name), 'wb') as f:
+        f.write(content)
+    return name, content
+
+def test_download_etag_and_not_modified(client, signed_file):
+    name, content = signed_file
+    response = client.get(f'/api/download/{name}')
+    assert response.status_code == 200
+    assert response.data == content
+    assert response.headers['ETag'] == f'"{hashlib.sha256(content).hexdigest()}"'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert 'private' in response.headers['Cache-Control']
+    assert response.headers['Content-Disposition'].startswith('attachment')
+
+    response = client.get(f'/api/download/{name}', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    assert not response.data
+
+def test_download_range(client, signed_file):
+    name, content = signed_file
+    size = len(content)
+
+    response = client.get(f'/api/download/{name}', headers={'Range': 'bytes=0-99'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 0-99/{size}'
+    assert response.data == content[:100]
+
+    response = client.get(f'/api/download/{name}', headers={'Range': 'bytes=-50'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes {size - 50}-{size - 1}/{size}'
+    assert response.data == content[-50:]
+
+    # Reprise avec un ETag périmé : document complet
+    response = client.get(f'/api/download/{name}', headers={'Range': 'bytes=0-99', 'If-Range': '"perime"'})
+    assert response.status_code == 200
+    assert response.data == content
+
+def test_download_unsatisfiable_range(client, signed_file):
+    name, content = signed_file
+    response = client.get(f'/api/download/{name}', headers={'Range': f'bytes={len(content) + 10}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(content)}'
+
+def test_download_unknown_file(client):
+    assert client.get('/api/download/signed_inconnu_contrat.pdf').status_code == 404
+    assert client.get('/api/download/..%2Fsignature_app.db').status_code == 404
+
+def test_download_delegated_to_proxy(client, signed_file, monkeypatch):
+    name, content = signed_file
+    monkeypatch.setattr(appmod, 'signed_files',
+                        delivery.SignedFileDelivery(appmod.signed_files.folder, mode='x-accel'))
+
+    response = client.get(f'/api/download/{name}')
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == f'/_signed/{name}'
+    assert not response.data  # Octets servis par le proxy
+
+    response = client.get(f'/api/download/{name}', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    assert 'X-Accel-Redirect' not in response.headers
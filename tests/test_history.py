@@ -0,0 +1,60 @@
+"""
+Historique paginé par clé (/api/history)
+"""
+import base64
+
+import pytest
+
+TIMESTAMPS = ['2026-01-02 09:00:00'] * 4 + ['2026-01-01 18:30:00'] * 3 + ['2026-01-01 08:00:00']
+
+@pytest.fixture
+def account(fresh_db):
+    db = fresh_db
+    with db.get_db() as conn:
+        # Comptes insérés directement : le test se connecte par jeton, sans bcrypt
+        user_id, other_id = (
+            conn.execute("INSERT INTO users (email, password_hash) VALUES (?, 'x')", (email,)).lastrowid
+            for email in ('historique@example.fr', 'autre@example.fr')
+        )
+        for i, created_at in enumerate(TIMESTAMPS):
+            for owner in (user_id, other_id):
+                conn.execute(
+                    '''INSERT INTO signature_history
+                       (user_id, original_filename, signed_filename, file_path, signature_page, created_at)
+                       VALUES (?, ?, ?, ?, 0, ?)''',
+                    (owner, f'doc{i}.pdf', f'signed_{owner}_{i}.pdf', f'signed/signed_{owner}_{i}.pdf', created_at)
+                )
+        expected = [row[0] for row in conn.execute(
+            'SELECT id FROM signature_history WHERE user_id = ? ORDER BY created_at DESC, id DESC', (user_id,)
+        )]
+    return {'Authorization': f'Bearer {db.create_session(user_id)}'}, expected
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 8])
+def test_history_pages_without_duplicates_or_gaps(client, account, limit):
+    headers, expected = account
+    seen = []
+    cursor = None
+    for _ in range(len(expected) + 1):
+        params = {'limit': limit, 'fields': 'signed_filename'}
+        if cursor:
+            params['cursor'] = cursor
+        response = client.get('/api/history', query_string=params, headers=headers)
+        assert response.status_code == 200, response.json
+        page = response.json['history']
+        assert len(page) <= limit
+        assert all(set(entry) == {'id', 'created_at', 'signed_filename'} for entry in page)
+        seen.extend(entry['id'] for entry in page)
+        cursor = response.json['next_cursor']
+        if cursor is None:
+            break
+    assert seen == expected  # Ordre (created_at, id) décroissant, sans doublon ni trou
+
+def encode(raw):
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+@pytest.mark.parametrize('cursor', ['pas un curseur', '%%%', encode('2026-01-01 10:00:00'), encode('2026-01-01|abc')])
+def test_history_rejects_malformed_cursor(client, account, cursor):
+    headers, _ = account
+    response = client.get('/api/history', query_string={'cursor': cursor}, headers=headers)
+    assert response.status_code == 400
+    assert response.json['error'] == 'Curseur invalide'
@@ -0,0 +1,56 @@
+"""
+File des signatures asynchrones : répartiteur et pool de calcul
+"""
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import database as db
+import jobs
+import pdf_engine
+
+class BrokenExecutor:
+    """Pool dont un processus est mort : toute soumission échoue"""
+
+    def __init__(self):
+        self.submitted = 0
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        raise BrokenProcessPool('A child process terminated abruptly')
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+def wait_for_status(job_id, statuses, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = db.get_sign_job(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'job {job_id} toujours {job["status"]}')
+
+def test_broken_pool_requeues_job_and_recreates_pool(tmp_path, monkeypatch, make_pdf, make_signature):
+    dispatcher = jobs.JobDispatcher(workers=1)
+    broken = BrokenExecutor()
+    with dispatcher._lock:
+        dispatcher._executor = broken
+    monkeypatch.setattr(jobs, 'get_dispatcher', lambda: dispatcher)
+
+    input_path = tmp_path / 'contrat.pdf'
+    input_path.write_bytes(make_pdf())
+    output_path = tmp_path / 'signed_contrat.pdf'
+    placement = pdf_engine.Placement(0, 100, 100, 150, 50, 'signature')
+    image = pdf_engine.decode_signature(make_signature())
+    job_id = jobs.enqueue(None, 'abc_contrat.pdf', str(input_path), str(output_path), [placement], {'signature': image})
+
+    job = wait_for_status(job_id, ('done', 'failed'))
+    assert job['status'] == 'done', job['error']
+    assert broken.submitted == 1 and broken.shut_down
+    assert dispatcher._executor is not broken  # Pool recréé
+    stats = dispatcher.stats()
+    assert stats['running'] == 0 and stats['failed'] == 0
+    assert not dispatcher._running_ids
+    assert dispatcher._slots.acquire(blocking=False)  # Place locale rendue
+    dispatcher._slots.release()
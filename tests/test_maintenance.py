@@ -0,0 +1,114 @@
+"""
+Nettoyage périodique : sessions, historique anonyme, uploads et PDF signés
+"""
+import fcntl
+import hashlib
+import os
+import time
+
+import pytest
+
+import maintenance
+from storage import UploadStore
+
+OLD = "datetime('now', '-3 days')"
+BATCH_SIZE = 2  # Plus petit que chaque population : plusieurs lots par étape
+
+def old_file(path, content=b'%PDF-1.4\n'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    stamp = time.time() - 3 * 24 * 3600
+    os.utime(path, (stamp, stamp))
+    return path
+
+@pytest.fixture
+def janitor(tmp_path, fresh_db):
+    store = UploadStore(str(tmp_path / 'uploads'))
+    signed_folder = tmp_path / 'signed'
+    signed_folder.mkdir()
+    return maintenance.Janitor(store, str(signed_folder), batch_size=BATCH_SIZE)
+
+def add_upload(db, store, file_id, content, old):
+    sha256 = hashlib.sha256(content).hexdigest()
+    old_file(store.blob_path(sha256), content)
+    db.add_upload(file_id, sha256, len(content), 1, None, 'contrat.pdf')
+    if old:
+        with db.get_db() as conn:
+            conn.execute(f'UPDATE uploads SET created_at = {OLD} WHERE file_id = ?', (file_id,))
+    return sha256
+
+def test_janitor_purges_in_batches_and_keeps_referenced(janitor, fresh_db, monkeypatch):
+    db = fresh_db
+    store = janitor.upload_store
+    signed = janitor.signed_folder
+    user_id = db.create_user('janitor@example.fr', 'motdepasse123')
+
+    # Sessions : 5 expirées, 1 valide
+    valid_token = db.create_session(user_id)
+    for _ in range(5):
+        db.create_session(user_id)
+    with db.get_db() as conn:
+        conn.execute("UPDATE sessions SET expires_at = datetime('now', '-1 day') WHERE token != ?",
+                     (valid_token,))
+
+    # Historique : 5 signatures anonymes périmées, 1 récente, 1 d'utilisateur ancienne
+    def history(name, user, old):
+        path = old_file(os.path.join(signed, name))
+        db.add_to_history(user, 'contrat.pdf', name, path, 0)
+        if old:
+            with db.get_db() as conn:
+                conn.execute(f'UPDATE signature_history SET created_at = {OLD} WHERE signed_filename = ?',
+                             (name,))
+        return path
+
+    anonymous = [history(f'signed_anon{i}.pdf', None, True) for i in range(5)]
+    recent = history('signed_recent.pdf', None, False)
+    owned = history('signed_owned.pdf', user_id, True)
+    orphan = old_file(os.path.join(signed, 'signed_orphan.pdf'))
+
+    # Uploads : contenu partagé par 3 uploads périmés et 1 récent, 3 contenus périmés seuls
+    shared = add_upload(db, store, 'old_shared0', b'%PDF partage', True)
+    for i in (1, 2):
+        add_upload(db, store, f'old_shared{i}', b'%PDF partage', True)
+    add_upload(db, store, 'recent_shared', b'%PDF partage', False)
+    alone = [add_upload(db, store, f'old_alone{i}', f'%PDF seul {i}'.encode(), True) for i in range(3)]
+
+    batches = []
+    get_expired_uploads = db.get_expired_uploads
+
+    def spy(hours, limit):
+        file_ids = get_expired_uploads(hours, limit)
+        batches.append(len(file_ids))
+        return file_ids
+
+    monkeypatch.setattr(db, 'get_expired_uploads', spy)
+    report = janitor.run()
+
+    assert 'errors' not in report, report
+    assert report['sessions'] == 5
+    assert db.get_user_by_token(valid_token)['id'] == user_id
+
+    assert report['anonymous_history'] == 5
+    assert not any(os.path.exists(path) for path in anonymous)
+    assert os.path.exists(recent) and os.path.exists(owned)
+    assert report['orphan_signed'] == 1 and not os.path.exists(orphan)
+    with db.get_db() as conn:
+        names = {row[0] for row in conn.execute('SELECT signed_filename FROM signature_history')}
+    assert names == {'signed_recent.pdf', 'signed_owned.pdf'}
+
+    assert batches == [BATCH_SIZE, BATCH_SIZE, BATCH_SIZE, 0]  # 6 uploads périmés, par lots de 2
+    assert report['uploads'] == 6 and report['upload_blobs'] == 3
+    assert os.path.exists(store.blob_path(shared))  # Encore référencé par l'upload récent
+    assert db.get_upload_blob(shared)['ref_count'] == 1
+    assert store.resolve('recent_shared') == store.blob_path(shared)
+    assert not any(os.path.exists(store.blob_path(sha256)) for sha256 in alone)
+
+def test_janitor_skips_when_another_process_runs(janitor):
+    with open(maintenance._lock_path(), 'a+') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            assert maintenance.run_locked(janitor) is None
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    assert maintenance.run_locked(janitor) is not None
@@ -0,0 +1,65 @@
+"""
+Optimisation des PDF signés : compactage, linéarisation et signatures suivantes
+"""
+import os
+import subprocess
+import sys
+
+import pikepdf
+import pytest
+
+import optimizer
+import pdf_engine
+
+def sign(input_path, output_path, signature, page=0):
+    placement = pdf_engine.Placement(page, 100, 100, 150, 50, 'signature')
+    return pdf_engine.stamp(str(input_path), str(output_path), [placement],
+                            {'signature': pdf_engine.decode_signature(signature)},
+                            mode='incremental', optimize='off')
+
+@pytest.mark.parametrize('mode', ['compact', 'linearize'])
+def test_optimized_output_is_valid_and_signable(tmp_path, make_pdf, make_signature, mode):
+    source = tmp_path / 'contrat.pdf'
+    source.write_bytes(make_pdf(pages=3))
+    signed = tmp_path / 'signed.pdf'
+    for page in range(3):  # Plusieurs passes : le document grossit à chaque mise à jour
+        sign(signed if page else source, signed, make_signature(), page)
+
+    report = optimizer.optimize(str(signed), mode)
+    assert 'error' not in report, report
+    assert report['linearized'] is (mode == 'linearize')
+    assert not report.get('kept_original')  # Le document a bien été réécrit
+    assert report['bytes_after'] == os.path.getsize(signed)
+    with pikepdf.open(str(signed)) as pdf:
+        assert pdf.check_pdf_syntax() == []
+        assert len(pdf.pages) == 3
+        assert pdf.is_linearized is (mode == 'linearize')
+
+    # Le document optimisé se signe encore par mise à jour incrémentale
+    optimized = signed.read_bytes()
+    resigned = tmp_path / 'resigned.pdf'
+    assert sign(signed, resigned, make_signature(padding=10), page=1).mode == 'incremental'
+    assert resigned.read_bytes().startswith(optimized)
+    with pikepdf.open(str(resigned)) as pdf:
+        assert pdf.check_pdf_syntax() == []
+        assert len(pdf.pages) == 3
+
+def test_linearize_refused_without_pikepdf(tmp_path, make_pdf, monkeypatch):
+    path = tmp_path / 'contrat.pdf'
+    content = make_pdf()
+    path.write_bytes(content)
+    monkeypatch.setattr(optimizer, 'pikepdf', None)
+
+    with pytest.raises(ValueError, match='pikepdf'):
+        optimizer.optimize(str(path), 'linearize')
+    assert path.read_bytes() == content
+    assert optimizer.optimize(str(path), 'compact')['linearized'] is False
+
+def test_linearize_setting_refused_at_startup():
+    """OUTPUT_OPTIMIZE=linearize sans pikepdf : l'import (démarrage) échoue"""
+    code = "import sys; sys.modules['pikepdf'] = None; import optimizer"
+    env = dict(os.environ, OUTPUT_OPTIMIZE='linearize')
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(optimizer.__file__)),
+                            env=env, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'OUTPUT_OPTIMIZE=linearize nécessite pikepdf' in result.stderr
@@ -0,0 +1,79 @@
+"""
+Signature par mise à jour incrémentale : PDF classiques, en flux d'objets,
+linéarisés et pages tournées
+"""
+import io
+
+import pikepdf
+import pypdfium2 as pdfium
+import pytest
+from PIL import Image
+from PyPDF2 import PdfReader
+
+import pdf_engine
+
+PLACEMENT = {'x': 100, 'y': 150, 'width': 180, 'height': 60}
+
+def solid_signature():
+    """Signature pleine (rectangle noir) : toute la zone de placement est encrée"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (300, 100), 'black').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def rewrite(content, **options):
+    """Réenregistre un PDF avec pikepdf (flux d'objets, linéarisation...)"""
+    output = io.BytesIO()
+    with pikepdf.open(io.BytesIO(content)) as pdf:
+        if options.pop('rotate', None):
+            pdf.pages[1].Rotate = 90
+        pdf.save(output, **options)
+    return output.getvalue()
+
+def ink_ratio(path, page_num, x, y, width, height):
+    """Part de pixels sombres dans un rectangle de l'espace affiché (origine en bas à gauche)"""
+    pdf = pdfium.PdfDocument(path)
+    try:
+        image = pdf[page_num].render(scale=1).to_pil().convert('L')
+    finally:
+        pdf.close()
+    top = image.height - (y + height)
+    region = image.crop((x + 5, top + 5, x + width - 5, top + height - 5))
+    pixels = list(region.getdata())
+    return sum(1 for value in pixels if value < 64) / len(pixels)
+
+@pytest.mark.parametrize('variant', ['plain', 'object_streams', 'linearized', 'rotated'])
+def test_incremental_stamp(tmp_path, make_pdf, variant):
+    content = make_pdf(pages=3)
+    if variant == 'object_streams':
+        content = rewrite(content, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+        assert b'/ObjStm' in content
+    elif variant == 'linearized':
+        content = rewrite(content, linearize=True)
+        assert b'/Linearized' in content[:1024]
+    elif variant == 'rotated':
+        content = rewrite(content, rotate=True)
+    input_path = tmp_path / 'contrat.pdf'
+    input_path.write_bytes(content)
+    output_path = tmp_path / 'signed.pdf'
+
+    placement = pdf_engine.Placement(1, PLACEMENT['x'], PLACEMENT['y'], PLACEMENT['width'],
+                                     PLACEMENT['height'], 'signature')
+    result = pdf_engine.stamp(str(input_path), str(output_path), [placement],
+                              {'signature': solid_signature()}, mode='incremental', optimize='off')
+
+    assert result.mode == 'incremental'
+    signed = output_path.read_bytes()
+    assert signed.startswith(content)  # Octets d'origine intacts : mise à jour ajoutée à la suite
+    assert len(signed) > len(content)
+
+    reader = PdfReader(str(output_path))
+    assert len(reader.pages) == 3
+    with pikepdf.open(str(output_path)) as pdf:
+        assert pdf.check_pdf_syntax() == []
+        if variant == 'rotated':
+            assert int(pdf.pages[1].Rotate) == 90
+
+    # Signature sur la page demandée, et seulement sur celle-ci
+    assert ink_ratio(str(output_path), 1, **PLACEMENT) > 0.9
+    for other in (0, 2):
+        assert ink_ratio(str(output_path), other, **PLACEMENT) < 0.01
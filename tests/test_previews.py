@@ -0,0 +1,23 @@
+"""
+Prévisualisation des pages : cache disque, ETag et validation
+"""
+
+def test_preview_etag_and_page_range(client, upload, make_pdf):
+    file_id = upload(make_pdf(pages=2))
+
+    response = client.get(f'/api/preview/{file_id}/1?dpi=72')
+    assert response.status_code == 200, response.data
+    assert response.mimetype == 'image/png'
+    assert response.data.startswith(b'\x89PNG')
+    etag = response.headers['ETag']
+
+    response = client.get(f'/api/preview/{file_id}/1?dpi=72', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert not response.data
+
+    response = client.get(f'/api/preview/{file_id}/2?dpi=72')
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+def test_preview_unknown_file(client):
+    assert client.get('/api/preview/inconnu_contrat.pdf/0').status_code == 404
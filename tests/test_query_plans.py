@@ -0,0 +1,104 @@
+"""
+Plans des requêtes de database.py : chaque requête doit utiliser un index
+
+La base est remplie (--plan-rows lignes d'historique, 20 000 par défaut)
+puis les fonctions de database.py sont appelées en capturant le SQL
+réellement exécuté : aucun SCAN de table, aucun tri temporaire. Sur une
+base de plusieurs millions de lignes :
+
+    python -m pytest tests/test_query_plans.py --plan-rows 2000000 --plan-users 20000
+"""
+import pytest
+
+import database as db
+
+def seed(conn, rows, users):
+    """Remplit la base : utilisateurs, sessions, signatures et historique"""
+    conn.executemany(
+        'INSERT INTO users (id, email, password_hash, name) VALUES (?, ?, ?, ?)',
+        ((i, f'user{i}@exemple.fr', 'x:y', f'Utilisateur {i}') for i in range(1, users + 1))
+    )
+    conn.executemany(
+        "INSERT INTO sessions (user_id, token, expires_at) VALUES (?, ?, datetime('now', ?))",
+        ((i % users + 1, f'token-{i}', f'{(i % 14) - 7} days') for i in range(users * 2))
+    )
+    conn.executemany(
+        'INSERT INTO saved_signatures (user_id, name, signature_data) VALUES (?, ?, ?)',
+        ((i % users + 1, f'signature {i}', 'data:image/png;base64,') for i in range(users * 3))
+    )
+    # Un quart de l'historique est anonyme (user_id NULL)
+    conn.executemany(
+        '''INSERT INTO signature_history
+           (user_id, original_filename, signed_filename, file_path, signature_page, created_at)
+           VALUES (?, ?, ?, ?, 0, datetime('now', ?))''',
+        ((None if i % 4 == 0 else i % users + 1, 'document.pdf', f'signed_{i}.pdf',
+          f'signed/signed_{i}.pdf', f'-{i % 72} hours') for i in range(rows))
+    )
+    conn.commit()
+    conn.execute('ANALYZE')
+
+def capture(calls):
+    """Exécute les appels et retourne le SQL émis par chacun"""
+    statements = []
+    with db.get_db() as conn:
+        conn.set_trace_callback(statements.append)  # Connexion unique du pool
+    captured = {}
+    try:
+        for name, call in calls:
+            statements.clear()
+            call()
+            captured[name] = [sql for sql in statements
+                              if sql.lstrip().upper().startswith(('SELECT', 'DELETE', 'UPDATE'))]
+    finally:
+        with db.get_db() as conn:
+            conn.set_trace_callback(None)
+    return captured
+
+def check_plan(conn, sql):
+    """Retourne (détails du plan, problèmes détectés)"""
+    plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+    problems = [detail for detail in plan
+                if (detail.startswith('SCAN') and 'USING' not in detail)
+                or 'TEMP B-TREE' in detail]
+    return plan, problems
+
+def calls(users):
+    user_id = users // 2
+    return [
+        ('get_user_history', lambda: db.get_user_history(user_id)),
+        ('get_user_history (page suivante)',
+         lambda: db.get_user_history(user_id, 50, ('2000-01-01 00:00:00', 10 ** 9), {'id'})),
+        ('count_user_history', lambda: db.count_user_history(user_id)),
+        ('get_history_entry', lambda: db.get_history_entry(user_id, 12345)),
+        ('get_user_signatures', lambda: db.get_user_signatures(user_id)),
+        ('get_user_by_token', lambda: db.get_user_by_token('token-42')),
+        ('get_referenced_signed_files', lambda: db.get_referenced_signed_files(['signed_7.pdf'])),
+        ('delete_expired_sessions', lambda: db.delete_expired_sessions(100)),
+        ('clean_old_files', lambda: db.clean_old_files(48, 100)),
+    ]
+
+CALL_NAMES = [name for name, _ in calls(2)]
+
+@pytest.fixture(scope='module')
+def captured(request, tmp_path_factory, application):
+    """SQL émis par chaque fonction sur une base remplie (une fois pour le module)"""
+    rows = request.config.getoption('--plan-rows')
+    users = request.config.getoption('--plan-users')
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        path = str(tmp_path_factory.mktemp('plans') / 'plans.db')
+        monkeypatch.setattr(db, 'DATABASE_PATH', path)
+        # Une seule connexion dans le pool : le SQL de chaque fonction y est capturé
+        monkeypatch.setattr(db, '_pool', db.ConnectionPool(path, max_size=1))
+        db.init_db()
+        with db.get_db() as conn:
+            seed(conn, rows, users)
+        queries = capture(calls(users))
+        with db.get_db() as conn:
+            yield {name: [(sql, *check_plan(conn, sql)) for sql in statements]
+                   for name, statements in queries.items()}
+
+@pytest.mark.parametrize('name', CALL_NAMES)
+def test_query_uses_index(captured, name):
+    assert captured[name], f'{name} : aucune requête capturée'
+    for sql, plan, problems in captured[name]:
+        assert not problems, f"{name} : {' / '.join(plan)}\n{sql}"
@@ -0,0 +1,145 @@
+"""
+Tests de non-régression des corrections de revue
+
+Identité du client derrière le proxy, rejeu des tokens reCAPTCHA,
+conversion de la position et de la page de /api/sign, migration d'une base
+restée en user_version 3.
+"""
+import pytest
+
+import admission
+import database as db
+import pdf_engine
+import recaptcha
+import signatures
+
+PROXY_ADDR = '172.18.0.2'  # Traefik, sur le réseau Docker
+
+# ============================================
+# Identité du client derrière Traefik
+# ============================================
+
+def test_proxy_clients_have_separate_buckets(client, monkeypatch):
+    """Chaque client relayé par le proxy a son propre seau (et non celui du proxy)"""
+    monkeypatch.setitem(admission.RATES, 'auth', (1.0, 1 / 60))
+
+    def login(client_ip):
+        return client.post('/api/login', json={}, environ_base={'REMOTE_ADDR': PROXY_ADDR},
+                           headers={'X-Forwarded-For': client_ip})
+
+    assert login('203.0.113.7').status_code == 400
+    assert login('203.0.113.7').status_code == 429
+    assert login('198.51.100.23').status_code == 400
+
+    keys = {row[0] for row in admission.store._connect().execute('SELECT key FROM buckets')}
+    assert {'auth:ip:203.0.113.7', 'auth:ip:198.51.100.23'} <= keys
+    assert f'auth:ip:{PROXY_ADDR}' not in keys
+
+# ============================================
+# Rejeu des tokens reCAPTCHA
+# ============================================
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+def test_recaptcha_token_is_accepted_once(monkeypatch):
+    client = recaptcha.RecaptchaClient(secret_key='secret', verify_url='http://recaptcha.invalid/siteverify')
+    calls = []
+
+    def post(url, data, timeout):
+        calls.append(data['response'])
+        return FakeResponse({'success': True, 'score': 0.9})
+
+    monkeypatch.setattr(client.session, 'post', post)
+
+    assert client.verify('token-1') is True
+    assert client.verify('token-1') is False  # Rejeu : refusé sans appeler l'API
+    assert client.verify('token-2') is True
+    assert calls == ['token-1', 'token-2']
+    assert client.stats()['cached'] == 1
+
+def test_recaptcha_rejected_token_stays_rejected(monkeypatch):
+    client = recaptcha.RecaptchaClient(secret_key='secret', verify_url='http://recaptcha.invalid/siteverify')
+    monkeypatch.setattr(client.session, 'post',
+                        lambda url, data, timeout: FakeResponse({'success': True, 'score': 0.1}))
+
+    assert client.verify('bot-token') is False
+    assert client.verify('bot-token') is False
+
+# ============================================
+# Position et page de /api/sign
+# ============================================
+
+@pytest.mark.parametrize('position, page', [
+    ({'x': 'gauche', 'y': 100}, 0),
+    ({'x': 100, 'y': 100, 'width': [150]}, 0),
+    ({'x': 100, 'y': 100}, 'première'),
+    ({'x': 100, 'y': 100}, 1.5),
+])
+def test_sign_rejects_invalid_placement(client, file_id, make_signature, position, page):
+    response = client.post('/api/sign', json={'file_id': file_id, 'signature': make_signature(),
+                                              'page': page, 'position': position})
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+def test_sign_converts_string_placement(client, file_id, make_signature):
+    response = client.post('/api/sign', json={
+        'file_id': file_id,
+        'signature': make_signature(),
+        'page': '0',
+        'position': {'x': '100', 'y': '120.5', 'width': '150', 'height': '50'},
+    })
+    assert response.status_code == 200, response.json
+
+    with db.get_db() as conn:
+        row = conn.execute(
+            'SELECT signature_page, typeof(signature_page) FROM signature_history WHERE signed_filename = ?',
+            (response.json['signed_file_id'],)
+        ).fetchone()
+    assert tuple(row) == (0, 'integer')
+
+# ============================================
+# Migration d'une base en user_version 3
+# ============================================
+
+def test_migration_from_version_3(tmp_path, monkeypatch, make_signature):
+    monkeypatch.setattr(db, 'DATABASE_PATH', str(tmp_path / 'v3.db'))
+    signature_data = make_signature()
+
+    monkeypatch.setattr(db, 'MIGRATIONS', db.MIGRATIONS[:2])
+    db.init_db()
+    with db.get_db() as conn:
+        conn.execute("INSERT INTO users (email, password_hash) VALUES ('v3@example.fr', 'x')")
+        conn.execute("INSERT INTO saved_signatures (user_id, name, signature_data) VALUES (1, 'Paraphe', ?)",
+                     (signature_data,))
+
+    monkeypatch.undo()
+    monkeypatch.setattr(db, 'DATABASE_PATH', str(tmp_path / 'v3.db'))
+    monkeypatch.setattr(db, 'MIGRATIONS', db.MIGRATIONS[:3])
+    db.init_db()
+    with db.get_db() as conn:
+        assert db.schema_version(conn) == 3
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(signature_blobs)')}
+        assert 'content_box' not in columns  # Migration 3 telle que publiée
+
+    monkeypatch.undo()
+    monkeypatch.setattr(db, 'DATABASE_PATH', str(tmp_path / 'v3.db'))
+    db.init_db()
+    with db.get_db() as conn:
+        assert db.schema_version(conn) == db.MIGRATIONS[-1][0]
+        blob = conn.execute('SELECT content_box, ref_count FROM signature_blobs').fetchone()
+    assert tuple(blob) == (None, 1)  # Contenu migré en v3 : cadre complet
+
+    image = signatures.load(1, 1)
+    assert image is not None and image.box == pdf_engine.FULL_FRAME
+
+    db.init_db()  # Redémarrage : aucune migration rejouée
+    with db.get_db() as conn:
+        assert db.migrate(conn) == []
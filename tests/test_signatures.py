@@ -0,0 +1,66 @@
+"""
+Signatures sauvegardées : contenus dédoublonnés, cadre propre à chaque signature
+"""
+import json
+
+import pytest
+
+import database as db
+import pdf_engine
+import signatures
+
+@pytest.fixture
+def user_id(fresh_db):
+    with fresh_db.get_db() as conn:
+        return conn.execute("INSERT INTO users (email, password_hash) VALUES ('sig@example.fr', 'x')").lastrowid
+
+def test_same_ink_different_padding_keeps_each_box(fresh_db, user_id, make_signature):
+    tight = signatures.save(user_id, 'serrée', make_signature(padding=0))
+    padded = signatures.save(user_id, 'avec marges', make_signature(padding=60))
+
+    # Même encre : un seul contenu, référencé deux fois
+    with db.get_db() as conn:
+        blobs = conn.execute('SELECT sha256, ref_count FROM signature_blobs').fetchall()
+    assert [row['ref_count'] for row in blobs] == [2]
+
+    tight_image = signatures.load(tight, user_id)
+    padded_image = signatures.load(padded, user_id)
+    assert tight_image.data == padded_image.data
+    assert tight_image.box != padded_image.box
+
+    # Chaque signature est placée selon son propre cadre
+    placement = pdf_engine.Placement(0, 100, 100, 200, 100, 'signature')
+    tight_box = pdf_engine._place_in_box(placement, tight_image.box)
+    padded_box = pdf_engine._place_in_box(placement, padded_image.box)
+    assert padded_box.width < tight_box.width and padded_box.x > tight_box.x
+
+    # Supprimer l'une ne change ni le contenu ni le cadre de l'autre
+    assert db.delete_signature(tight, user_id)
+    assert signatures.load(padded, user_id).box == padded_image.box
+
+def test_migration_copies_box_to_saved_signatures(tmp_path, monkeypatch, application, make_signature):
+    monkeypatch.setattr(db, 'DATABASE_PATH', str(tmp_path / 'v5.db'))
+    monkeypatch.setattr(db, 'MIGRATIONS', [m for m in db.MIGRATIONS if m[0] <= 5])
+    db.init_db()
+    image = signatures.normalize(make_signature(padding=30))
+    with db.get_db() as conn:
+        user = conn.execute("INSERT INTO users (email, password_hash) VALUES ('v5@example.fr', 'x')").lastrowid
+        # Écriture telle qu'en version 5 : cadre porté par le contenu
+        conn.execute(
+            '''INSERT INTO signature_blobs
+               (sha256, data, width, height, size, original_size, thumbnail, content_box, ref_count)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)''',
+            (image.sha256, image.data, image.width, image.height, len(image.data),
+             image.original_size, image.thumbnail, json.dumps(image.box))
+        )
+        signature_id = conn.execute(
+            "INSERT INTO saved_signatures (user_id, name, signature_data, blob_sha256) VALUES (?, 's', '', ?)",
+            (user, image.sha256)
+        ).lastrowid
+
+    monkeypatch.undo()
+    monkeypatch.setattr(db, 'DATABASE_PATH', str(tmp_path / 'v5.db'))
+    db.init_db()
+    with db.get_db() as conn:
+        assert db.schema_version(conn) >= 6
+    assert signatures.load(signature_id, user).box == pytest.approx(image.box)
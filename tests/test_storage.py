@@ -0,0 +1,38 @@
+"""
+Stockage des uploads adressé par contenu : dédoublonnage et comptage de références
+"""
+import hashlib
+import os
+
+import app as appmod
+import database as db
+
+def test_identical_uploads_share_one_blob(upload, make_pdf):
+    content = make_pdf(pages=2)
+    sha256 = hashlib.sha256(content).hexdigest()
+    store = appmod.upload_store
+
+    first = upload(content, 'contrat.pdf')
+    second = upload(content, 'copie.pdf')
+    other = upload(make_pdf(pages=3), 'autre.pdf')
+    assert first != second
+
+    blob_path = store.blob_path(sha256)
+    assert store.resolve(first) == store.resolve(second) == blob_path
+    assert store.resolve(other) != blob_path
+    assert db.get_upload_blob(sha256)['ref_count'] == 2
+    with open(blob_path, 'rb') as f:
+        assert f.read() == content
+
+    # Suppression d'un upload : le contenu reste pour l'autre
+    assert store.release(first) is False
+    assert store.resolve(first) is None
+    assert os.path.isfile(blob_path)
+    assert store.resolve(second) == blob_path
+    assert db.get_upload_blob(sha256)['ref_count'] == 1
+
+    # Dernière référence : le contenu est effacé
+    assert store.release(second) is True
+    assert not os.path.exists(blob_path)
+    assert db.get_upload_blob(sha256) is None
+    assert store.resolve(other) is not None
@@ -0,0 +1,146 @@
+"""
+Réception des fichiers uploadés en flux
+
+Werkzeug écrit normalement chaque fichier dans un fichier temporaire (ou en
+mémoire) avant que la route ne le recopie dans uploads/ puis le relise. Ici,
+chaque morceau reçu est directement haché, compté et écrit dans un fichier
+partiel du dossier de destination ; l'en-tête %PDF- est vérifié dès les
+premiers octets et la route n'a plus qu'à renommer le fichier validé.
+"""
+import hashlib
+import os
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+HEAD_SIZE = 1024  # Le marqueur %PDF- doit apparaître dans les 1024 premiers octets
+# Marqueur attendu dans l'en-tête selon l'extension, et message en cas d'absence
+HEAD_MARKERS = {
+    'pdf': (b'%PDF-', 'Le fichier n\'est pas un PDF valide'),
+    'zip': (b'PK\x03\x04', 'Le fichier n\'est pas une archive ZIP valide'),
+}
+PARTIAL_PREFIX = '.upload-'
+PARTIAL_SUFFIX = '.part'
+BULK_PREFIX = '.bulk-'  # Dossier de travail d'une signature en masse (bulk.py)
+
+class IngestStream:
+    """Flux d'écriture d'un fichier uploadé : SHA-256, taille et en-tête calculés au fil de l'eau"""
+
+    def __init__(self, folder, max_bytes, filename=None, allowed_extensions=None):
+        self.max_bytes = max_bytes
+        self.filename = filename
+        self.size = 0
+        self.head = b''
+        self.rejected = None
+        self.committed = False
+        self._sha256 = hashlib.sha256()
+        extension = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+        self.marker, self.invalid_reason = HEAD_MARKERS.get(extension, HEAD_MARKERS['pdf'])
+        if allowed_extensions is not None and extension not in allowed_extensions:
+            # Type refusé : le contenu est lu mais jamais écrit sur disque
+            self.rejected = 'Type de fichier non autorisé'
+            self.path = None
+            self._file = tempfile.SpooledTemporaryFile(max_size=0)
+        else:
+            fd, self.path = tempfile.mkstemp(dir=folder, prefix=PARTIAL_PREFIX, suffix=PARTIAL_SUFFIX)
+            self._file = os.fdopen(fd, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge()
+        if self.rejected:
+            return len(data)
+        if len(self.head) < HEAD_SIZE:
+            self.head += data[:HEAD_SIZE - len(self.head)]
+            if len(self.head) >= HEAD_SIZE and self.marker not in self.head:
+                self._reject(self.invalid_reason)
+                return len(data)
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    def _reject(self, reason):
+        """Abandonne l'écriture : le reste du corps est ignoré"""
+        self.rejected = reason
+        self._file.truncate(0)
+
+    def finish(self):
+        """Termine la réception et vérifie l'en-tête (fichiers de moins de HEAD_SIZE octets)"""
+        if not self.rejected and self.marker not in self.head:
+            self._reject(self.invalid_reason)
+        self._file.flush()
+        self._file.seek(0)
+
+    @property
+    def file(self):
+        """Fichier partiel ouvert (lecture)"""
+        return self._file
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def commit(self, destination):
+        """Renomme le fichier partiel validé vers sa destination finale"""
+        self._file.close()
+        os.replace(self.path, destination)
+        self.path = destination
+        self.committed = True
+
+    def close(self):
+        """Ferme le flux et supprime le fichier partiel s'il n'a pas été validé"""
+        if not self._file.closed:
+            self._file.close()
+        if not self.committed and self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def __del__(self):
+        self.close()
+
+class IngestRequest(Request):
+    """Requête Flask dont les fichiers sont écrits en flux dans ingest_folder
+
+    Les routes de bulk_paths (envoi en masse) acceptent aussi des archives
+    ZIP et un corps de requête jusqu'à bulk_max_bytes.
+    """
+
+    ingest_folder = 'uploads'
+    ingest_max_bytes = 16 * 1024 * 1024
+    allowed_extensions = None
+    bulk_paths = frozenset()
+    bulk_max_bytes = 512 * 1024 * 1024
+
+    @property
+    def is_bulk(self):
+        return self.path in self.bulk_paths
+
+    @property
+    def max_content_length(self):
+        if self.is_bulk:
+            return self.bulk_max_bytes
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.is_bulk:
+            extensions = None if self.allowed_extensions is None else self.allowed_extensions | {'zip'}
+            is_zip = bool(filename) and filename.lower().endswith('.zip')
+            max_bytes = self.bulk_max_bytes if is_zip else self.ingest_max_bytes
+            return IngestStream(self.ingest_folder, max_bytes, filename, extensions)
+        return IngestStream(self.ingest_folder, self.ingest_max_bytes, filename, self.allowed_extensions)